@@ -4,7 +4,7 @@
 Run directly for development:
     DATA_DIR=./data python3 app.py
 In production (add-on / Docker) gunicorn imports `app` from this module.
-Keep a single worker process: real-time SSE uses an in-process event bus.
+More than one worker needs EVENT_BUS=table (run.sh sets it for WORKERS > 1).
 """
 from backend import create_app
 from backend.config import PORT
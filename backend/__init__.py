@@ -4,14 +4,18 @@ import secrets
 
 from flask import Flask, jsonify, send_from_directory
 
-from .config import DATA_DIR, WEB_DIST
-from .db import db
+from .config import DATA_DIR, DATABASE_URL, WEB_DIST
+from .db import db, engine_options
 
 
 def _load_secret_key():
-    """Persist a random secret key in the data dir so sessions survive restarts."""
+    """Persist a random secret key in the data dir so sessions survive restarts.
+    Locked so the workers of a first boot all end up with the same key."""
+    from . import proclock
     path = os.path.join(DATA_DIR, '.secret_key')
+    lock = None
     try:
+        lock = proclock.acquire('secret_key')
         if os.path.exists(path):
             with open(path) as f:
                 key = f.read().strip()
@@ -24,15 +28,22 @@ def _load_secret_key():
         return key
     except OSError:
         return secrets.token_hex(32)
+    finally:
+        if lock is not None:
+            lock.close()
 
 
-def create_app():
+def create_app(background=True):
+    """The Flask app. background=False leaves out the deferred-work, email
+    and scheduler threads: for processes that sit next to gunicorn's (the SSE
+    gateway) or run one job and exit (the command-line tools)."""
     os.makedirs(DATA_DIR, exist_ok=True)
     os.makedirs(os.path.join(DATA_DIR, 'uploads'), exist_ok=True)
 
     app = Flask(__name__, static_folder=None)
     app.config['SECRET_KEY'] = _load_secret_key()
-    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(DATA_DIR, 'taskmaster.db')}"
+    app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(DATABASE_URL)
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024
     app.config['SESSION_COOKIE_HTTPONLY'] = True
@@ -47,19 +58,36 @@ def create_app():
     db.init_app(app)
 
     from . import models  # noqa: F401  (register models)
-    with app.app_context():
-        db.create_all()
-        from .migrate_v4 import ensure_schema, migrate_v4_data
-        ensure_schema()  # column additions must precede any ORM queries
-        from .migrate_v2 import migrate_v2_if_needed
-        migrate_v2_if_needed()
-        migrate_v4_data()
+    from . import changefeed  # noqa: F401  (register the change-log listener)
+    from . import search  # registers the search-index listener
+    from . import automations  # noqa: F401  (register the rule-table invalidation)
+    from . import counters  # registers the board-counter listener
+    from . import proclock
+    startup = proclock.acquire('startup')  # workers migrate one at a time
+    try:
+        with app.app_context():
+            from .migrations import run_migrations
+            run_migrations()
+            search.enable()
+            counters.enable()
+    finally:
+        startup.close()
 
     from .api import register_blueprints
     register_blueprints(app)
 
-    from .scheduler import start_scheduler
-    start_scheduler(app)
+    from . import bus
+    bus.start(app)
+
+    if background:
+        from . import deferred
+        deferred.start(app)
+
+        from . import emailer
+        emailer.start(app)
+
+        from .scheduler import start_scheduler
+        start_scheduler(app)
 
     @app.before_request
     def api_guards():
@@ -72,7 +100,7 @@ def create_app():
         if request.method not in ('POST', 'PUT', 'DELETE', 'PATCH'):
             return None
         # viewers may still authenticate, manage session basics, and submit requests
-        for allowed in ('/api/auth/', '/api/notifications/read', '/api/requests'):
+        for allowed in ('/api/auth/', '/api/notifications/read', '/api/requests', '/api/events/'):
             if request.path.startswith(allowed):
                 return None
         if u and not perm.can_write(u):
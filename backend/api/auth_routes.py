@@ -5,6 +5,7 @@ from datetime import datetime, timedelta
 from flask import Blueprint, jsonify, request, session
 from werkzeug.security import check_password_hash, generate_password_hash
 
+from .. import bus, digests
 from .. import permissions as perm
 from ..auth import current_user, login_required, start_session
 from ..db import db
@@ -115,16 +116,15 @@ def forgot_password():
                              User.password_hash.isnot(None)).first()
     if user:
         token = issue_token(user, 'reset')
-        db.session.commit()
-        from flask import current_app
-        emailer.send_async(
-            current_app._get_current_object(), user.email,
+        emailer.queue(
+            user.email,
             'Reset your TaskMaster password',
             f'Hi {user.display_name},\n\n'
             f'Someone (hopefully you) asked to reset your TaskMaster password.\n'
             f'Click the link below to choose a new one. The link works once and '
             f'expires in 1 hour.\n\n{_link_base()}/?reset={token}\n\n'
             f'If this wasn\'t you, you can ignore this email - nothing changes.')
+        db.session.commit()
     return jsonify({'ok': True, 'message': 'If that email belongs to an account, a reset link is on its way.'})
 
 
@@ -246,6 +246,7 @@ def setup():
 
 
 # Brute-force protection: 5 failed tries per username locks it for 15 minutes.
+# Failures are shared with the other workers over the bus.
 _FAILED_LOGINS = {}
 LOCKOUT_TRIES = 5
 LOCKOUT_WINDOW = 15 * 60
@@ -261,7 +262,22 @@ def _login_blocked(key):
 
 def _login_failed(key):
     import time as _t
-    _FAILED_LOGINS.setdefault(key, []).append(_t.time())
+    bus.send('login_failed', {'key': key, 'at': _t.time()})
+
+
+def _login_succeeded(key):
+    if _FAILED_LOGINS.get(key):  # failures reach every worker, so empty here means none
+        bus.send('login_succeeded', {'key': key})
+
+
+@bus.handler('login_failed')
+def _on_login_failed(msg):
+    _FAILED_LOGINS.setdefault(msg['key'], []).append(msg['at'])
+
+
+@bus.handler('login_succeeded')
+def _on_login_succeeded(msg):
+    _FAILED_LOGINS.pop(msg['key'], None)
 
 
 @bp.post('/login')
@@ -283,7 +299,7 @@ def login():
     if not local_ok:
         _login_failed(username)
         return jsonify({'error': 'Invalid username or password'}), 401
-    _FAILED_LOGINS.pop(username, None)
+    _login_succeeded(username)
     if user.totp_secret:
         code = (data.get('totp') or '').strip()
         if not code:
@@ -357,6 +373,8 @@ def change_password(user):
 @login_required
 def update_profile(user):
     data = request.json or {}
+    if 'email_digest' in data and data['email_digest'] not in digests.MODES:
+        return jsonify({'error': 'Choose immediate, hourly or daily emails'}), 400
     if 'display_name' in data and data['display_name'].strip():
         user.display_name = data['display_name'].strip()
     if 'color' in data:
@@ -367,6 +385,8 @@ def update_profile(user):
         user.hide_done = bool(data['hide_done'])
     if 'email_notifications' in data:
         user.email_notifications = bool(data['email_notifications'])
+    if 'email_digest' in data:
+        digests.set_mode(user, data['email_digest'])
     db.session.commit()
     return jsonify({'user': _user_payload(user)})
 
@@ -6,12 +6,13 @@ from .. import ha
 from .. import permissions as perm
 from ..auth import login_required
 from ..db import db
+from ..jsonstream import stream_json
 from ..models import (Activity, Board, BoardColumn, BoardGroup, Department,
                       Item, User)
 from ..services import (COLUMN_DEFAULT_WIDTH, DEFAULT_COLUMN_SETTINGS,
                         GROUP_COLORS, broadcast_board,
                         create_default_board_layout, log_activity,
-                        serialize_board_full)
+                        serialize_board_changes, serialize_board_full)
 
 bp = Blueprint('boards', __name__, url_prefix='/api')
 
@@ -93,10 +94,26 @@ def get_board(user, board_id):
     if not access:
         return jsonify({'error': 'You do not have access to this board'}), 403
     visible = perm.visible_item_ids(user, board)
-    payload = serialize_board_full(board, visible_ids=visible, access=access)
+    payload = serialize_board_full(board, visible_ids=visible, access=access, stream=True)
     dept = db.session.get(Department, board.department_id) if board.department_id else None
     payload['department'] = dept.to_dict() if dept else None
-    return jsonify(payload)
+    return stream_json(payload)
+
+
+@bp.get('/boards/<int:board_id>/changes')
+@login_required
+def board_changes(user, board_id):
+    """Delta since ?since=<cursor> (the `cursor` of the last board payload).
+    Assignable users are not part of the delta; reload the board for those."""
+    board, access = _board_or_403(user, board_id)
+    if not access:
+        return jsonify({'error': 'You do not have access to this board'}), 403
+    try:
+        since = int(request.args.get('since', ''))
+    except ValueError:
+        return jsonify({'error': 'since must be a change cursor'}), 400
+    visible = perm.visible_item_ids(user, board)
+    return jsonify(serialize_board_changes(board, since, visible_ids=visible, access=access))
 
 
 @bp.put('/boards/<int:board_id>')
@@ -215,10 +232,10 @@ def list_items_lite(user, board_id):
     colors = {}
     if status_col and items:
         labels = {l['id']: l['color'] for l in status_col.settings_dict().get('labels', [])}
-        for v in ItemValue.query.filter(
+        for item_id, label_id in db.session.query(ItemValue.item_id, ItemValue.label_id).filter(
                 ItemValue.column_id == status_col.id,
-                ItemValue.item_id.in_([i.id for i in items])).all():
-            colors[v.item_id] = labels.get(v.value_dict().get('id'))
+                ItemValue.item_id.in_([i.id for i in items])):
+            colors[item_id] = labels.get(label_id)
     return jsonify({'items': [
         {'id': i.id, 'name': i.name, 'color': colors.get(i.id)} for i in items
     ]})
@@ -348,8 +365,9 @@ def delete_column(user, column_id):
     if not perm.can_edit_board(user, board):
         return jsonify({'error': 'No permission to edit this board'}), 403
     board_id = col.board_id
-    from ..models import ItemValue, NotificationRule
+    from ..models import ItemAssignee, ItemValue, NotificationRule
     ItemValue.query.filter_by(column_id=col.id).delete(synchronize_session=False)
+    ItemAssignee.query.filter_by(column_id=col.id).delete(synchronize_session=False)
     NotificationRule.query.filter_by(column_id=col.id).delete(synchronize_session=False)
     log_activity(user.id, board_id, None, 'column_deleted', f'deleted column "{col.title}"')
     db.session.delete(col)
@@ -7,15 +7,16 @@ from datetime import datetime
 from flask import Blueprint, jsonify, request, send_from_directory
 from werkzeug.utils import secure_filename
 
-from .. import ha
+from .. import deferred
 from .. import permissions as perm
 from ..auth import login_required
 from ..config import ALLOWED_EXTENSIONS, UPLOAD_DIR
 from ..db import db
 from ..models import (Activity, AutomationRule, Board, BoardColumn, BoardGroup,
                       FileAsset, Item, ItemUpdate, ItemValue, JobTemplate, User)
-from ..services import (apply_template, broadcast_board, log_activity,
-                        notify_user, people_column_user_ids, purge_items)
+from ..services import (add_assignee, apply_template, broadcast_board,
+                        log_activity, notify_user, notify_users,
+                        people_column_user_ids, purge_items, sync_assignees)
 
 bp = Blueprint('items', __name__, url_prefix='/api')
 
@@ -82,26 +83,15 @@ def create_item(user, board_id):
         people_col = (BoardColumn.query.filter_by(board_id=board.id, type='people')
                       .order_by(BoardColumn.position).first())
         if people_col:
-            existing = ItemValue.query.filter_by(item_id=item.id, column_id=people_col.id).first()
-            ids = set((existing.value_dict().get('user_ids') if existing else None) or [])
-            ids.add(assignee_id)
-            payload = json.dumps({'user_ids': sorted(ids)})
-            if existing:
-                existing.value = payload
-            else:
-                db.session.add(ItemValue(item_id=item.id, column_id=people_col.id, value=payload))
-            notify_user(assignee_id, user.id, 'assigned', board.id, item.id,
-                        f'{user.display_name} assigned you to "{item.name}" on {board.name}')
-
-    if parent is None:
-        from ..services import run_automations
-        run_automations('created', board, item, user.id)
+            add_assignee(item.id, people_col.id, assignee_id)
+            notify_users([assignee_id], user.id, 'assigned', board.id, item.id,
+                         f'{user.display_name} assigned you to "{item.name}" on {board.name}')
+
+    # HA event and automations run after the commit (services._after_item_created)
+    deferred.enqueue('item_created', {'item_id': item.id, 'actor_id': user.id,
+                                      'actor_username': user.username})
     db.session.commit()
     broadcast_board(board.id)
-    ha.fire_event('taskmaster_item_created', {
-        'item_id': item.id, 'board_id': board.id,
-        'board': board.name, 'name': name, 'created_by': user.username,
-    })
     return jsonify({'item': item.to_dict(values={}, counts={})}), 201
 
 
@@ -255,6 +245,8 @@ def set_value(user, item_id, column_id):
     else:
         iv = ItemValue(item_id=item.id, column_id=col.id, value=json.dumps(value))
         db.session.add(iv)
+    if col.type == 'people':
+        sync_assignees(item.id, col.id, (value or {}).get('user_ids'))
 
     old_desc = _describe_value(col, old_value)
     new_desc = _describe_value(col, value)
@@ -276,30 +268,20 @@ def set_value(user, item_id, column_id):
                 names = [x.display_name for x in User.query.filter(User.id.in_(bad)).all()]
                 return jsonify({'error': f'{", ".join(names) or "That person"} has no access to this job — grant access first (🔑)'}), 400
         board = Board.query.get(item.board_id)
-        for uid in new_ids - old_ids:
-            notify_user(uid, user.id, 'assigned', item.board_id, item.id,
-                        f'{user.display_name} assigned you to "{item.name}" on {board.name}')
+        notify_users(new_ids - old_ids, user.id, 'assigned', item.board_id, item.id,
+                     f'{user.display_name} assigned you to "{item.name}" on {board.name}')
 
+    if col.type in ('status', 'priority') and old_desc != new_desc:
+        # HA event, assignee notifications and automations run after the
+        # commit (services._after_status_change), not in this request
+        deferred.enqueue('status_changed', {
+            'item_id': item.id, 'column': col.title, 'old': old_desc, 'new': new_desc,
+            'actor_id': user.id, 'actor_name': user.display_name,
+            'actor_username': user.username})
     item.updated_at = datetime.utcnow()
     db.session.commit()
     broadcast_board(item.board_id)
 
-    if col.type in ('status', 'priority') and old_desc != new_desc:
-        board = Board.query.get(item.board_id)
-        ha.fire_event('taskmaster_status_changed', {
-            'item_id': item.id, 'board_id': board.id, 'board': board.name,
-            'name': item.name, 'column': col.title,
-            'old_status': old_desc, 'new_status': new_desc, 'changed_by': user.username,
-        })
-        # Notify assignees about status changes made by someone else
-        for uid in people_column_user_ids(item.id):
-            notify_user(uid, user.id, 'status', item.board_id, item.id,
-                        f'{user.display_name} set {col.title} of "{item.name}" to {new_desc}')
-        # Central automations (notify / set status / assign)
-        from ..services import run_automations
-        run_automations('status', board, item, user.id, new_label_text=new_desc)
-        db.session.commit()
-
     return jsonify({'ok': True, 'value': value})
 
 
@@ -369,19 +351,15 @@ def create_update(user, item_id):
     db.session.add(upd)
     log_activity(user.id, item.board_id, item.id, 'update_posted',
                  f'wrote an update on "{item.name}"')
-    notified = set()
     # @mentions get a direct "flagged you" notification
     mentioned = {m.lower() for m in re.findall(r'@([A-Za-z0-9_.\-]+)', body)}
+    notified = set()
     if mentioned:
-        for u in perm.visible_users(user):
-            if u.username.lower() in mentioned:
-                notify_user(u.id, user.id, 'mention', item.board_id, item.id,
-                            f'{user.display_name} mentioned you on "{item.name}"')
-                notified.add(u.id)
-    for uid in people_column_user_ids(item.id):
-        if uid not in notified:
-            notify_user(uid, user.id, 'update', item.board_id, item.id,
-                        f'{user.display_name} wrote an update on "{item.name}"')
+        notified = {u.id for u in perm.visible_users(user) if u.username.lower() in mentioned}
+        notify_users(notified, user.id, 'mention', item.board_id, item.id,
+                     f'{user.display_name} mentioned you on "{item.name}"')
+    notify_users(people_column_user_ids(item.id) - notified, user.id, 'update',
+                 item.board_id, item.id, f'{user.display_name} wrote an update on "{item.name}"')
     db.session.commit()
     broadcast_board(item.board_id)
     return jsonify({'update': upd.to_dict()}), 201
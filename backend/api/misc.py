@@ -1,12 +1,17 @@
+import base64
+import itertools
+import json
+from datetime import date, datetime
+
 from flask import Blueprint, Response, jsonify, request, stream_with_context
 
-from .. import ha, realtime
+from .. import counters, realtime
 from .. import permissions as perm
 from ..auth import login_required
 from ..db import db
+from ..jsonstream import chunks, stream_json
 from ..models import (Activity, Board, BoardColumn, BoardGroup, Company,
                       Department, Item, ItemValue, Notification, User)
-from ..services import values_for_items
 
 bp = Blueprint('misc', __name__, url_prefix='/api')
 
@@ -14,18 +19,57 @@ bp = Blueprint('misc', __name__, url_prefix='/api')
 @bp.get('/events')
 @login_required
 def events(user):
-    q = realtime.subscribe(user.id)
+    """SSE stream. ?typed=1 opts into row-level events instead of the coarse
+    board_changed hints the bundled frontend refetches on; a typed stream
+    watches the boards in ?boards=1,2 and those added via /events/<id>/boards.
+    A `resync` event means the stream fell behind and dropped events: reload.
+    With the async gateway (sse_gateway.py) in front, it serves this path."""
+    sub = open_stream(user)
+    # don't sit on a pooled connection (and, under WAL, an open read
+    # snapshot that blocks checkpoints) for the life of the stream
+    db.session.close()
 
     def generate():
         try:
-            yield from realtime.sse_stream(q)
+            yield from realtime.sse_stream(sub)
         finally:
-            realtime.unsubscribe(q)
+            realtime.unsubscribe(sub)
 
     return Response(stream_with_context(generate()), mimetype='text/event-stream',
                     headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
+def open_stream(user):
+    """Subscribe a stream as the current request's ?typed= / ?boards= ask."""
+    typed = request.args.get('typed') == '1'
+    boards = []
+    if typed:
+        for raw in (request.args.get('boards') or '').split(','):
+            b = db.session.get(Board, int(raw)) if raw.strip().isdigit() else None
+            if b is not None and perm.board_access(user, b):
+                boards.append(b.id)
+    return realtime.subscribe(user.id, typed=typed, boards=boards)
+
+
+@bp.post('/events/<stream_id>/boards/<int:board_id>')
+@login_required
+def watch_board(user, stream_id, board_id):
+    board = Board.query.get_or_404(board_id)
+    if not perm.board_access(user, board):
+        return jsonify({'error': 'You do not have access to this board'}), 403
+    if not realtime.watch(stream_id, user.id, board.id):
+        return jsonify({'error': 'Unknown event stream'}), 404
+    return jsonify({'ok': True})
+
+
+@bp.delete('/events/<stream_id>/boards/<int:board_id>')
+@login_required
+def unwatch_board(user, stream_id, board_id):
+    if not realtime.unwatch(stream_id, user.id, board_id):
+        return jsonify({'error': 'Unknown event stream'}), 404
+    return jsonify({'ok': True})
+
+
 @bp.get('/notifications')
 @login_required
 def notifications(user):
@@ -49,20 +93,115 @@ def mark_read(user):
     return jsonify({'ok': True})
 
 
+# ---- Item lists (my work, directory): filters + keyset pages ----
+
+SORTS = {  # ?sort= : (key, descending); ties break on id the same way.
+    # Each has a (key, id) index on items, so a page is an index range.
+    'updated': (Item.updated_at, True),
+    'due': (Item.due_date, False),  # undated items come last
+    'name': (Item.name, False),
+}
+PAGE_MAX = 500
+
+
+def _filter_items(query, args):
+    """Narrow an Item query (joined to its Board) by ?status= (label text,
+    any status column), ?company_id= and ?due_from= / ?due_to= (ISO dates,
+    inclusive)."""
+    status = (args.get('status') or '').strip().lower()
+    if status:
+        cols_by_label = {}
+        for col in BoardColumn.query.filter_by(type='status').all():
+            for l in col.settings_dict().get('labels', []):
+                if str(l.get('label', '')).strip().lower() == status and 'id' in l:
+                    cols_by_label.setdefault(l['id'], []).append(col.id)
+        # EXISTS, not IN: checked row by row as the sort index is walked,
+        # instead of first collecting every item with that label. `+ 0`
+        # keeps the check on the item's few values (idx_values_item) rather
+        # than one (item, column) probe per status column in the database.
+        query = query.filter(db.exists().where(ItemValue.item_id == Item.id, db.or_(db.false(), *[
+            db.and_(ItemValue.label_id == label_id, (ItemValue.column_id + 0).in_(cols))
+            for label_id, cols in cols_by_label.items()])))
+    company_id = args.get('company_id', type=int)
+    if company_id:  # on the joined Board, for the same reason
+        depts = db.select(Department.id).where(Department.company_id == company_id)
+        query = query.filter(db.or_(
+            Board.department_id.in_(depts),
+            db.and_(Board.department_id.is_(None), Board.company_id == company_id)))
+    for arg, op in (('due_from', '__ge__'), ('due_to', '__le__')):
+        if args.get(arg):
+            query = query.filter(getattr(Item.due_date, op)(date.fromisoformat(args[arg])))
+    return query
+
+
+def _encode_cursor(value, item_id):
+    value = value.isoformat() if isinstance(value, (date, datetime)) else value
+    return base64.urlsafe_b64encode(json.dumps([value, item_id]).encode()).decode()
+
+
+def _decode_cursor(cursor, sort):
+    value, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if value is not None and sort == 'updated':
+        value = datetime.fromisoformat(value)
+    elif value is not None and sort == 'due':
+        value = date.fromisoformat(value)
+    return value, int(item_id)
+
+
+def _item_page(query, args, lazy=False):
+    """Filter, sort and page an Item query from the request args.
+    ?limit= turns paging on (keyset: ?cursor= is the previous page's
+    next_cursor), so each page costs the same however deep it is; without
+    it every row comes back (lazy=True: as an iterator reading them in
+    batches). Returns (items, next_cursor), or raises ValueError on a bad
+    argument."""
+    sort = args.get('sort', 'updated')
+    if sort not in SORTS:
+        raise ValueError(f'sort must be one of {", ".join(SORTS)}')
+    query = _filter_items(query, args)
+    key, desc = SORTS[sort]
+    order = (key.desc(), Item.id.desc()) if desc else (key.asc(), Item.id.asc())
+    later = '__lt__' if desc else '__gt__'  # "comes after" in this order
+    limit = args.get('limit', type=int)
+    if limit is None:
+        parts = [query.order_by(*order)] if sort != 'due' else [
+            query.filter(key.isnot(None)).order_by(*order),
+            query.filter(key.is_(None)).order_by(Item.id)]
+        if lazy:
+            return itertools.chain.from_iterable(p.yield_per(PAGE_MAX) for p in parts), None
+        return [i for p in parts for i in p.all()], None
+    limit = min(max(limit, 1), PAGE_MAX)
+    after = _decode_cursor(args['cursor'], sort) if args.get('cursor') else None
+    rows = []
+    if after is None or after[0] is not None:
+        page = query.filter(key.isnot(None)) if sort == 'due' else query
+        if after is not None:
+            page = page.filter(getattr(db.tuple_(key, Item.id), later)(db.tuple_(*after)))
+        rows = page.order_by(*order).limit(limit + 1).all()
+    if sort == 'due' and len(rows) <= limit:  # then the undated ones, by id
+        page = query.filter(key.is_(None))
+        if after is not None and after[0] is None:
+            page = page.filter(Item.id > after[1])
+        rows += page.order_by(Item.id).limit(limit + 1 - len(rows)).all()
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    return rows[:limit], _encode_cursor(getattr(last, key.key), last.id)
+
+
 @bp.get('/my-work')
 @login_required
 def my_work(user):
-    """All items across boards where a people column contains the current user."""
-    people_cols = BoardColumn.query.filter_by(type='people').all()
-    col_ids = [c.id for c in people_cols]
-    if not col_ids:
-        return jsonify({'items': [], 'boards': {}, 'columns': []})
-    needle = f'"user_ids"'
-    values = (ItemValue.query.filter(ItemValue.column_id.in_(col_ids),
-                                     ItemValue.value.contains(needle)).all())
-    item_ids = {v.item_id for v in values
-                if user.id in (v.value_dict().get('user_ids') or [])}
-    items = Item.query.filter(Item.id.in_(item_ids)).all() if item_ids else []
+    """Items across boards where a people column contains the current user.
+    Takes the list filters, sort and paging of _item_page. Ships only the
+    status and date columns of the boards involved."""
+    query = (Item.query.join(Board, Board.id == Item.board_id)
+             .filter(Board.archived.is_(False),
+                     Item.id.in_(perm.assigned_items_query(user))))
+    try:
+        items, next_cursor = _item_page(query, request.args)
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid filter, sort or cursor'}), 400
     board_rows = Board.query.filter(Board.id.in_({i.board_id for i in items})).all()
     dept_ids = {b.department_id for b in board_rows if b.department_id}
     depts = ({d.id: d for d in Department.query.filter(Department.id.in_(dept_ids)).all()}
@@ -81,40 +220,62 @@ def my_work(user):
         boards[b.id] = d
     groups = {g.id: g.to_dict() for g in
               BoardGroup.query.filter(BoardGroup.id.in_({i.group_id for i in items})).all()}
-    all_values = values_for_items([i.id for i in items])
-    columns = {}
-    for b_id in boards:
-        cols = (BoardColumn.query.filter_by(board_id=b_id)
-                .order_by(BoardColumn.position).all())
-        columns[str(b_id)] = [c.to_dict() for c in cols]
+    columns = {str(b_id): [] for b_id in boards}
+    shown = []
+    if boards:
+        for c in (BoardColumn.query.filter(BoardColumn.board_id.in_(list(boards)),
+                                           BoardColumn.type.in_(('status', 'date')))
+                  .order_by(BoardColumn.position).all()):
+            columns[str(c.board_id)].append(c.to_dict())
+            shown.append(c.id)
+    all_values = {i.id: {} for i in items}
+    if shown and items:
+        for v in ItemValue.query.filter(ItemValue.item_id.in_(list(all_values)),
+                                        ItemValue.column_id.in_(shown)):
+            all_values[v.item_id][str(v.column_id)] = v.value_dict()
     parent_ids = {i.parent_id for i in items if i.parent_id}
     parent_names = ({p.id: p.name for p in Item.query.filter(Item.id.in_(parent_ids)).all()}
                     if parent_ids else {})
     out_items = []
     for i in items:
-        d = i.to_dict(values=all_values.get(i.id, {}))
+        d = i.to_dict(values=all_values[i.id])
         d['parent_name'] = parent_names.get(i.parent_id)
+        d['done'] = bool(i.done)
+        d['due_date'] = i.due_date.isoformat() if i.due_date else None
         out_items.append(d)
     return jsonify({
         'items': out_items,
         'boards': boards,
         'groups': groups,
         'columns': columns,
+        'next_cursor': next_cursor,
     })
 
 
 @bp.get('/search')
 @login_required
 def search(user):
+    """Ranked search over jobs (name, checklist, text values, updates),
+    companies and board names. ?offset= pages through the jobs; `truncated`
+    says only the newest matches of a very common word were ranked."""
+    from .. import search as fts
     q = (request.args.get('q') or '').strip()
     if len(q) < 2:
-        return jsonify({'items': [], 'boards': []})
-    like = f'%{q}%'
-    items = [i for i in (Item.query.filter(Item.name.ilike(like))
-                         .order_by(Item.updated_at.desc()).limit(120).all())
-             if perm.can_view_item(user, i)][:30]
-    boards = [b for b in Board.query.filter(Board.name.ilike(like)).limit(40).all()
-              if perm.board_access(user, b)][:10]
+        return jsonify({'items': [], 'boards': [], 'companies': [], 'next_offset': None,
+                        'truncated': False})
+    limit = min(max(request.args.get('limit', 30, type=int), 1), 100)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    items, truncated = fts.search_items(q, perm.visible_item_filter(user),
+                                        perm.visible_board_ids(user), limit, offset)
+    more = len(items) > limit
+    items = items[:limit]
+    boards, companies = [], []
+    if offset == 0:
+        boards = [b for b in Board.query.filter(Board.name.ilike(f'%{q}%')).limit(40).all()
+                  if perm.board_access(user, b)][:10]
+        visible_companies = (None if perm.is_super(user) else
+                             {c.id for c in perm.accessible_companies(user)})
+        companies = fts.search_companies(q, visible_companies, 10)
     board_names = {b.id: b.name for b in
                    Board.query.filter(Board.id.in_({i.board_id for i in items})).all()}
     out = []
@@ -122,64 +283,61 @@ def search(user):
         d = i.to_dict()
         d['board_name'] = board_names.get(i.board_id, '')
         out.append(d)
-    return jsonify({'items': out, 'boards': [b.to_dict() for b in boards]})
+    return jsonify({'items': out, 'boards': [b.to_dict() for b in boards],
+                    'companies': [c.to_dict() for c in companies],
+                    'next_offset': offset + limit if more else None,
+                    'truncated': truncated})
 
 
 @bp.get('/overview-items')
 @login_required
 def overview_items(user):
-    """All accessible jobs (kind=jobs) or sub-tasks (kind=tasks) across boards,
-    with enough context to render a directory list."""
+    """Accessible jobs (kind=jobs) or sub-tasks (kind=tasks) across boards,
+    with enough context to render a directory list. Takes the list filters,
+    sort and paging of _item_page."""
     kind = request.args.get('kind', 'jobs')
-    boards = {}
-    for b in Board.query.filter_by(archived=False).all():
-        access = perm.board_access(user, b)
-        if access:
-            boards[b.id] = (b, access)
-    if not boards:
-        return jsonify({'items': []})
-
-    q = Item.query.filter(Item.board_id.in_(list(boards)))
+    q = Item.query.join(Board, Board.id == Item.board_id).filter(Board.archived.is_(False))
+    visible = perm.visible_item_filter(user)
+    if visible is not None:
+        q = q.filter(visible)
     q = q.filter(Item.parent_id.is_(None)) if kind == 'jobs' else q.filter(Item.parent_id.isnot(None))
-    items = q.order_by(Item.updated_at.desc()).all()
+    try:
+        out_items, next_cursor = _item_page(q, request.args, lazy=True)
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid filter, sort or cursor'}), 400
+    company_names = {c.id: c.name for c in Company.query.all()}
+    rows = (row for batch in chunks(out_items, PAGE_MAX)
+            for row in _overview_rows(batch, company_names))
+    return stream_json({'next_cursor': next_cursor, 'items': rows})
 
-    # filter partial boards down to visible items
-    visible_cache = {}
-    out_items = []
-    for i in items:
-        b, access = boards[i.board_id]
-        if access == 'partial':
-            if i.board_id not in visible_cache:
-                visible_cache[i.board_id] = perm.visible_item_ids(user, b)
-            if i.id not in visible_cache[i.board_id]:
-                continue
-        out_items.append(i)
-
-    # context: company names, status label per item, parent names
-    from ..models import Company as _Company, Department as _Department
-    company_names = {c.id: c.name for c in _Company.query.all()}
-    board_company = {bid: perm.board_company_id(b) for bid, (b, _a) in boards.items()}
-    status_cols = {}
-    for bid, (b, _a) in boards.items():
-        col = (BoardColumn.query.filter_by(board_id=bid, type='status')
-               .order_by(BoardColumn.position).first())
-        if col:
-            status_cols[bid] = (col.id, {l['id']: l for l in col.settings_dict().get('labels', [])})
-    ids = [i.id for i in out_items]
+
+def _overview_rows(items, company_names):
+    """overview-items rows for one batch of items, with their context:
+    board and company names, status label, parent name."""
+    boards = {b.id: b for b in
+              Board.query.filter(Board.id.in_({i.board_id for i in items})).all()}
+    board_company = {bid: perm.board_company_id(b) for bid, b in boards.items()}
+    status_cols = {}  # board id: (first status column id, {label id: label})
+    if boards:
+        for col in (BoardColumn.query.filter(BoardColumn.board_id.in_(list(boards)),
+                                             BoardColumn.type == 'status')
+                    .order_by(BoardColumn.position.desc()).all()):
+            status_cols[col.board_id] = (
+                col.id, {l['id']: l for l in col.settings_dict().get('labels', [])})
+    ids = [i.id for i in items]
     status_values = {}
     if ids:
         col_ids = [c[0] for c in status_cols.values()]
-        for v in ItemValue.query.filter(ItemValue.item_id.in_(ids),
-                                        ItemValue.column_id.in_(col_ids)).all():
-            status_values[v.item_id] = v.value_dict().get('id')
+        status_values = dict(db.session.query(ItemValue.item_id, ItemValue.label_id).filter(
+            ItemValue.item_id.in_(ids), ItemValue.column_id.in_(col_ids)))
     parent_names = {}
-    parent_ids = {i.parent_id for i in out_items if i.parent_id}
+    parent_ids = {i.parent_id for i in items if i.parent_id}
     if parent_ids:
         parent_names = {p.id: p.name for p in Item.query.filter(Item.id.in_(parent_ids)).all()}
 
     result = []
-    for i in out_items:
-        b, _access = boards[i.board_id]
+    for i in items:
+        b = boards[i.board_id]
         label = None
         if i.board_id in status_cols:
             _cid, labels = status_cols[i.board_id]
@@ -190,34 +348,26 @@ def overview_items(user):
             'company_name': company_names.get(board_company.get(i.board_id), ''),
             'status': {'label': label['label'], 'color': label['color']} if label else None,
             'parent_name': parent_names.get(i.parent_id),
+            'done': bool(i.done),
+            'due_date': i.due_date.isoformat() if i.due_date else None,
             'updated_at': i.updated_at.isoformat() + 'Z' if i.updated_at else None,
         })
-    return jsonify({'items': result})
+    return result
 
 
 @bp.get('/stats')
 @login_required
 def stats(user):
-    my_boards = [b for b in Board.query.all() if perm.board_access(user, b) == 'full']
+    full = perm.full_boards_query(user)
+    my_boards = (Board.query.all() if full is None
+                 else Board.query.filter(Board.id.in_(full)).all())
     board_ids = [b.id for b in my_boards]
     boards_count = len([b for b in my_boards if not b.archived])
-    items_count = (Item.query.filter(Item.board_id.in_(board_ids)).count()
-                   if board_ids else 0)
     users_count = len([u for u in perm.visible_users(user) if u.is_active])
-
-    # Done = item whose status column value carries a "Done" label
-    done = 0
-    status_cols = (BoardColumn.query.filter(BoardColumn.type == 'status',
-                                            BoardColumn.board_id.in_(board_ids)).all()
-                   if board_ids else [])
-    done_ids = {}
-    for c in status_cols:
-        done_ids[c.id] = {l['id'] for l in c.settings_dict().get('labels', [])
-                          if l.get('label', '').lower() == 'done'}
-    if done_ids:
-        for v in ItemValue.query.filter(ItemValue.column_id.in_(list(done_ids))).all():
-            if v.value_dict().get('id') in done_ids.get(v.column_id, set()):
-                done += 1
+    # per-board counters kept current by every write (counters.py)
+    mine = counters.totals(None if full is None else board_ids)
+    items_count = mine['jobs'] + mine['tasks']
+    done = mine['done']
 
     recent = ((Activity.query.filter(Activity.board_id.in_(board_ids))
                .order_by(Activity.created_at.desc()).limit(20).all())
@@ -225,18 +375,14 @@ def stats(user):
     users = {u.id: u.to_dict() for u in User.query.all()}
     board_names = {b.id: b.name for b in Board.query.all()}
 
-    ha.update_sensor('sensor.taskmaster_items', items_count, {
-        'friendly_name': 'TaskMaster items', 'done': done, 'boards': boards_count,
-    })
-
     # High-level overview counts, scoped to what this user can access
     if perm.is_super(user):
         overview = {
             'companies': Company.query.count(),
             'departments': Department.query.count(),
             'boards': Board.query.filter_by(archived=False).count(),
-            'jobs': Item.query.filter(Item.parent_id.is_(None)).count(),
-            'tasks': Item.query.filter(Item.parent_id.isnot(None)).count(),
+            'jobs': mine['jobs'],
+            'tasks': mine['tasks'],
             'users': User.query.filter_by(is_active=True).count(),
         }
     else:
@@ -244,18 +390,12 @@ def stats(user):
         dept_count = (Department.query.filter(
             Department.company_id.in_([c.id for c in companies])).count()
             if companies else 0)
-        jobs = (Item.query.filter(Item.board_id.in_(board_ids),
-                                  Item.parent_id.is_(None)).count()
-                if board_ids else 0)
-        tasks = (Item.query.filter(Item.board_id.in_(board_ids),
-                                   Item.parent_id.isnot(None)).count()
-                 if board_ids else 0)
         overview = {
             'companies': len(companies),
             'departments': dept_count,
             'boards': boards_count,
-            'jobs': jobs,
-            'tasks': tasks,
+            'jobs': mine['jobs'],
+            'tasks': mine['tasks'],
             'users': users_count,
         }
 
@@ -263,6 +403,7 @@ def stats(user):
         'boards': boards_count,
         'items': items_count,
         'done': done,
+        'overdue': mine['overdue'],
         'users': users_count,
         'overview': overview,
         'is_super': perm.is_super(user),
@@ -195,12 +195,11 @@ def resend_invite(actor, user_id):
 
 
 def _send_invite(actor, u):
-    from flask import current_app
     from .. import emailer
     from .auth_routes import issue_token, _link_base
     token = issue_token(u, 'invite')
-    emailer.send_async(
-        current_app._get_current_object(), u.email,
+    emailer.queue(
+        u.email,
         'You\'re invited to TaskMaster',
         f'Hi,\n\n{actor.display_name} invited you to TaskMaster.\n'
         f'Click the link below to choose your username and password - it takes a '
@@ -252,6 +251,7 @@ def update_user(actor, user_id):
                          company_id=u.company_id)
         u.is_active = bool(data['is_active'])
     db.session.commit()
+    perm.forget_access(u.id)
     return jsonify({'user': u.to_dict(include_private=True)})
 
 
@@ -271,19 +271,19 @@ def delete_user(actor, user_id):
         return jsonify({'error': 'Deactivate the user first — deletion is permanent'}), 400
 
     import json as _json
-    from ..models import AuthToken, BoardColumn, ItemValue, Notification
+    from ..models import AuthToken, ItemAssignee, ItemValue, Notification
     AccessGrant.query.filter_by(user_id=u.id).delete(synchronize_session=False)
     AccessGrant.query.filter_by(granted_by=u.id).update({'granted_by': None}, synchronize_session=False)
     Notification.query.filter_by(user_id=u.id).delete(synchronize_session=False)
     AuthToken.query.filter_by(user_id=u.id).delete(synchronize_session=False)
     # scrub them out of every people column so jobs don't point at a ghost
-    people_cols = [c.id for c in BoardColumn.query.filter_by(type='people').all()]
-    if people_cols:
-        for v in ItemValue.query.filter(ItemValue.column_id.in_(people_cols),
-                                        ItemValue.value.contains('"user_ids"')).all():
+    for item_id, column_id in (db.session.query(ItemAssignee.item_id, ItemAssignee.column_id)
+                               .filter(ItemAssignee.user_id == u.id).all()):
+        v = ItemValue.query.filter_by(item_id=item_id, column_id=column_id).first()
+        if v:
             ids = v.value_dict().get('user_ids') or []
-            if u.id in ids:
-                v.value = _json.dumps({'user_ids': [x for x in ids if x != u.id]})
+            v.value = _json.dumps({'user_ids': [x for x in ids if x != u.id]})
+    ItemAssignee.query.filter_by(user_id=u.id).delete(synchronize_session=False)
     log_activity(actor.id, None, None, 'user_deleted',
                  f'permanently deleted user {u.display_name} (@{u.username})',
                  company_id=u.company_id)
@@ -6,8 +6,9 @@ from flask import Blueprint, jsonify, request
 from .. import permissions as perm
 from ..auth import login_required
 from ..db import db
-from ..models import (AccessGrant, Board, BoardColumn, Company, Department,
-                      Item, JobTemplate, Role, User)
+from ..jsonstream import stream_json
+from ..models import (AccessGrant, Board, BoardColumn, BoardCounter, Company,
+                      Department, Item, JobTemplate, Role, User)
 from ..services import log_activity
 
 bp = Blueprint('workspace', __name__, url_prefix='/api')
@@ -19,16 +20,37 @@ bp = Blueprint('workspace', __name__, url_prefix='/api')
 @login_required
 def workspace(user):
     companies = perm.accessible_companies(user)
-    item_counts = dict(db.session.query(Item.board_id, db.func.count(Item.id))
-                       .filter(Item.parent_id.is_(None)).group_by(Item.board_id).all())
+    # the whole tree in three queries; access is answered from the request's
+    # memoized AccessContext, so no per-board permission queries either
+    company_ids = [c.id for c in companies]
+    depts_by_company, boards_by_dept, direct_by_company = {}, {}, {}
+    if company_ids:
+        for d in (Department.query.filter(Department.company_id.in_(company_ids))
+                  .order_by(Department.position, Department.id).all()):
+            depts_by_company.setdefault(d.company_id, []).append(d)
+        dept_ids = [d.id for ds in depts_by_company.values() for d in ds]
+        for b in (Board.query.filter(db.or_(
+                Board.department_id.in_(dept_ids) if dept_ids else db.false(),
+                db.and_(Board.company_id.in_(company_ids), Board.department_id.is_(None))))
+                .order_by(Board.position, Board.id).all()):
+            access = perm.board_access(user, b)
+            if not access:
+                continue
+            if b.department_id:
+                boards_by_dept.setdefault(b.department_id, []).append((b, access))
+            else:
+                direct_by_company.setdefault(b.company_id, []).append((b, access))
+    shown = [b.id for bs in (*boards_by_dept.values(), *direct_by_company.values())
+             for b, _a in bs]
+    item_counts = (dict(db.session.query(BoardCounter.board_id, BoardCounter.jobs)
+                        .filter(BoardCounter.board_id.in_(shown)))
+                   if shown else {})
     out = []
     for c in companies:
-        direct = perm.accessible_direct_boards(user, c)
-        depts = (Department.query.filter_by(company_id=c.id)
-                 .order_by(Department.position, Department.id).all())
+        direct = direct_by_company.get(c.id, [])
         dept_list = []
-        for d in depts:
-            boards = perm.accessible_boards_in(user, d)
+        for d in depts_by_company.get(c.id, []):
+            boards = boards_by_dept.get(d.id, [])
             if not boards and not (perm.is_super(user) or perm.can_manage_company(user, c.id)):
                 continue
             dept_list.append({
@@ -290,6 +312,7 @@ def create_grant(actor, user_id):
                  f'granted {target.display_name} access to {_describe_scope(g)}',
                  company_id=target.company_id)
     db.session.commit()
+    perm.forget_access(target.id)
     return jsonify({'grant': {**g.to_dict(), 'label': _describe_scope(g)}}), 201
 
 
@@ -327,6 +350,7 @@ def update_grant(actor, grant_id):
                  f"changed {target.display_name}'s access from {old_label} to {_describe_scope(g)}",
                  company_id=target.company_id)
     db.session.commit()
+    perm.forget_access(target.id)
     return jsonify({'grant': {**g.to_dict(), 'label': _describe_scope(g)}})
 
 
@@ -342,6 +366,7 @@ def delete_grant(actor, grant_id):
                  company_id=target.company_id)
     db.session.delete(g)
     db.session.commit()
+    perm.forget_access(target.id)
     return jsonify({'ok': True})
 
 
@@ -425,9 +450,9 @@ def audit(user):
             q = q.filter(Activity.company_id.in_(managed) if managed else db.false())
         else:
             q = q.filter(Activity.company_id == user.company_id)
-    rows = q.order_by(Activity.created_at.desc()).limit(200).all()
+    rows = q.order_by(Activity.created_at.desc()).limit(200).yield_per(100)
     users = {u.id: u.to_dict() for u in User.query.all()}
-    return jsonify({'audit': [a.to_dict() for a in rows], 'users': users})
+    return stream_json({'users': users, 'audit': (a.to_dict() for a in rows)})
 
 
 # ---- Automations (central, admin-managed) ----
@@ -690,9 +715,8 @@ def download_backup(user, name):
 def create_request(user):
     """A simple 'ask for help' intake: lands as a job on the company's
     Requests board, with the requester attached and admins notified."""
-    import json as _json
-    from ..models import BoardColumn, BoardGroup, Item, ItemUpdate, ItemValue, User as U
-    from ..services import broadcast_board, log_activity, notify_user
+    from ..models import BoardColumn, BoardGroup, Item, ItemUpdate, User as U
+    from ..services import add_assignee, broadcast_board, log_activity, notify_users
     data = request.json or {}
     subject = (data.get('subject') or '').strip()
     if not subject:
@@ -720,21 +744,18 @@ def create_request(user):
     people = (BoardColumn.query.filter_by(board_id=board.id, type='people')
               .order_by(BoardColumn.position).first())
     if people:
-        db.session.add(ItemValue(item_id=item.id, column_id=people.id,
-                                 value=_json.dumps({'user_ids': [user.id]})))
+        add_assignee(item.id, people.id, user.id)
     if details:
         db.session.add(ItemUpdate(item_id=item.id, user_id=user.id, body=details))
     log_activity(user.id, board.id, item.id, 'item_created',
                  f'submitted request "{subject}"')
     # tell the company admins and the staff who manage this company
-    for admin in U.query.filter_by(is_active=True).all():
-        if admin.id == user.id:
-            continue
-        if (admin.role == 'super_admin'
-                or (admin.role == 'company_admin' and admin.company_id == company.id)
-                or (admin.role == 'admin' and company.id in perm.managed_company_ids(admin))):
-            notify_user(admin.id, user.id, 'update', board.id, item.id,
-                        f'{user.display_name} submitted a request: "{subject}" ({company.name})')
+    admins = [admin.id for admin in U.query.filter_by(is_active=True).all()
+              if admin.role == 'super_admin'
+              or (admin.role == 'company_admin' and admin.company_id == company.id)
+              or (admin.role == 'admin' and company.id in perm.managed_company_ids(admin))]
+    notify_users(admins, user.id, 'update', board.id, item.id,
+                 f'{user.display_name} submitted a request: "{subject}" ({company.name})')
     db.session.commit()
     broadcast_board(board.id)
     return jsonify({'ok': True, 'item_id': item.id}), 201
@@ -920,10 +941,12 @@ def list_trash(user):
     scope = _trash_scope(user)
     if scope is not None and not scope:
         return jsonify({'error': 'Only admins can see the trash'}), 403
-    q = TrashEntry.query.order_by(TrashEntry.deleted_at.desc())
+    # the listing never needs the snapshots themselves, which can be whole boards
+    q = (TrashEntry.query.options(db.defer(TrashEntry.payload))
+         .order_by(TrashEntry.deleted_at.desc()))
     if scope is not None:
         q = q.filter(TrashEntry.company_id.in_(scope))
-    return jsonify({'entries': [e.to_dict() for e in q.limit(200).all()]})
+    return stream_json({'entries': (e.to_dict() for e in q.limit(200).yield_per(100))})
 
 
 def _trash_entry_or_403(user, entry_id):
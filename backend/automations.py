@@ -0,0 +1,133 @@
+"""Compiled automation rules for services.run_automations.
+
+Every enabled AutomationRule is read once into a table keyed by
+(trigger, company_id, label), where company_id is None for a global rule and
+label is the normalized label text of a status rule (None = any label). A
+status change then looks up four keys (this company or global, this label or
+any) instead of scanning and JSON-decoding every rule. Each board's first
+status column (with its labels by normalized text) and first people column
+are resolved once and kept alongside.
+
+The table is shared across requests and rebuilt lazily after any change to
+rules or columns is committed, in this worker and (over the bus) in
+every other one. A session with such a change still uncommitted reads
+around the shared table, so it always sees its own edits.
+"""
+import itertools
+from collections import namedtuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import bus
+from .db import db
+from .models import AutomationRule, BoardColumn
+
+_INPUTS = (AutomationRule, BoardColumn)
+
+Rule = namedtuple('Rule', 'id company_id disabled action action_param user_ids '
+                          'notify_assignees created_by')
+# a board's first status column (id, {normalized label: label}) and
+# first people column id; either may be None
+Columns = namedtuple('Columns', 'status_id status_labels people_id')
+
+_rules = [None]  # the compiled table, None until first needed
+_columns = {}    # board id -> Columns
+_generation = [0]
+
+
+def normalize(label_text):
+    return (label_text or '').strip().lower()
+
+
+def _compile():
+    """(trigger, company_id, label) -> [Rule] for every enabled rule."""
+    table = {}
+    for r in AutomationRule.query.filter_by(enabled=True).order_by(AutomationRule.id):
+        trigger = r.trigger or 'status'
+        label = normalize(r.label_text) if trigger == 'status' and r.label_text else None
+        disabled = frozenset(r.disabled_company_list()) if r.company_id is None else frozenset()
+        table.setdefault((trigger, r.company_id, label), []).append(Rule(
+            r.id, r.company_id, disabled, r.action or 'notify', r.action_param,
+            tuple(r.user_id_list()), bool(r.notify_assignees), r.created_by))
+    return table
+
+
+def _shareable():
+    # uncommitted rule / column edits in this session bypass the shared table
+    return not db.session.info.get('automations_stale')
+
+
+def matching_rules(trigger, company_id, label_text=None):
+    """Enabled rules for this trigger that apply to the company (its own,
+    plus global ones it hasn't opted out of), in rule id order. For the
+    status trigger, only those for this label or for any label."""
+    table = _rules[0] if _shareable() else None
+    if table is None:
+        generation = _generation[0]
+        table = _compile()
+        if _shareable() and generation == _generation[0]:
+            _rules[0] = table
+    labels = (None, normalize(label_text)) if trigger == 'status' else (None,)
+    owners = (company_id, None) if company_id is not None else (None,)
+    found = [r for cid in owners for label in labels
+             for r in table.get((trigger, cid, label), ())]
+    return sorted((r for r in found if company_id not in r.disabled), key=lambda r: r.id)
+
+
+def board_columns(board_id):
+    """The Columns an automation acts on for this board."""
+    shareable = _shareable()
+    cached = _columns.get(board_id) if shareable else None
+    if cached is not None:
+        return cached
+    generation = _generation[0]
+    status = people = None
+    for c in (BoardColumn.query.filter(BoardColumn.board_id == board_id,
+                                       BoardColumn.type.in_(('status', 'people')))
+              .order_by(BoardColumn.position)):
+        if c.type == 'status' and status is None:
+            status = c
+        elif c.type == 'people' and people is None:
+            people = c
+    labels = {}
+    if status is not None:
+        for l in status.settings_dict().get('labels', []):
+            labels.setdefault(normalize(l.get('label')), l)
+    result = Columns(status.id if status else None, labels, people.id if people else None)
+    if shareable and generation == _generation[0]:
+        _columns[board_id] = result
+    return result
+
+
+def invalidate():
+    _generation[0] += 1
+    _rules[0] = None
+    _columns.clear()
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_change(session, flush_context):
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, _INPUTS):
+            session.info['automations_stale'] = True
+            return
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _note_bulk_change(state):
+    if (state.is_update or state.is_delete) and state.bind_mapper is not None \
+            and state.bind_mapper.class_ in _INPUTS:
+        state.session.info['automations_stale'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_soft_rollback')
+def _flush_tables(session, *args):
+    if session.info.pop('automations_stale', False):
+        bus.send('automations_stale', None)  # every worker keeps its own table
+
+
+@bus.handler('automations_stale')
+def _on_stale(payload):
+    invalidate()
@@ -0,0 +1,119 @@
+"""Cross-process message bus.
+
+SSE streams, the assignable-users cache and login throttling are per-process
+state. With one gunicorn worker that is all there is; with several, a change
+made in one worker has to reach all of them. A channel registers a handler
+with @bus.handler('name'); bus.send('name', payload) runs it in this process
+right away and, with the 'table' backend, in every other worker shortly after.
+
+Backends (config.EVENT_BUS):
+  local — this process only; the default, for a single worker
+  table — rows in the bus_messages table of the app database, written and
+          polled by one background thread per worker. No outside service.
+"""
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+
+from .config import EVENT_BUS
+
+POLL_SECONDS = 0.2
+KEEP_SECONDS = 300  # sweep messages every worker has long since read
+WRITE_LOCK_KEY = 0x7462  # PostgreSQL advisory lock: ids commit in order (db.py)
+
+_handlers = {}
+_origin = uuid.uuid4().hex[:16]
+_outbox = deque()
+_wakeup = threading.Event()
+_started = False
+
+
+def handler(channel):
+    """Decorator: run fn(payload) for every message sent on `channel`."""
+    def register(fn):
+        _handlers[channel] = fn
+        return fn
+    return register
+
+
+def send(channel, payload):
+    """Deliver to this process now and queue for the other workers. Never
+    blocks on the database, so it is safe inside an open transaction.
+    The payload must survive a JSON round trip."""
+    _dispatch(channel, payload)
+    if _started:
+        _outbox.append((channel, payload))
+        _wakeup.set()
+
+
+def shared():
+    """True when messages reach other processes (the table backend is running)."""
+    return _started
+
+
+def _dispatch(channel, payload):
+    fn = _handlers.get(channel)
+    if fn is None:
+        return
+    try:
+        fn(payload)
+    except Exception as e:  # noqa: BLE001
+        print(f'TaskMaster bus ({channel}): {e}')
+
+
+def start(app):
+    """Start the table backend's writer/poller thread (no-op for 'local')."""
+    global _started
+    if _started or EVENT_BUS != 'table':
+        return
+    _started = True
+    from sqlalchemy import func, select
+    from .db import db, serialize_writes
+    from .models import BusMessage
+    table = BusMessage.__table__
+    with app.app_context():
+        engine = db.engine
+    with engine.connect() as conn:
+        last = conn.execute(select(func.max(table.c.id))).scalar() or 0
+
+    def loop():
+        nonlocal last
+        swept = 0
+        while True:
+            _wakeup.wait(POLL_SECONDS)
+            _wakeup.clear()
+            batch = []
+            while _outbox:
+                batch.append(_outbox.popleft())
+            try:
+                now = datetime.utcnow()
+                with engine.begin() as conn:
+                    if batch:
+                        serialize_writes(conn, WRITE_LOCK_KEY)
+                        conn.execute(table.insert(), [
+                            {'origin': _origin, 'channel': ch, 'payload': json.dumps(p),
+                             'created_at': now} for ch, p in batch])
+                        batch = []
+                    if time.monotonic() - swept > 60:
+                        swept = time.monotonic()
+                        conn.execute(table.delete().where(
+                            table.c.created_at < now - timedelta(seconds=KEEP_SECONDS)))
+                with engine.connect() as conn:
+                    rows = conn.execute(
+                        select(table.c.id, table.c.origin, table.c.channel, table.c.payload)
+                        .where(table.c.id > last).order_by(table.c.id)).all()
+                if rows:
+                    last = rows[-1].id
+                    with app.app_context():
+                        for r in rows:
+                            if r.origin != _origin:
+                                _dispatch(r.channel, json.loads(r.payload))
+            except Exception as e:  # noqa: BLE001
+                print(f'TaskMaster bus: {e}')
+                _outbox.extendleft(reversed(batch))  # retry on the next tick
+                time.sleep(1)
+
+    threading.Thread(target=loop, daemon=True, name='taskmaster-bus').start()
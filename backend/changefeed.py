@@ -0,0 +1,187 @@
+"""Per-board change cursor for delta sync.
+
+Every transaction that touches a board, its groups, columns or items
+(including an item's values, updates and files) appends one BoardChange row
+per touched object as it commits. A client holding cursor N asks for the
+rows after N and re-reads only those objects; deletions come back as
+tombstones. Rows older than CHANGE_KEEP_DAYS are pruned daily — a client whose
+cursor predates the prune floor has to reload the full board.
+
+Each flush also records typed, row-carrying events (item_created,
+value_set, item_moved, group_updated, column_deleted, ...). They are held
+until the session commits and then published by services.broadcast_board."""
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from .db import db, serialize_writes
+from .models import (AppSetting, Board, BoardChange, BoardColumn, BoardGroup,
+                     FileAsset, Item, ItemUpdate, ItemValue)
+
+CHANGE_KEEP_DAYS = 7
+FLOOR_KEY = 'changefeed_floor'  # highest pruned change id
+WRITE_LOCK_KEY = 0x7463  # PostgreSQL advisory lock: ids commit in order (db.py)
+
+_KINDS = {Board: 'board', BoardGroup: 'group', BoardColumn: 'column', Item: 'item'}
+_ITEM_CHILDREN = (ItemValue, ItemUpdate, FileAsset)
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_changes(session, flush_context):
+    touched = {}
+    events = []  # (board_id, event); children wait for their item's board
+    child_events = []  # (item_id, event)
+
+    def note(board_id, kind, row_id, deleted=False):
+        if board_id and row_id:
+            key = (board_id, kind, row_id)
+            touched[key] = touched.get(key, False) or deleted
+
+    new = list(session.new)
+    gone = list(session.deleted)
+    dirty = [o for o in session.dirty if session.is_modified(o, include_collections=False)]
+    for objs, verb in ((new, 'created'), (dirty, 'updated'), (gone, 'deleted')):
+        for obj in objs:
+            kind = _KINDS.get(type(obj))
+            if kind == 'board':
+                note(obj.id, kind, obj.id, verb == 'deleted')
+                if verb != 'deleted':  # board_deleted is broadcast explicitly
+                    events.append((obj.id, {'type': f'board_{verb}', 'board': obj.to_dict()}))
+            elif kind:
+                note(obj.board_id, kind, obj.id, verb == 'deleted')
+                # a parent's subitems_count moves with its sub-items
+                if kind == 'item' and obj.parent_id and verb != 'updated':
+                    note(obj.board_id, 'item', obj.parent_id)
+                ev = _row_event(obj, kind, verb)
+                if ev:
+                    events.append((obj.board_id, ev))
+            elif isinstance(obj, _ITEM_CHILDREN):
+                child_events.append((obj.item_id, _child_event(obj, verb)))
+    if child_events:
+        rows = session.connection().execute(
+            select(Item.id, Item.board_id).where(Item.id.in_({i for i, _ in child_events})))
+        boards = dict(rows.all())
+        for iid, ev in child_events:
+            if iid in boards:  # children of a deleted item go with its item_deleted
+                note(boards[iid], 'item', iid)
+                events.append((boards[iid], ev))
+    if events:
+        session.info.setdefault('pending_board_events', []).extend(events)
+    if touched:
+        pending = session.info.setdefault('pending_board_changes', {})
+        for key, deleted in touched.items():
+            pending[key] = pending.get(key, False) or deleted
+
+
+@event.listens_for(Session, 'before_commit')
+def _write_changes(session):
+    """Append the transaction's change rows as its last statement. The
+    write lock (PostgreSQL) is taken here, so it is held only from this
+    insert to the commit, never across the transaction's own work."""
+    session.flush()  # whatever is still unflushed is recorded too
+    touched = session.info.pop('pending_board_changes', None)
+    if not touched:
+        return
+    now = datetime.utcnow()
+    conn = session.connection()
+    serialize_writes(conn, WRITE_LOCK_KEY)
+    conn.execute(BoardChange.__table__.insert(), [
+        {'board_id': b, 'kind': k, 'row_id': r, 'deleted': d, 'created_at': now}
+        for (b, k, r), d in touched.items()
+    ])
+
+
+def _row_event(obj, kind, verb):
+    if verb == 'deleted':
+        return {'type': f'{kind}_deleted', f'{kind}_id': obj.id}
+    if kind != 'item':
+        return {'type': f'{kind}_{verb}', kind: obj.to_dict()}
+    if verb == 'created':
+        d = obj.to_dict(values={}, counts={})
+        d['subitems_count'] = 0
+        return {'type': 'item_created', 'item_id': obj.id, 'item': d}
+    changed = {a.key for a in inspect(obj).attrs if a.history.has_changes()} - {'updated_at'}
+    if not changed:
+        return None  # a bare touch; the value/update events carry the change
+    if changed <= {'group_id', 'position'}:
+        return {'type': 'item_moved', 'item_id': obj.id,
+                'group_id': obj.group_id, 'position': obj.position}
+    return {'type': 'item_updated', 'item_id': obj.id, 'item': obj.to_dict()}
+
+
+def _child_event(obj, verb):
+    if isinstance(obj, ItemValue):
+        return {'type': 'value_set', 'item_id': obj.item_id, 'column_id': obj.column_id,
+                'value': None if verb == 'deleted' else obj.value_dict()}
+    kind = 'update' if isinstance(obj, ItemUpdate) else 'file'
+    if verb == 'deleted':
+        return {'type': f'{kind}_deleted', 'item_id': obj.item_id, f'{kind}_id': obj.id}
+    return {'type': f'{kind}_{verb}', 'item_id': obj.item_id, kind: obj.to_dict()}
+
+
+@event.listens_for(Session, 'after_commit')
+def _commit_events(session):
+    pending = session.info.pop('pending_board_events', None)
+    if pending:
+        session.info.setdefault('board_events', []).extend(pending)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _drop_events(session, previous_transaction):
+    session.info.pop('pending_board_events', None)
+    session.info.pop('pending_board_changes', None)
+
+
+def take_board_events():
+    """Row-level events committed by this session since the last call, as
+    {board_id: [event, ...]} in commit order. services.broadcast_board
+    drains them after each commit."""
+    out = {}
+    for board_id, ev in db.session.info.pop('board_events', ()):
+        out.setdefault(board_id, []).append(ev)
+    return out
+
+
+def committed_board_ids():
+    """Boards with row events this session committed that no
+    broadcast_board has taken yet."""
+    return {board_id for board_id, _ev in db.session.info.get('board_events', ())}
+
+
+def current_cursor():
+    """Newest change id overall. Cursors are shared across boards, so a board
+    with no changes of its own still hands out an up-to-date cursor."""
+    return db.session.query(db.func.max(BoardChange.id)).scalar() or 0
+
+
+def cursor_is_stale(since, cursor):
+    """True when `since` can no longer be answered incrementally: its rows were
+    pruned, or it comes from a different database (e.g. a restored backup)."""
+    return since < (AppSetting.get_json(FLOOR_KEY) or 0) or since > cursor
+
+
+def changed_rows(board_id, since):
+    """{(kind, row_id): deleted} for the newest change of each object after
+    `since` — a row deleted and re-created (SQLite reuses ids) ends up live."""
+    latest = {}
+    rows = (db.session.query(BoardChange.kind, BoardChange.row_id, BoardChange.deleted)
+            .filter(BoardChange.board_id == board_id, BoardChange.id > since)
+            .order_by(BoardChange.id).all())
+    for kind, row_id, deleted in rows:
+        latest[(kind, row_id)] = bool(deleted)
+    return latest
+
+
+def prune_changes():
+    """Called daily: drop change rows older than CHANGE_KEEP_DAYS and raise
+    the floor so older cursors are told to resync."""
+    cutoff = datetime.utcnow() - timedelta(days=CHANGE_KEEP_DAYS)
+    top = (db.session.query(db.func.max(BoardChange.id))
+           .filter(BoardChange.created_at < cutoff).scalar())
+    if not top:
+        return 0
+    n = BoardChange.query.filter(BoardChange.id <= top).delete(synchronize_session=False)
+    AppSetting.set_json(FLOOR_KEY, top)
+    db.session.commit()
+    return n
@@ -0,0 +1,275 @@
+"""Per-item progress and per-board counters behind the sidebar and dashboard.
+
+Each item carries two derived columns: `done` (one of its status values has a
+label reading "Done") and `due_date` (its earliest date value). A transaction
+that changes a status or date value, moves an item, or edits a board's
+status/date columns re-derives them for just those items (or that board) in
+SQL as it commits, so nothing ever decodes status values to find out what is
+done.
+
+board_counters holds, per board: jobs, sub-tasks, done items, overdue items
+(due before today and not done), updates and files. A transaction that adds,
+moves or deletes an item or changes its progress recounts the boards it
+touched just before it commits (once per board, however often it flushed),
+so /api/workspace and /api/stats read a handful of rows instead of counting
+the items table. A recount is a few indexed range counts on that board's
+items. Adding or deleting an update or file, the most frequent write, only
+shifts the board's updates / files by the difference.
+
+Overdue moves with the calendar as well as with writes, so the daily job
+recounts every board (recount_all). To rebuild everything by hand:
+
+    DATA_DIR=./data python3 -m backend.counters
+"""
+import json
+from datetime import date
+
+from sqlalchemy import bindparam, event, inspect, select, text
+from sqlalchemy.orm import Session
+
+from .db import db
+from .models import (Board, BoardColumn, BoardCounter, FileAsset, Item,
+                     ItemUpdate, ItemValue)
+
+COUNTERS = ('jobs', 'tasks', 'done', 'overdue', 'updates', 'files')
+CHUNK = 200  # boards per recount during a rebuild
+
+_enabled = False
+
+
+def enable():
+    """Turn on write-time counting once the table exists (after migrations)."""
+    global _enabled
+    _enabled = True
+
+
+def done_labels(settings):
+    """Label ids in a status column's settings that mean the item is done."""
+    return {l['id'] for l in settings.get('labels', [])
+            if str(l.get('label', '')).strip().lower() == 'done' and 'id' in l}
+
+
+def rebuild():
+    """Re-derive every item's done / due date, then recount every board;
+    returns the number of boards counted."""
+    conn = db.session.connection()
+    board_ids = [bid for (bid,) in conn.execute(select(Board.id))]
+    for i in range(0, len(board_ids), CHUNK):
+        refresh_progress(conn, Item.board_id.in_(board_ids[i:i + CHUNK]))
+    return recount_all()
+
+
+def recount_all():
+    """Recount every board; returns the number of boards counted."""
+    conn = db.session.connection()
+    board_ids = [bid for (bid,) in conn.execute(select(Board.id))]
+    conn.execute(BoardCounter.__table__.delete())
+    for i in range(0, len(board_ids), CHUNK):
+        recount(conn, board_ids[i:i + CHUNK])
+    return len(board_ids)
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_changes(session, flush_context):
+    """Collect what this flush touched; the counting waits for the commit,
+    so a transaction that flushes once per item still counts each board once."""
+    if not _enabled:
+        return
+    pending = session.info.setdefault('counters_pending', {
+        'boards': set(), 'gone': set(), 'shifts': {},  # shifts: item -> [updates, files]
+        'stale_items': set(), 'stale_boards': set()})  # stale: done / due_date to re-derive
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Board):
+            if obj in session.deleted:
+                pending['gone'].add(obj.id)
+            elif obj in session.new:
+                pending['boards'].add(obj.id)
+        elif isinstance(obj, Item):
+            if obj in session.dirty:
+                hist = inspect(obj).attrs.board_id.history
+                pending['boards'].update(b for b in hist.deleted if b)
+                if hist.has_changes():
+                    pending['stale_items'].add(obj.id)
+                elif not _changed(obj, 'parent_id'):
+                    continue
+            pending['boards'].add(obj.board_id)
+        elif isinstance(obj, ItemValue):
+            if obj in session.dirty and not _changed(obj, 'label_id', 'date_value'):
+                continue
+            if obj.label_id or obj.date_value or obj in session.dirty:
+                pending['stale_items'].add(obj.item_id)
+        elif isinstance(obj, (ItemUpdate, FileAsset)):
+            if obj not in session.dirty:
+                shift = pending['shifts'].setdefault(obj.item_id, [0, 0])
+                shift[isinstance(obj, FileAsset)] += -1 if obj in session.deleted else 1
+        elif isinstance(obj, BoardColumn):
+            if obj.type in ('status', 'date') or _changed(obj, 'type'):
+                pending['stale_boards'].add(obj.board_id)
+
+
+# ahead of changefeed's before_commit, which takes the board_changes lock
+@event.listens_for(Session, 'before_commit', insert=True)
+def _count_changes(session):
+    if not _enabled:
+        return
+    session.flush()  # whatever is still unflushed is collected too
+    pending = session.info.pop('counters_pending', None)
+    if not pending:
+        return
+    gone_boards = pending['gone']
+    stale_items, stale_boards = pending['stale_items'], pending['stale_boards']
+    conn = session.connection()
+    stale_boards -= gone_boards
+    stale_boards.discard(None)
+    if stale_boards:
+        refresh_progress(conn, Item.board_id.in_(stale_boards))
+    if stale_items:
+        refresh_progress(conn, Item.id.in_(stale_items))
+    if stale_items or stale_boards:
+        _expire_progress(session, stale_items, stale_boards)
+    board_ids = pending['boards']
+    if stale_items:
+        board_ids.update(bid for (bid,) in conn.execute(
+            select(Item.board_id).where(Item.id.in_(stale_items)).distinct()))
+    if gone_boards:
+        conn.execute(BoardCounter.__table__.delete()
+                     .where(BoardCounter.board_id.in_(gone_boards)))
+    board_ids |= stale_boards
+    board_ids -= gone_boards
+    board_ids.discard(None)
+    shifts = {}  # board -> [updates, files], for boards not recounted anyway
+    if pending['shifts']:
+        for iid, bid in conn.execute(select(Item.id, Item.board_id)
+                                     .where(Item.id.in_(pending['shifts']))):
+            if bid not in board_ids:
+                shift = shifts.setdefault(bid, [0, 0])
+                shift[0] += pending['shifts'][iid][0]
+                shift[1] += pending['shifts'][iid][1]
+    counters = BoardCounter.__table__
+    for bid, (updates, files) in shifts.items():
+        if not (updates or files):
+            continue
+        shifted = conn.execute(counters.update().where(counters.c.board_id == bid)
+                               .values(updates=counters.c.updates + updates,
+                                       files=counters.c.files + files))
+        if not shifted.rowcount:  # never counted: count it now
+            board_ids.add(bid)
+    if board_ids:
+        recount(conn, board_ids)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_changes(session, previous_transaction):
+    session.info.pop('counters_pending', None)
+
+
+def _expire_progress(session, item_ids, board_ids):
+    """refresh_progress wrote done / due_date behind the ORM's back."""
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Item) and (obj.id in item_ids or obj.board_id in board_ids):
+            session.expire(obj, ['done', 'due_date'])
+
+
+def _changed(obj, *attrs):
+    state = inspect(obj)
+    return any(state.attrs[a].history.has_changes() for a in attrs)
+
+
+def refresh_progress(conn, where):
+    """Re-derive Item.done and Item.due_date, for the items matching `where`,
+    from their status and date values. One UPDATE per board, so each item
+    probes only its own board's few columns."""
+    board_ids = [bid for (bid,) in conn.execute(select(Item.board_id).where(where).distinct())]
+    if not board_ids:
+        return
+    columns = {bid: ([], []) for bid in board_ids}  # board: (done terms, date columns)
+    for cid, bid, ctype, settings in conn.execute(
+            select(BoardColumn.id, BoardColumn.board_id, BoardColumn.type, BoardColumn.settings)
+            .where(BoardColumn.board_id.in_(board_ids),
+                   BoardColumn.type.in_(('status', 'date')))):
+        if ctype == 'date':
+            columns[bid][1].append(cid)
+            continue
+        try:
+            labels = done_labels(json.loads(settings or '{}'))
+        except (ValueError, AttributeError):
+            labels = None
+        if labels:
+            columns[bid][0].append(db.and_(ItemValue.column_id == cid,
+                                           ItemValue.label_id.in_(sorted(labels))))
+    items = Item.__table__
+    for bid, (done_terms, date_cols) in columns.items():
+        done = (db.exists().where(ItemValue.item_id == items.c.id, db.or_(*done_terms))
+                if done_terms else db.false())
+        due = (select(db.func.min(ItemValue.date_value))
+               .where(ItemValue.item_id == items.c.id, ItemValue.column_id.in_(date_cols))
+               .scalar_subquery() if date_cols else db.null())
+        # only rows that are, or are about to be, done or dated can change
+        candidates = [items.c.done.is_(True), items.c.due_date.isnot(None)]
+        if done_terms or date_cols:
+            candidates.append(items.c.id.in_(select(ItemValue.item_id).where(db.or_(
+                *done_terms,
+                ItemValue.column_id.in_(date_cols) & ItemValue.date_value.isnot(None)))))
+        # keep updated_at: this is bookkeeping, not an edit of the item
+        conn.execute(items.update().where(where, items.c.board_id == bid, db.or_(*candidates))
+                     .values(done=done, due_date=due, updated_at=items.c.updated_at))
+
+
+def recount(conn, board_ids):
+    """Rewrite the counter rows of these boards from the live tables."""
+    today = date.today()
+    board_ids = list(board_ids)
+    counts = {bid: dict.fromkeys(COUNTERS, 0) for (bid,) in conn.execute(
+        select(Board.id).where(Board.id.in_(board_ids)))}
+    if not counts:
+        return
+    board_ids = list(counts)
+
+    def add(key, query):
+        for bid, n in conn.execute(query.group_by(Item.board_id)):
+            counts[bid][key] = n
+
+    in_boards = Item.board_id.in_(board_ids)
+    for bid, total, tasks in conn.execute(
+            select(Item.board_id, db.func.count(), db.func.count(Item.parent_id))
+            .where(in_boards).group_by(Item.board_id)):
+        counts[bid].update(jobs=total - tasks, tasks=tasks)
+    add('done', select(Item.board_id, db.func.count()).where(in_boards, Item.done.is_(True)))
+    add('overdue', select(Item.board_id, db.func.count())
+        .where(in_boards, Item.done.is_(False), Item.due_date < today))
+    add('updates', select(Item.board_id, db.func.count(ItemUpdate.id))
+        .join(Item, Item.id == ItemUpdate.item_id).where(in_boards))
+    add('files', select(Item.board_id, db.func.count(FileAsset.id))
+        .join(Item, Item.id == FileAsset.item_id).where(in_boards))
+    # an upsert rather than delete + insert: two PostgreSQL transactions
+    # recounting the same board must not collide on the primary key
+    conn.execute(text(
+        'INSERT INTO board_counters (board_id, jobs, tasks, done, overdue, updates, files, '
+        'counted_on) VALUES (:board_id, :jobs, :tasks, :done, :overdue, :updates, :files, '
+        ':counted_on) ON CONFLICT (board_id) DO UPDATE SET '
+        + ', '.join(f'{c} = excluded.{c}' for c in COUNTERS + ('counted_on',)))
+        .bindparams(bindparam('counted_on', type_=db.Date)),
+        [{'board_id': bid, 'counted_on': today, **c} for bid, c in counts.items()])
+
+
+def totals(board_ids=None):
+    """Summed counters over board_ids (None = every board)."""
+    query = db.session.query(*[db.func.coalesce(db.func.sum(getattr(BoardCounter, c)), 0)
+                               for c in COUNTERS])
+    if board_ids is not None:
+        if not board_ids:
+            return dict.fromkeys(COUNTERS, 0)
+        query = query.filter(BoardCounter.board_id.in_(board_ids))
+    return dict(zip(COUNTERS, query.one()))
+
+
+def main():
+    from . import create_app
+    with create_app(background=False).app_context():
+        n = rebuild()
+        db.session.commit()
+    print(f'Recounted {n} board(s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,53 @@
+import sqlite3
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+from .config import (DB_MAX_OVERFLOW, DB_POOL_SIZE, DB_POOL_TIMEOUT,
+                     SQLITE_BUSY_TIMEOUT_MS, SQLITE_CACHE_SIZE_KB,
+                     SQLITE_JOURNAL_MODE, SQLITE_MMAP_SIZE, SQLITE_SYNCHRONOUS)
 
 db = SQLAlchemy()
+
+
+def engine_options(url):
+    """SQLALCHEMY_ENGINE_OPTIONS for the app database (knobs in config.py)."""
+    options = {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+    }
+    if url.startswith('sqlite'):
+        # sqlite3's own lock wait; the PRAGMA below sets the same for the driver
+        options['connect_args'] = {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000}
+    else:
+        options['pool_pre_ping'] = True  # a server restart drops pooled connections
+    return options
+
+
+def is_sqlite():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def serialize_writes(conn, key):
+    """PostgreSQL: hold a transaction-scoped lock on `key` until commit, so
+    rows inserted under it commit in id order. Tables read as a log by id
+    (board_changes, bus_messages) need that; SQLite has one writer anyway.
+    Every writer of the log waits on the lock, so take it right before the
+    commit, not while the transaction still has work to do."""
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text('SELECT pg_advisory_xact_lock(:k)'), {'k': key})
+
+
+@event.listens_for(Engine, 'connect')
+def _tune_sqlite(dbapi_conn, connection_record):
+    if not isinstance(dbapi_conn, sqlite3.Connection):
+        return
+    cur = dbapi_conn.cursor()
+    cur.execute(f'PRAGMA journal_mode={SQLITE_JOURNAL_MODE}')
+    cur.execute(f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}')
+    cur.execute(f'PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT_MS)}')
+    cur.execute(f'PRAGMA cache_size=-{int(SQLITE_CACHE_SIZE_KB)}')
+    cur.execute(f'PRAGMA mmap_size={int(SQLITE_MMAP_SIZE)}')
+    cur.close()
@@ -0,0 +1,182 @@
+"""Deferred work: what a request sets off but shouldn't wait for.
+
+A request queues work with enqueue(kind, payload) inside its own transaction,
+so the work is exactly as durable as the change behind it: a crash after the
+commit loses nothing and a rollback queues nothing. The request returns
+straight away. A small pool of threads per process (config.DEFERRED_WORKERS)
+claims due rows in batches, hands each kind's payloads to the function
+registered with @deferred.handler(kind), and deletes the rows in the same
+transaction as the work they did.
+
+A handler gets a list of payloads, so a batch shares its lookups. When a
+batch fails, its payloads are retried one by one so a bad row can't hold up
+the rest; a row that keeps failing backs off and is parked as 'failed' after
+MAX_ATTEMPTS. A retry rolls back the database work, not what already left
+the process (a pushed notification, a Home Assistant event): handlers run
+at least once. A claim is a lease: rows claimed by a process that died are
+picked up again after LEASE_SECONDS.
+
+Run whatever is due by hand (e.g. with DEFERRED_WORKERS=0):
+
+    DATA_DIR=./data python3 -m backend.deferred
+"""
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .config import DEFERRED_WORKERS
+from .db import db
+from .models import DeferredWork
+
+BATCH = 50
+POLL_SECONDS = 2      # picks up retries and work queued by other processes
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 5
+
+_handlers = {}
+_wakeup = threading.Event()
+_started = False
+
+
+def handler(kind):
+    """Decorator: run fn([payload, ...]) for queued work of this kind."""
+    def register(fn):
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+def enqueue(kind, payload):
+    """Queue work in the current transaction; it runs after the commit.
+    The payload must survive a JSON round trip."""
+    db.session.add(DeferredWork(kind=kind, payload=json.dumps(payload)))
+    db.session.info['deferred_queued'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_workers(session):
+    if session.info.pop('deferred_queued', False):
+        _wakeup.set()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_queued(session, previous_transaction):
+    session.info.pop('deferred_queued', None)
+
+
+def start(app):
+    """Start this process's worker threads (none with DEFERRED_WORKERS=0)."""
+    global _started
+    if _started or DEFERRED_WORKERS <= 0:
+        return
+    _started = True
+
+    def loop():
+        while True:
+            _wakeup.wait(POLL_SECONDS)
+            _wakeup.clear()
+            try:
+                with app.app_context():
+                    drain()
+            except Exception as e:  # noqa: BLE001
+                print(f'TaskMaster deferred work: {e}')
+                time.sleep(1)
+
+    for n in range(DEFERRED_WORKERS):
+        threading.Thread(target=loop, daemon=True, name=f'taskmaster-deferred-{n}').start()
+
+
+def drain():
+    """Run due work until none is left; returns how many rows were run."""
+    total = 0
+    while True:
+        n = run_batch()
+        if not n:
+            return total
+        total += n
+
+
+def run_batch(limit=BATCH):
+    """Claim up to `limit` due rows and run them; returns how many."""
+    rows = claim(DeferredWork.__table__, limit)
+    by_kind = {}
+    for row in rows:
+        by_kind.setdefault(row.kind, []).append(row)
+    for kind, batch in by_kind.items():
+        try:
+            _run(kind, batch)
+            continue
+        except Exception as e:  # noqa: BLE001
+            db.session.rollback()
+            if len(batch) == 1:
+                _failed(batch[0], e)
+                continue
+        for row in batch:
+            try:
+                _run(kind, [row])
+            except Exception as e:  # noqa: BLE001
+                db.session.rollback()
+                _failed(row, e)
+    return len(rows)
+
+
+def claim(t, limit):
+    """Lease up to `limit` due rows of a queue table (this one, or one with
+    the same id / status / run_after / claimed_* columns) to the caller;
+    returns them, committed as claimed."""
+    now = datetime.utcnow()
+    free = db.or_(t.c.claimed_at.is_(None),
+                  t.c.claimed_at < now - timedelta(seconds=LEASE_SECONDS))
+    # read first: an idle poll shouldn't take SQLite's write lock
+    due = [i for (i,) in db.session.execute(
+        db.select(t.c.id).where(t.c.status == 'pending', t.c.run_after <= now, free)
+        .order_by(t.c.id).limit(limit))]
+    if not due:
+        db.session.rollback()
+        return []
+    token = uuid.uuid4().hex
+    db.session.execute(t.update().where(t.c.id.in_(due), free)  # lost races skip the row
+                       .values(claimed_by=token, claimed_at=now))
+    db.session.commit()
+    return db.session.execute(
+        db.select(t).where(t.c.claimed_by == token).order_by(t.c.id)).all()
+
+
+def _run(kind, rows):
+    fn = _handlers.get(kind)
+    if fn is None:
+        raise LookupError(f'no handler for deferred work {kind!r}')
+    t = DeferredWork.__table__
+    db.session.execute(t.delete().where(t.c.id.in_([r.id for r in rows])))
+    fn([json.loads(r.payload) for r in rows])
+    db.session.commit()
+
+
+def _failed(row, error):
+    t = DeferredWork.__table__
+    attempts = row.attempts + 1
+    values = {'attempts': attempts, 'claimed_by': None, 'claimed_at': None,
+              'last_error': str(error)[:2000],
+              'run_after': datetime.utcnow() + timedelta(seconds=5 * 2 ** attempts)}
+    if attempts >= MAX_ATTEMPTS:
+        values['status'] = 'failed'
+    db.session.execute(t.update().where(t.c.id == row.id).values(**values))
+    db.session.commit()
+    print(f'TaskMaster deferred work: {row.kind} #{row.id} failed '
+          f'(attempt {attempts}/{MAX_ATTEMPTS}): {error}')
+
+
+def main():
+    from . import create_app
+    with create_app(background=False).app_context():
+        n = drain()
+    print(f'Ran {n} deferred work row(s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Notification email digests.
+
+A user whose email_digest is 'hourly' or 'daily' gets no email per
+notification (services.notify_users skips them). Instead the scheduler calls
+run() every tick. A user's window opens with the oldest unread notification
+newer than the last one emailed (digest_last_id); once it has been waiting a
+full window, and a window has passed since their last digest, they get one
+email listing everything pending. So a quiet spell never turns the next
+notification into an email of its own. All due users are read and rendered
+in one pass and queued with one outbox insert.
+"""
+from datetime import datetime, timedelta
+
+from .db import db
+from .models import Notification, User
+
+MODES = ('immediate', 'hourly', 'daily')
+WINDOWS = {'hourly': timedelta(hours=1), 'daily': timedelta(days=1)}
+MAX_LINES = 50  # per email; the rest are summed up
+
+
+def wants_immediate(user):
+    return (user.email_digest or 'immediate') == 'immediate'
+
+
+def set_mode(user, mode):
+    """Switch a user's digest setting. Starting a digest starts its window
+    now and leaves out what was already emailed one by one."""
+    mode = mode if mode in MODES else 'immediate'
+    if mode != 'immediate' and wants_immediate(user):
+        user.digest_sent_at = datetime.utcnow()
+        user.digest_last_id = db.session.query(db.func.max(Notification.id)).filter(
+            Notification.user_id == user.id).scalar()
+    user.email_digest = mode
+
+
+def run(now=None):
+    """Queue the digests that are due; returns how many."""
+    from . import emailer
+    if not emailer.is_ready():
+        return 0
+    now = now or datetime.utcnow()
+    users = {u.id: u for u in User.query.filter(
+        User.email_digest.in_(tuple(WINDOWS)), User.is_active.is_(True),
+        User.email.isnot(None), User.email != '',
+        db.or_(User.email_notifications.is_(None), User.email_notifications.is_(True)))
+        if u.digest_sent_at is None or u.digest_sent_at <= now - WINDOWS[u.email_digest]}
+    if not users:
+        return 0
+    unsent = db.and_(
+        Notification.user_id.in_(users), Notification.read.is_(False),
+        Notification.id > db.func.coalesce(
+            db.select(User.digest_last_id).where(User.id == Notification.user_id)
+            .scalar_subquery(), 0))
+    # a window opens with the first notification waiting for it
+    due = [uid for uid, oldest in db.session.query(
+               Notification.user_id, db.func.min(Notification.created_at))
+           .filter(unsent).group_by(Notification.user_id)
+           if oldest <= now - WINDOWS[users[uid].email_digest]]
+    if not due:
+        return 0
+    pending = {}  # user id -> [count, newest id, first MAX_LINES messages]
+    rows = (db.session.query(Notification.user_id, Notification.id, Notification.message)
+            .filter(unsent, Notification.user_id.in_(due))
+            .order_by(Notification.user_id, Notification.id).yield_per(1000))
+    for uid, nid, message in rows:
+        p = pending.setdefault(uid, [0, 0, []])
+        p[0] += 1
+        p[1] = nid
+        if len(p[2]) < MAX_LINES:
+            p[2].append(message)
+    emailer.queue_many([(users[uid].email, *render(users[uid], count, messages))
+                        for uid, (count, _newest, messages) in pending.items()])
+    db.session.execute(db.update(User), [
+        {'id': uid, 'digest_sent_at': now, 'digest_last_id': newest}
+        for uid, (_count, newest, _messages) in pending.items()])
+    db.session.commit()
+    return len(pending)
+
+
+def render(user, count, messages):
+    """(subject, body) of one digest."""
+    period = 'hour' if user.email_digest == 'hourly' else 'day'
+    noun = 'notification' if count == 1 else 'notifications'
+    lines = [f'- {m}' for m in messages]
+    if count > len(messages):
+        lines.append(f'…and {count - len(messages)} more in TaskMaster.')
+    body = (f'Hi {user.display_name},\n\n'
+            f'Here is what happened in the last {period}:\n\n' + '\n'.join(lines))
+    return f'TaskMaster: {count} new {noun}', body
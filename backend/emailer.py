@@ -1,14 +1,32 @@
 """Outgoing email via the SMTP server the super admin configures in Settings.
 
-Notification emails are sent on a background thread so API requests never
-wait on an SMTP server. Uses only the standard library — nothing extra to
-install inside the add-on."""
+Notification emails never wait on an SMTP server: queue() / queue_many() add
+them to the email_outbox table in the caller's transaction (so an email goes
+out exactly when the change behind it commits), and a few sender threads per
+process (config.EMAIL_WORKERS) claim them in batches and send them over an
+SMTP connection each keeps open, logged in, between batches. A failed email
+stays in the outbox and is retried with backoff, then parked as 'failed'
+after MAX_ATTEMPTS. A crash between a send and its batch's commit can send
+an email twice, never lose one. Uses only the standard library — nothing
+extra to install inside the add-on.
+
+Send whatever is due by hand (e.g. with EMAIL_WORKERS=0):
+
+    DATA_DIR=./data python3 -m backend.emailer
+"""
 import smtplib
 import threading
+import time
+from datetime import datetime, timedelta
 from email.message import EmailMessage
 from email.utils import formataddr
 
-from .models import AppSetting
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .config import EMAIL_WORKERS
+from .db import db
+from .models import AppSetting, EmailOutbox
 
 SETTINGS_KEY = 'email_smtp'
 DEFAULTS = {
@@ -23,6 +41,15 @@ DEFAULTS = {
     'base_url': '',           # optional portal address for links in emails
 }
 
+BATCH = 20
+POLL_SECONDS = 5
+IDLE_SECONDS = 30      # close a sender's connection after this long unused
+RETRY_SECONDS = 60     # first retry; doubles each time
+MAX_ATTEMPTS = 8       # about four hours of retries
+
+_wakeup = threading.Event()
+_started = False
+
 
 def get_config():
     cfg = dict(DEFAULTS)
@@ -70,6 +97,15 @@ def send_email(to, subject, body, cfg=None):
     cfg = cfg or get_config()
     if not is_ready(cfg):
         return 'Email service is not configured'
+    try:
+        with _connect(cfg) as server:
+            server.send_message(_message(to, subject, body, cfg))
+        return None
+    except Exception as e:  # noqa: BLE001 — surface any SMTP problem as text
+        return str(e)
+
+
+def _message(to, subject, body, cfg):
     msg = EmailMessage()
     msg['Subject'] = subject
     msg['From'] = formataddr((cfg['from_name'] or 'TaskMaster', cfg['from_addr']))
@@ -82,32 +118,209 @@ def send_email(to, subject, body, cfg=None):
         msg.set_content(body, cte='7bit')
     except (UnicodeEncodeError, ValueError):
         msg.set_content(body)
+    return msg
+
+
+def _connect(cfg):
+    """An SMTP connection, secured and logged in."""
+    if cfg['security'] == 'ssl':
+        server = smtplib.SMTP_SSL(cfg['host'], cfg['port'], timeout=15)
+    else:
+        server = smtplib.SMTP(cfg['host'], cfg['port'], timeout=15)
     try:
-        if cfg['security'] == 'ssl':
-            server = smtplib.SMTP_SSL(cfg['host'], cfg['port'], timeout=15)
-        else:
-            server = smtplib.SMTP(cfg['host'], cfg['port'], timeout=15)
-        with server:
-            if cfg['security'] == 'starttls':
-                server.starttls()
-            if cfg['username']:
-                server.login(cfg['username'], cfg['password'])
-            server.send_message(msg)
-        return None
-    except Exception as e:  # noqa: BLE001 — surface any SMTP problem as text
-        return str(e)
+        if cfg['security'] == 'starttls':
+            server.starttls()
+        if cfg['username']:
+            server.login(cfg['username'], cfg['password'])
+    except Exception:
+        server.close()
+        raise
+    return server
 
 
-def send_async(app, to, subject, body):
-    """Fire-and-forget email for notifications; never blocks a request."""
-    cfg = get_config()
-    if not is_ready(cfg) or not to:
+def queue(to, subject, body):
+    """Send an email once the current transaction commits; never blocks a
+    request on the SMTP server."""
+    queue_many([(to, subject, body)])
+
+
+def queue_many(messages):
+    """queue() for a list of (to, subject, body): one config read and one
+    insert for the lot. Nothing is queued while the service is off."""
+    messages = [m for m in messages if m[0]]
+    if not messages or not is_ready():
+        return
+    db.session.bulk_insert_mappings(EmailOutbox, [
+        {'to_addr': to, 'subject': subject[:255], 'body': body}
+        for to, subject, body in messages])
+    db.session.info['email_queued'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_senders(session):
+    if session.info.pop('email_queued', False):
+        _wakeup.set()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_queued(session, previous_transaction):
+    session.info.pop('email_queued', None)
+
+
+class _Connection:
+    """A sender's SMTP connection: opened when first needed, reused while
+    it's fresh and the settings haven't changed."""
+
+    def __init__(self):
+        self.server = None
+        self.settings = None
+        self.last_used = 0.0
+
+    def open(self, cfg):
+        """Make sure there is a connection for these settings; True when a
+        new one had to be made."""
+        settings = tuple(cfg[k] for k in ('host', 'port', 'security', 'username', 'password'))
+        if self.server is not None and settings != self.settings:
+            self.close()
+        if self.server is not None:
+            return False
+        self.server = _connect(cfg)
+        self.settings = settings
+        self.last_used = time.monotonic()
+        return True
+
+    def send(self, msg, cfg):
+        fresh = self.open(cfg)
+        try:
+            self.server.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError):
+            # the server dropped an idle or long-lived connection: once more
+            # on a new one
+            self.close()
+            if fresh:
+                raise
+            return self.send(msg, cfg)
+        except smtplib.SMTPResponseException as e:
+            if e.smtp_code != 421:
+                self._reset()
+                raise
+            self.close()  # the server is closing (too many messages, say)
+            if fresh:
+                raise
+            return self.send(msg, cfg)
+        except smtplib.SMTPRecipientsRefused:
+            self._reset()
+            raise
+        self.last_used = time.monotonic()
+
+    def _reset(self):
+        try:
+            self.server.rset()
+        except Exception:  # noqa: BLE001
+            self.close()
+
+    def expire(self):
+        if self.server is not None and time.monotonic() - self.last_used > IDLE_SECONDS:
+            self.close()
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:  # noqa: BLE001
+                self.server.close()
+        self.server = None
+
+
+def start(app):
+    """Start this process's sender threads (none with EMAIL_WORKERS=0)."""
+    global _started
+    if _started or EMAIL_WORKERS <= 0:
         return
+    _started = True
+
+    def loop():
+        connection = _Connection()
+        while True:
+            _wakeup.wait(POLL_SECONDS)
+            _wakeup.clear()
+            try:
+                with app.app_context():
+                    drain(connection)
+            except Exception as e:  # noqa: BLE001
+                print(f'TaskMaster email outbox: {e}')
+                time.sleep(1)
+            connection.expire()
+
+    for n in range(EMAIL_WORKERS):
+        threading.Thread(target=loop, daemon=True, name=f'taskmaster-email-{n}').start()
+
+
+def drain(connection=None):
+    """Send due email until none is left; returns how many were tried."""
+    own = connection is None
+    connection = connection or _Connection()
+    total = 0
+    try:
+        while True:
+            n = send_batch(connection)
+            if not n:
+                return total
+            total += n
+    finally:
+        if own:
+            connection.close()
+
+
+def send_batch(connection, limit=BATCH):
+    """Claim up to `limit` due emails and send them over `connection`;
+    the sent ones leave the outbox, the rest wait for a retry."""
+    from .deferred import claim
+    t = EmailOutbox.__table__
+    rows = claim(t, limit)
+    if not rows:
+        return 0
+    cfg = get_config()
+    down = None if is_ready(cfg) else 'Email service is not configured'
+    if down is None:
+        try:
+            connection.open(cfg)
+        except Exception as e:  # noqa: BLE001
+            down = e
+    sent, failed = [], []
+    for row in rows:
+        if down is not None:
+            failed.append((row, down))
+            continue
+        try:
+            connection.send(_message(row.to_addr, row.subject, row.body, cfg), cfg)
+            sent.append(row.id)
+        except Exception as e:  # noqa: BLE001
+            failed.append((row, e))
+            if connection.server is None:  # couldn't get back in: the rest wait too
+                down = e
+    if sent:
+        db.session.execute(t.delete().where(t.c.id.in_(sent)))
+    now = datetime.utcnow()
+    for row, error in failed:
+        attempts = row.attempts + 1
+        db.session.execute(t.update().where(t.c.id == row.id).values(
+            attempts=attempts, claimed_by=None, claimed_at=None,
+            last_error=str(error)[:2000],
+            run_after=now + timedelta(seconds=RETRY_SECONDS * 2 ** (attempts - 1)),
+            status='failed' if attempts >= MAX_ATTEMPTS else 'pending'))
+        print(f'TaskMaster: email to {row.to_addr} failed '
+              f'(attempt {attempts}/{MAX_ATTEMPTS}): {error}')
+    db.session.commit()
+    return len(rows)
+
+
+def main():
+    from . import create_app
+    with create_app(background=False).app_context():
+        n = drain()
+    print(f'Tried {n} queued email(s)')
 
-    def worker():
-        with app.app_context():
-            err = send_email(to, subject, body, cfg)
-            if err:
-                print(f'TaskMaster: email to {to} failed: {err}')
 
-    threading.Thread(target=worker, daemon=True).start()
+if __name__ == '__main__':
+    main()
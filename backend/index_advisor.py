@@ -0,0 +1,70 @@
+"""Check that the hot query shapes are served by an index.
+
+Each entry in HOT_QUERIES builds one query the way the endpoint that runs it
+does. check() runs EXPLAIN on each query against the live database and
+reports any that read a whole table, so a query change that loses its index
+is caught before it reaches a large tenant. The indexes themselves are
+declared on the models.
+
+    DATA_DIR=./data python3 -m backend.index_advisor
+"""
+from .db import db
+from .models import (AUDIT_ACTION_LIST, AccessGrant, Activity, FileAsset, Item,
+                     ItemValue, Notification)
+
+HOT_QUERIES = {
+    'list_items_lite': lambda: (Item.query.filter_by(board_id=1)
+                                .filter(Item.parent_id.is_(None)).order_by(Item.position)),
+    'status colours': lambda: (db.session.query(ItemValue.item_id, ItemValue.label_id)
+                               .filter(ItemValue.column_id == 1, ItemValue.item_id.in_([1, 2, 3]))),
+    'board activity': lambda: (Activity.query.filter_by(board_id=1)
+                               .order_by(Activity.created_at.desc()).limit(100)),
+    'audit': lambda: (Activity.query.filter(Activity.action.in_(AUDIT_ACTION_LIST),
+                                            Activity.company_id == 1)
+                      .order_by(Activity.created_at.desc()).limit(200)),
+    'notifications': lambda: (Notification.query.filter_by(user_id=1)
+                              .order_by(Notification.created_at.desc()).limit(100)),
+    'grants on an object': lambda: AccessGrant.query.filter_by(scope_type='board', scope_id=1),
+    'trash purge file check': lambda: FileAsset.query.filter_by(filename='x').limit(1),
+}
+
+
+def explain(query):
+    """The database's plan for a query, one line per step."""
+    dialect = db.engine.dialect
+    sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect.name == 'sqlite' else 'EXPLAIN '
+    rows = db.session.connection().exec_driver_sql(prefix + sql).all()
+    return [row[-1] for row in rows]
+
+
+def _full_scan(line):
+    # SQLite: "SCAN items", also "SCAN items USING INDEX ..." (every entry,
+    # just in index order) as opposed to "SEARCH ..."; PostgreSQL: "Seq Scan"
+    return line.startswith('SCAN ') or 'Seq Scan' in line
+
+
+def check():
+    """{query name: plan} for every hot query that scans a whole table."""
+    problems = {}
+    for name, build in HOT_QUERIES.items():
+        plan = explain(build())
+        if any(_full_scan(line.strip(' -')) for line in plan):
+            problems[name] = plan
+    return problems
+
+
+def main():
+    from . import create_app
+    with create_app(background=False).app_context():
+        problems = check()
+    for name, plan in problems.items():
+        print(f'{name}: full table scan')
+        for line in plan:
+            print(f'    {line}')
+    print(f'{len(HOT_QUERIES) - len(problems)}/{len(HOT_QUERIES)} hot queries use an index')
+    raise SystemExit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Streamed JSON for the bulk payloads (a full board, the audit log, the
+unpaged overview list, trash snapshots).
+
+A payload is an ordinary dict whose big members may be left lazy: any
+iterable that is not a list, tuple or dict (a generator, a query with
+yield_per) is written out as a JSON array one element at a time as it is
+consumed. So a board of any size costs one batch of items in memory, not
+the whole item list, its dicts and one string several times that size.
+
+    return stream_json({'items': (i.to_dict() for i in query.yield_per(500))})
+
+Once the first bytes are out the status is 200; an error half way through
+leaves the client holding truncated JSON, which it treats as a failed load.
+"""
+import json
+
+from flask import Response, current_app, stream_with_context
+
+BUFFER = 64 * 1024  # bytes per write to the client
+
+
+def chunks(iterable, size):
+    """Lists of up to `size` elements from any iterable."""
+    batch = []
+    for x in iterable:
+        batch.append(x)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_json(obj, dumps=json.dumps):
+    """Yield the JSON text of obj in pieces. A dict holding a lazy value is
+    written key by key, a lazy iterable element by element; anything else
+    (an item dict, say) in one `dumps`."""
+    if isinstance(obj, dict) and any(_is_lazy(v) for v in obj.values()):
+        yield '{'
+        for n, (key, value) in enumerate(obj.items()):
+            yield (',' if n else '') + dumps(str(key)) + ':'
+            yield from iter_json(value, dumps)
+        yield '}'
+    elif _is_lazy(obj):
+        yield '['
+        for n, value in enumerate(obj):
+            if n:
+                yield ','
+            yield from iter_json(value, dumps)
+        yield ']'
+    else:
+        yield dumps(obj)
+
+
+def _is_lazy(obj):
+    return (not isinstance(obj, (str, bytes, list, tuple, dict))
+            and hasattr(obj, '__iter__'))
+
+
+def stream_json(payload, status=200):
+    """A JSON response written out while `payload` is being iterated, with
+    the app's JSON settings (what jsonify would produce, bar key order)."""
+    def dumps(obj):
+        return current_app.json.dumps(obj, separators=(',', ':'))
+
+    def generate():
+        buf, size = [], 0
+        for piece in iter_json(payload, dumps):
+            buf.append(piece)
+            size += len(piece)
+            if size >= BUFFER:
+                yield ''.join(buf)
+                buf, size = [], 0
+        if buf:
+            yield ''.join(buf)
+
+    return Response(stream_with_context(generate()), status=status,
+                    mimetype=current_app.json.mimetype)
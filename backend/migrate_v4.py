@@ -1,7 +1,8 @@
 """Schema + data upgrade for the multi-company version (v4).
 
-- Adds new columns to existing tables (SQLite ALTER TABLE, since create_all
-  only creates missing tables).
+- Adds new columns to existing tables (ALTER TABLE, since create_all only
+  creates missing tables). The DDL sticks to types and defaults that SQLite
+  and PostgreSQL both accept.
 - Wraps any pre-existing boards into a default company/department.
 - Upgrades legacy roles: admin -> super_admin.
 - Members keep seeing the boards that existed before permissions arrived
@@ -9,13 +10,13 @@
 """
 import json
 
-from sqlalchemy import inspect, text
+from sqlalchemy import inspect, select, text
 
 from .db import db
 from .models import (AUDIT_ACTION_LIST, AccessGrant, Activity, AutomationRule,
                      Board, BoardColumn, BoardGroup, Company, Department,
-                     FileAsset, Item, ItemUpdate, ItemValue, NotificationRule,
-                     User)
+                     FileAsset, Item, ItemAssignee, ItemUpdate, ItemValue,
+                     NotificationRule, User)
 
 
 def _ensure_column(table, column, ddl):
@@ -25,6 +26,15 @@ def _ensure_column(table, column, ddl):
         db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {ddl}'))
         db.session.commit()
         print(f'TaskMaster: added {table}.{column}')
+        return True
+    return False
+
+
+def _ensure_indexes(model):
+    """create_all only indexes brand-new tables; add any a model declares
+    that an existing table is still missing."""
+    for index in model.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
 
 
 def ensure_schema():
@@ -35,10 +45,13 @@ def ensure_schema():
     if 'users' in tables:
         _ensure_column('users', 'company_id', 'company_id INTEGER')
         _ensure_column('users', 'custom_role_id', 'custom_role_id INTEGER')
-        _ensure_column('users', 'hide_done', 'hide_done INTEGER DEFAULT 0')
-        _ensure_column('users', 'must_change_password', 'must_change_password INTEGER DEFAULT 0')
-        _ensure_column('users', 'email_notifications', 'email_notifications INTEGER DEFAULT 1')
+        _ensure_column('users', 'hide_done', 'hide_done BOOLEAN DEFAULT FALSE')
+        _ensure_column('users', 'must_change_password', 'must_change_password BOOLEAN DEFAULT FALSE')
+        _ensure_column('users', 'email_notifications', 'email_notifications BOOLEAN DEFAULT TRUE')
         _ensure_column('users', 'totp_secret', 'totp_secret VARCHAR(64)')
+        _ensure_column('users', 'email_digest', "email_digest VARCHAR(10) DEFAULT 'immediate'")
+        _ensure_column('users', 'digest_sent_at', 'digest_sent_at TIMESTAMP')
+        _ensure_column('users', 'digest_last_id', 'digest_last_id INTEGER')
     if 'automation_rules' in tables:
         _ensure_column('automation_rules', 'trigger', "\"trigger\" VARCHAR(20) DEFAULT 'status'")
         _ensure_column('automation_rules', 'action', "action VARCHAR(20) DEFAULT 'notify'")
@@ -52,6 +65,8 @@ def ensure_schema():
     if 'items' in tables:
         _ensure_column('items', 'parent_id', 'parent_id INTEGER')
         _ensure_column('items', 'checklist', 'checklist TEXT')
+        _ensure_column('items', 'done', 'done BOOLEAN DEFAULT FALSE')
+        _ensure_column('items', 'due_date', 'due_date DATE')
     if 'boards' in tables:
         _ensure_column('boards', 'company_id', 'company_id INTEGER')
         _ensure_column('boards', 'status', 'status TEXT')
@@ -59,6 +74,34 @@ def ensure_schema():
         for col in ('address TEXT', 'phone VARCHAR(60)', 'phone2 VARCHAR(60)',
                     'email VARCHAR(200)', 'contact_name VARCHAR(200)', 'notes TEXT'):
             _ensure_column('companies', col.split()[0], col)
+    if 'item_values' in tables:
+        added = [_ensure_column('item_values', col.split()[0], col)
+                 for col in ('label_id VARCHAR(40)', 'date_value DATE', 'number_value FLOAT')]
+        _ensure_indexes(ItemValue)
+        if any(added):
+            _backfill_typed_values()
+
+
+def _backfill_typed_values():
+    """Fill ItemValue's typed columns from the JSON values written before they
+    existed. Plain SQL: this runs before any ORM query may touch the table."""
+    from .models import typed_value_fields
+    updates = []
+    for vid, raw in db.session.execute(text('SELECT id, value FROM item_values')):
+        try:
+            label_id, due, number = typed_value_fields(json.loads(raw or '{}'))
+        except ValueError:
+            continue
+        if label_id is None and due is None and number is None:
+            continue
+        updates.append({'vid': vid, 'label_id': label_id, 'number': number,
+                        'due': due.isoformat() if due else None})
+    if updates:
+        db.session.execute(text('UPDATE item_values SET label_id = :label_id, '
+                                'date_value = :due, number_value = :number WHERE id = :vid'),
+                           updates)
+    db.session.commit()
+    print(f'TaskMaster: indexed typed fields of {len(updates)} value(s)')
 
 
 def migrate_v4_data():
@@ -103,6 +146,7 @@ def migrate_v4_data():
     _cleanup_orphans()
     _dedupe_default_columns()
     _migrate_board_rules()
+    _backfill_item_assignees()
 
 
 def _cleanup_orphans():
@@ -110,7 +154,11 @@ def _cleanup_orphans():
     columns/values behind — they inflated every count and, because SQLite
     reuses row ids, could attach old data to brand-new rows. Sweep them out."""
     removed = 0
-    board_ids = {b.id for b in Board.query.with_entities(Board.id)}
+    # id subqueries, not id lists: a large database has more rows than a
+    # statement may carry bound parameters
+    board_ids = select(Board.id)
+    item_ids = select(Item.id)
+    col_ids = select(BoardColumn.id)
 
     def sweep(query):
         nonlocal removed
@@ -122,13 +170,12 @@ def _cleanup_orphans():
     sweep(BoardColumn.query.filter(~BoardColumn.board_id.in_(board_ids)))
     sweep(Item.query.filter(~Item.board_id.in_(board_ids)))
     # sub-tasks whose parent job is gone
-    item_ids = {i.id for i in Item.query.with_entities(Item.id)}
     sweep(Item.query.filter(Item.parent_id.isnot(None), ~Item.parent_id.in_(item_ids)))
 
-    item_ids = {i.id for i in Item.query.with_entities(Item.id)}
-    col_ids = {c.id for c in BoardColumn.query.with_entities(BoardColumn.id)}
     sweep(ItemValue.query.filter(~ItemValue.item_id.in_(item_ids)
                                  | ~ItemValue.column_id.in_(col_ids)))
+    sweep(ItemAssignee.query.filter(~ItemAssignee.item_id.in_(item_ids)
+                                    | ~ItemAssignee.column_id.in_(col_ids)))
     sweep(ItemUpdate.query.filter(~ItemUpdate.item_id.in_(item_ids)))
     sweep(FileAsset.query.filter(~FileAsset.item_id.in_(item_ids)))
     sweep(NotificationRule.query.filter(~NotificationRule.board_id.in_(board_ids)
@@ -144,8 +191,8 @@ def _cleanup_orphans():
                           ~Activity.board_id.in_(board_ids)).update(
         {'board_id': None}, synchronize_session=False)
     # access grants whose target object is gone
-    dept_ids = {d.id for d in Department.query.with_entities(Department.id)}
-    company_ids = {c.id for c in Company.query.with_entities(Company.id)}
+    dept_ids = select(Department.id)
+    company_ids = select(Company.id)
     for scope, ids in (('board', board_ids), ('item', item_ids),
                        ('department', dept_ids), ('company', company_ids)):
         sweep(AccessGrant.query.filter(AccessGrant.scope_type == scope,
@@ -185,6 +232,8 @@ def _dedupe_default_columns():
                 db.session.delete(c)
                 removed += 1
     if removed:
+        from .services import rebuild_item_assignees
+        rebuild_item_assignees()  # people values may have moved columns
         db.session.commit()
         print(f'TaskMaster: removed {removed} duplicated column(s)')
 
@@ -219,3 +268,20 @@ def _migrate_board_rules():
         migrated += 1
     db.session.commit()
     print(f'TaskMaster: migrated {migrated} board notification rule(s) to central automations')
+
+
+def _backfill_item_assignees():
+    """Databases from before the item_assignees index get it built once from
+    the people-column values; afterwards every write keeps it current."""
+    if ItemAssignee.query.first() is not None:
+        return
+    has_people = (db.session.query(ItemValue.id)
+                  .join(BoardColumn, BoardColumn.id == ItemValue.column_id)
+                  .filter(BoardColumn.type == 'people',
+                          ItemValue.value.contains('"user_ids"')).first())
+    if has_people is None:
+        return
+    from .services import rebuild_item_assignees
+    n = rebuild_item_assignees()
+    db.session.commit()
+    print(f'TaskMaster: indexed {n} people-column assignment(s)')
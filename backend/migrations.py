@@ -0,0 +1,153 @@
+"""Versioned startup migrations.
+
+The database records the last migration it has run (app setting
+`schema_version`). At boot, a database that is already current costs a single
+read. Otherwise the tables are created, every pending step from MIGRATIONS
+runs in order, and the version is saved after each step, so a crash resumes
+at the step that failed.
+
+A schema or data change ships as a new function appended to MIGRATIONS, not
+as a check that runs on every boot. Steps must be idempotent, and each one
+does its own work: a step for a new table creates it and its indexes. New
+columns on existing tables go in migrate_v4.ensure_schema, the one list of
+them, and the step that ships one runs it again. Databases from before this
+runner have no version, so they run the whole list once. That list starts
+with the old every-boot chain: ensure_schema, the v2 import and the v4 data
+fixes.
+"""
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from .db import db
+from .models import AppSetting
+
+VERSION_KEY = 'schema_version'
+
+
+def _v4_columns():
+    from .migrate_v4 import ensure_schema
+    ensure_schema()  # column additions must precede any ORM queries
+
+
+def _v2_import():
+    from .migrate_v2 import migrate_v2_if_needed
+    migrate_v2_if_needed()
+
+
+def _v4_data():
+    from .migrate_v4 import migrate_v4_data
+    migrate_v4_data()
+
+
+def _hot_query_indexes():
+    """Composite indexes for the hot query shapes (see index_advisor.py); drop
+    the single-column ones they now cover as a prefix."""
+    from .migrate_v4 import _ensure_indexes
+    from .models import AccessGrant, Activity, FileAsset, Item, ItemValue, Notification
+    for model in (Item, ItemValue, Activity, Notification, AccessGrant, FileAsset):
+        _ensure_indexes(model)
+    for name in ('idx_items_board', 'idx_values_column', 'idx_v3_activity_board'):
+        db.session.execute(text(f'DROP INDEX IF EXISTS {name}'))
+    db.session.commit()
+
+
+def _create_table(model):
+    from .migrate_v4 import _ensure_indexes
+    model.__table__.create(db.engine, checkfirst=True)
+    _ensure_indexes(model)
+
+
+def _search_index():
+    """Full-text search tables (SQLite only), filled from the existing rows."""
+    from . import search
+    from .db import is_sqlite
+    if not is_sqlite():
+        return
+    search.create_tables(db.session.connection())
+    n = search.rebuild()
+    db.session.commit()
+    print(f'TaskMaster: indexed {n} item(s) for search')
+
+
+def _board_counters():
+    """The per-board counters table (counters.py). _item_progress fills it,
+    since counting reads the items' progress."""
+    from .models import BoardCounter
+    _create_table(BoardCounter)
+
+
+def _item_progress():
+    """Items' derived done / due date columns, then every board's counters."""
+    from . import counters
+    from .migrate_v4 import _ensure_indexes, ensure_schema
+    from .models import Item
+    ensure_schema()
+    _ensure_indexes(Item)
+    n = counters.rebuild()
+    db.session.commit()
+    print(f'TaskMaster: counted {n} board(s)')
+
+
+def _item_list_indexes():
+    """(sort key, id) indexes behind the paged job lists."""
+    from .migrate_v4 import _ensure_indexes
+    from .models import Item
+    _ensure_indexes(Item)
+
+
+def _deferred_work():
+    """The deferred_work queue (deferred.py)."""
+    from .models import DeferredWork
+    _create_table(DeferredWork)
+
+
+def _email_outbox():
+    """The email_outbox table (emailer.py)."""
+    from .models import EmailOutbox
+    _create_table(EmailOutbox)
+
+
+def _email_digests():
+    """Users' notification digest setting and how far their digests got."""
+    from .migrate_v4 import ensure_schema
+    ensure_schema()
+
+
+MIGRATIONS = [  # (version, step); append only, never renumber
+    (1, _v4_columns),
+    (2, _v2_import),
+    (3, _v4_data),
+    (4, _hot_query_indexes),
+    (5, _search_index),
+    (6, _board_counters),
+    (7, _item_progress),
+    (8, _item_list_indexes),
+    (9, _deferred_work),
+    (10, _email_outbox),
+    (11, _email_digests),
+]
+LATEST = MIGRATIONS[-1][0]
+
+
+def schema_version():
+    """The stored version; 0 for a new or pre-versioning database."""
+    try:
+        return AppSetting.get_json(VERSION_KEY) or 0
+    except DBAPIError:  # no app_settings table yet
+        db.session.rollback()
+        return 0
+
+
+def run_migrations():
+    """Bring the database up to LATEST. Call with the startup lock held."""
+    current = schema_version()
+    if current >= LATEST:
+        return
+    db.create_all()
+    for version, step in MIGRATIONS:
+        if version <= current:
+            continue
+        step()
+        AppSetting.set_json(VERSION_KEY, version)
+        db.session.commit()
+    print(f'TaskMaster: database schema at version {LATEST} (was {current})')
@@ -1,5 +1,7 @@
 import json
-from datetime import datetime
+from datetime import date, datetime
+
+from sqlalchemy.orm import validates
 
 from .db import db
 
@@ -27,6 +29,10 @@ class User(db.Model):
     # set when an admin gives them a (temporary) password; forces a change on next login
     must_change_password = db.Column(db.Boolean, default=False)
     email_notifications = db.Column(db.Boolean, default=True)  # mail me my notifications
+    # immediate | hourly | daily: each one as it happens, or one digest per window
+    email_digest = db.Column(db.String(10), default='immediate')
+    digest_sent_at = db.Column(db.DateTime)
+    digest_last_id = db.Column(db.Integer)  # newest notification already emailed
     totp_secret = db.Column(db.String(64))  # set = two-factor codes required at login
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=utcnow)
@@ -44,6 +50,7 @@ class User(db.Model):
             'hide_done': bool(self.hide_done),
             'must_change_password': bool(self.must_change_password),
             'email_notifications': self.email_notifications is None or bool(self.email_notifications),
+            'email_digest': self.email_digest or 'immediate',
             'totp_enabled': bool(self.totp_secret),
             'auth_source': self.auth_source or 'local',
             'has_password': bool(self.password_hash),
@@ -149,12 +156,22 @@ class Item(db.Model):
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
     # lightweight checklist: JSON [{"id", "text", "done"}]
     checklist = db.Column(db.Text)
+    # derived from the status and date values on every write (counters.py):
+    # a "Done" status label, and the earliest date
+    done = db.Column(db.Boolean, default=False)
+    due_date = db.Column(db.Date)
     created_at = db.Column(db.DateTime, default=utcnow)
     updated_at = db.Column(db.DateTime, default=utcnow, onupdate=utcnow)
 
     __table_args__ = (
-        db.Index('idx_items_board', 'board_id'),
+        # board_id first so it also serves every plain board_id filter
+        db.Index('idx_items_board_parent', 'board_id', 'parent_id', 'position'),
+        db.Index('idx_items_board_done', 'board_id', 'done', 'due_date'),
         db.Index('idx_items_group', 'group_id'),
+        # keyset pages of the cross-board lists (api/misc.py SORTS)
+        db.Index('idx_items_updated', 'updated_at', 'id'),
+        db.Index('idx_items_due', 'due_date', 'id'),
+        db.Index('idx_items_name', 'name', 'id'),
     )
 
     def checklist_list(self):
@@ -190,13 +207,30 @@ class ItemValue(db.Model):
     item_id = db.Column(db.Integer, db.ForeignKey('items.id', ondelete='CASCADE'), nullable=False)
     column_id = db.Column(db.Integer, db.ForeignKey('board_columns.id', ondelete='CASCADE'), nullable=False)
     value = db.Column(db.Text, default='{}')
+    # typed copies of the JSON value, derived on every write (see below), so
+    # status / due date / number filters run as indexed SQL
+    label_id = db.Column(db.String(40))
+    date_value = db.Column(db.Date)
+    number_value = db.Column(db.Float)
 
     __table_args__ = (
         db.UniqueConstraint('item_id', 'column_id', name='uq_item_column'),
         db.Index('idx_values_item', 'item_id'),
-        db.Index('idx_values_column', 'column_id'),
+        db.Index('idx_values_column_item', 'column_id', 'item_id'),
+        db.Index('idx_values_label', 'column_id', 'label_id'),
+        db.Index('idx_values_date', 'column_id', 'date_value'),
+        db.Index('idx_values_number', 'column_id', 'number_value'),
     )
 
+    @validates('value')
+    def _derive_typed(self, key, value):
+        try:
+            parsed = json.loads(value or '{}')
+        except (TypeError, ValueError):
+            parsed = {}
+        self.label_id, self.date_value, self.number_value = typed_value_fields(parsed)
+        return value
+
     def value_dict(self):
         try:
             return json.loads(self.value or '{}')
@@ -204,6 +238,123 @@ class ItemValue(db.Model):
             return {}
 
 
+def typed_value_fields(value):
+    """(label_id, date, number) carried by a column value dict — the indexed
+    columns of ItemValue. Anything missing or malformed comes back as None."""
+    if not isinstance(value, dict):
+        return None, None, None
+    label_id = value.get('id')
+    label_id = str(label_id)[:40] if label_id not in (None, '') else None
+    try:
+        due = date.fromisoformat(str(value['date'])[:10]) if value.get('date') else None
+    except ValueError:
+        due = None
+    number = value.get('number')
+    try:
+        number = float(number) if number not in (None, '') and not isinstance(number, bool) else None
+    except (TypeError, ValueError):
+        number = None
+    return label_id, due, number
+
+
+class ItemAssignee(db.Model):
+    """Inverted index of people-column values: one row per (item, person,
+    column). Kept in step with ItemValue by services.sync_assignees, so
+    "which items is this user assigned to" is a single indexed lookup."""
+    __tablename__ = 'item_assignees'
+    item_id = db.Column(db.Integer, db.ForeignKey('items.id', ondelete='CASCADE'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    column_id = db.Column(db.Integer, db.ForeignKey('board_columns.id', ondelete='CASCADE'),
+                          primary_key=True)
+
+    __table_args__ = (db.Index('idx_assignees_user', 'user_id', 'item_id'),)
+
+
+class BoardChange(db.Model):
+    """Append-only per-board change log behind delta sync (see changefeed.py).
+    The id is the change cursor; AUTOINCREMENT keeps it from ever going back
+    once old rows are pruned."""
+    __tablename__ = 'board_changes'
+    id = db.Column(db.Integer, primary_key=True)
+    board_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(10), nullable=False)  # 'board' | 'group' | 'column' | 'item'
+    row_id = db.Column(db.Integer, nullable=False)
+    deleted = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=utcnow)
+
+    __table_args__ = (
+        db.Index('idx_board_changes_board', 'board_id', 'id'),
+        {'sqlite_autoincrement': True},
+    )
+
+
+class BoardCounter(db.Model):
+    """Precomputed per-board totals for the sidebar and dashboard, rewritten
+    in the same transaction as any write that moves them (see counters.py).
+    `overdue` is as of `counted_on`; the daily job recounts it."""
+    __tablename__ = 'board_counters'
+    board_id = db.Column(db.Integer, primary_key=True)
+    jobs = db.Column(db.Integer, default=0)
+    tasks = db.Column(db.Integer, default=0)
+    done = db.Column(db.Integer, default=0)
+    overdue = db.Column(db.Integer, default=0)
+    updates = db.Column(db.Integer, default=0)
+    files = db.Column(db.Integer, default=0)
+    counted_on = db.Column(db.Date)
+
+
+class BusMessage(db.Model):
+    """Cross-worker message for the 'table' event bus backend (see bus.py).
+    Short-lived: every worker polls past it within a fraction of a second and
+    rows older than a few minutes are swept."""
+    __tablename__ = 'bus_messages'
+    id = db.Column(db.Integer, primary_key=True)
+    origin = db.Column(db.String(32), nullable=False)  # sending process
+    channel = db.Column(db.String(40), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=utcnow)
+
+    __table_args__ = ({'sqlite_autoincrement': True},)
+
+
+class DeferredWork(db.Model):
+    """Follow-up work a request queued in its own transaction and the
+    deferred.py workers run after it commits (automations, notifications).
+    Deleted once done; kept with status 'failed' after the last retry."""
+    __tablename__ = 'deferred_work'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(40), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending | failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_after = db.Column(db.DateTime, default=utcnow)
+    claimed_by = db.Column(db.String(32))
+    claimed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=utcnow)
+
+    __table_args__ = (db.Index('idx_deferred_due', 'status', 'run_after', 'id'),)
+
+
+class EmailOutbox(db.Model):
+    """An email waiting for the emailer.py senders. Deleted once the SMTP
+    server takes it; kept with status 'failed' after the last retry."""
+    __tablename__ = 'email_outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    to_addr = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending | failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_after = db.Column(db.DateTime, default=utcnow)
+    claimed_by = db.Column(db.String(32))
+    claimed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=utcnow)
+
+    __table_args__ = (db.Index('idx_email_outbox_due', 'status', 'run_after', 'id'),)
+
+
 class ItemUpdate(db.Model):
     __tablename__ = 'item_updates'
     id = db.Column(db.Integer, primary_key=True)
@@ -237,7 +388,10 @@ class FileAsset(db.Model):
     file_size = db.Column(db.Integer)
     created_at = db.Column(db.DateTime, default=utcnow)
 
-    __table_args__ = (db.Index('idx_files_item', 'item_id'),)
+    __table_args__ = (
+        db.Index('idx_files_item', 'item_id'),
+        db.Index('idx_files_filename', 'filename'),  # trash purge: is a stored file still used?
+    )
 
     def to_dict(self):
         return {
@@ -266,9 +420,10 @@ class Activity(db.Model):
     # Index names must not collide with the v2 indexes that may still exist in
     # the same SQLite file (idx_activity_* on the old activity_log table).
     __table_args__ = (
-        db.Index('idx_v3_activity_board', 'board_id'),
+        db.Index('idx_v3_activity_board_created', 'board_id', 'created_at'),
         db.Index('idx_v3_activity_item', 'item_id'),
         db.Index('idx_v3_activity_created', 'created_at'),
+        db.Index('idx_v3_activity_audit', 'action', 'company_id', 'created_at'),
     )
 
     def to_dict(self):
@@ -296,7 +451,10 @@ class Notification(db.Model):
     read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=utcnow)
 
-    __table_args__ = (db.Index('idx_notifications_user', 'user_id', 'read'),)
+    __table_args__ = (
+        db.Index('idx_notifications_user', 'user_id', 'read'),
+        db.Index('idx_notifications_user_created', 'user_id', 'created_at'),
+    )
 
     def to_dict(self):
         return {
@@ -409,6 +567,7 @@ class AccessGrant(db.Model):
     __table_args__ = (
         db.UniqueConstraint('user_id', 'scope_type', 'scope_id', name='uq_grant'),
         db.Index('idx_grants_user', 'user_id'),
+        db.Index('idx_grants_scope', 'scope_type', 'scope_id'),
     )
 
     def to_dict(self):
@@ -7,9 +7,16 @@ Rules:
 - member sees only what an AccessGrant covers (company / department / board /
   single item) — plus items they are assigned to via a people column.
 """
+import itertools
+
+import flask
+from sqlalchemy import event, select, union
+from sqlalchemy.orm import Session, aliased
+
+from . import bus
 from .db import db
-from .models import (AccessGrant, Board, BoardColumn, Company, Department,
-                     Item, ItemValue, Role, User)
+from .models import (AccessGrant, Board, Company, Department, Item,
+                     ItemAssignee, Role, User)
 
 # Capability keys a role can carry
 CAP_CREATE = 'create_jobs'      # add jobs / sub-tasks
@@ -33,40 +40,192 @@ def is_super(user):
     return user.role == 'super_admin'
 
 
+class AccessContext:
+    """Everything the permission helpers need to know about one user, loaded
+    once and memoized for the rest of the request (see access_context).
+
+    Grants are read in a single query; the wider sets (boards covered by
+    company/department grants, single-job grants and assignments grouped by
+    board) are expanded lazily the first time something asks for them, so a
+    sidebar load over hundreds of boards costs a fixed handful of queries."""
+
+    def __init__(self, user):
+        self.user = user
+        self.grants = AccessGrant.query.filter_by(user_id=user.id).all()
+        self.all_access = any(g.scope_type == 'all' for g in self.grants)
+        self.item_grant_ids = {g.scope_id for g in self.grants if g.scope_type == 'item'}
+        self._caps = None
+        self._managed = None
+        self._board_ids = None
+        self._item_grants_by_board = None
+        self._assigned_by_board = None
+        self._board_access = {}
+        self._visible = {}
+
+    @property
+    def caps(self):
+        if self._caps is None:
+            user = self.user
+            self._caps = LEVEL_CAPS.get(user.role, set())
+            if user.custom_role_id:
+                r = db.session.get(Role, user.custom_role_id)
+                if r:
+                    self._caps = set(r.permission_list())
+        return self._caps
+
+    def managed_company_ids(self):
+        if self._managed is None:
+            if self.user.role != 'admin':
+                self._managed = set()
+            elif self.all_access:
+                self._managed = {cid for (cid,) in db.session.query(Company.id)}
+            else:
+                self._managed = {g.scope_id for g in self.grants if g.scope_type == 'company'}
+        return self._managed
+
+    def granted_board_ids(self):
+        """Board ids covered by full-board-or-wider grants."""
+        if self._board_ids is not None:
+            return self._board_ids
+        if self.all_access:
+            self._board_ids = {bid for (bid,) in db.session.query(Board.id)}
+            return self._board_ids
+        grants = self.grants
+        company_ids = {g.scope_id for g in grants if g.scope_type == 'company'}
+        dept_ids = {g.scope_id for g in grants if g.scope_type == 'department'}
+        board_ids = {g.scope_id for g in grants if g.scope_type == 'board'}
+        if self.user.role == 'company_admin' and self.user.company_id:
+            company_ids.add(self.user.company_id)
+        if company_ids:
+            dept_ids |= {did for (did,) in db.session.query(Department.id).filter(
+                Department.company_id.in_(company_ids))}
+        if dept_ids or company_ids:
+            board_ids |= {bid for (bid,) in db.session.query(Board.id).filter(db.or_(
+                Board.department_id.in_(dept_ids) if dept_ids else db.false(),
+                Board.company_id.in_(company_ids) if company_ids else db.false()))}
+        self._board_ids = board_ids
+        return board_ids
+
+    def item_grants_by_board(self):
+        """{board_id: {item_id}} for single-job grants."""
+        if self._item_grants_by_board is None:
+            out = {}
+            if self.item_grant_ids:
+                for iid, bid in db.session.query(Item.id, Item.board_id).filter(
+                        Item.id.in_(self.item_grant_ids)):
+                    out.setdefault(bid, set()).add(iid)
+            self._item_grants_by_board = out
+        return self._item_grants_by_board
+
+    def assigned_by_board(self):
+        """{board_id: {item_id}} for items where the user is in a people column."""
+        if self._assigned_by_board is None:
+            out = {}
+            rows = (db.session.query(ItemAssignee.item_id, Item.board_id)
+                    .join(Item, Item.id == ItemAssignee.item_id)
+                    .filter(ItemAssignee.user_id == self.user.id))
+            for iid, bid in rows:
+                out.setdefault(bid, set()).add(iid)
+            self._assigned_by_board = out
+        return self._assigned_by_board
+
+    def board_access(self, board):
+        if board.id not in self._board_access:
+            if is_super(self.user) or board.id in self.granted_board_ids():
+                access = 'full'
+            elif (board.id in self.item_grants_by_board()
+                  or board.id in self.assigned_by_board()):
+                access = 'partial'
+            else:
+                access = None
+            self._board_access[board.id] = access
+        return self._board_access[board.id]
+
+    def visible_item_ids(self, board):
+        if board.id not in self._visible:
+            self._visible[board.id] = self._compute_visible(board)
+        return self._visible[board.id]
+
+    def _compute_visible(self, board):
+        access = self.board_access(board)
+        if access == 'full':
+            return None
+        if access is None:
+            return set()
+        ids = set(self.item_grants_by_board().get(board.id, ()))
+        ids |= self.assigned_by_board().get(board.id, set())
+        # roll visibility up/down the parent-child chain
+        parents = dict(db.session.query(Item.id, Item.parent_id)
+                       .filter(Item.board_id == board.id))
+        # a visible sub-item reveals its parent (as context)
+        for iid in list(ids):
+            pid = parents.get(iid)
+            while pid and pid not in ids:
+                ids.add(pid)
+                pid = parents.get(pid)
+        # a visible parent reveals its sub-items
+        changed = True
+        while changed:
+            changed = False
+            for iid, pid in parents.items():
+                if pid in ids and iid not in ids:
+                    ids.add(iid)
+                    changed = True
+        return ids
+
+
+def access_context(user):
+    """The user's AccessContext for the current request, built on first use.
+    Outside an application context a fresh, unshared one is returned."""
+    if not flask.has_app_context():
+        return AccessContext(user)
+    cache = flask.g.setdefault('access_contexts', {})
+    ctx = cache.get(user.id)
+    if ctx is None or ctx.user is not user:
+        ctx = cache[user.id] = AccessContext(user)
+    return ctx
+
+
+def forget_access(user_id=None):
+    """Drop memoized access for one user (or everyone) after grants, roles or
+    assignments change mid-request."""
+    if not flask.has_app_context():
+        return
+    cache = flask.g.get('access_contexts')
+    if cache is None:
+        return
+    if user_id is None:
+        cache.clear()
+    else:
+        cache.pop(user_id, None)
+
+
 def caps(user):
     """Effective capability set: custom role if assigned, else base level."""
-    if user.custom_role_id:
-        r = db.session.get(Role, user.custom_role_id)
-        if r:
-            return set(r.permission_list())
-    return LEVEL_CAPS.get(user.role, set())
+    return set(access_context(user).caps)
 
 
 def has_cap(user, cap):
-    return cap in caps(user)
+    return cap in access_context(user).caps
 
 
 def can_write(user):
     """Users whose role carries no capabilities are read-only everywhere."""
-    return bool(caps(user))
+    return bool(access_context(user).caps)
 
 
 def user_grants(user):
-    return AccessGrant.query.filter_by(user_id=user.id).all()
+    return access_context(user).grants
 
 
 def has_all_access(user):
     """IT staff granted every company ('all sites')."""
-    return any(g.scope_type == 'all' for g in user_grants(user))
+    return access_context(user).all_access
 
 
 def managed_company_ids(user):
     """Companies an IT-staff admin manages (via 'all' or company grants)."""
-    if user.role != 'admin':
-        return set()
-    if has_all_access(user):
-        return {c.id for c in Company.query.all()}
-    return {g.scope_id for g in user_grants(user) if g.scope_type == 'company'}
+    return set(access_context(user).managed_company_ids())
 
 
 def board_company_id(board):
@@ -78,90 +237,83 @@ def board_company_id(board):
 
 def _granted_board_ids(user):
     """Board ids covered by full-board-or-wider grants."""
-    grants = user_grants(user)
-    if any(g.scope_type == 'all' for g in grants):
-        return {b.id for b in Board.query.all()}
-    company_ids = {g.scope_id for g in grants if g.scope_type == 'company'}
-    dept_ids = {g.scope_id for g in grants if g.scope_type == 'department'}
-    board_ids = {g.scope_id for g in grants if g.scope_type == 'board'}
-    if user.role == 'company_admin' and user.company_id:
-        company_ids.add(user.company_id)
-    if company_ids:
-        dept_ids |= {d.id for d in Department.query.filter(
-            Department.company_id.in_(company_ids)).all()}
-    if dept_ids:
-        board_ids |= {b.id for b in Board.query.filter(
-            Board.department_id.in_(dept_ids)).all()}
-    if company_ids:
-        board_ids |= {b.id for b in Board.query.filter(
-            Board.company_id.in_(company_ids)).all()}
-    return board_ids
+    return access_context(user).granted_board_ids()
 
 
 def _assigned_item_ids_on_board(user, board_id):
     """Items on a board where the user appears in a people column."""
-    people_cols = [c.id for c in BoardColumn.query.filter_by(
-        board_id=board_id, type='people').all()]
-    if not people_cols:
-        return set()
-    out = set()
-    for v in ItemValue.query.filter(ItemValue.column_id.in_(people_cols)).all():
-        if user.id in (v.value_dict().get('user_ids') or []):
-            out.add(v.item_id)
-    return out
+    return access_context(user).assigned_by_board().get(board_id, set())
 
 
 def board_access(user, board):
     """Returns 'full', 'partial' (some items only), or None."""
-    if is_super(user):
-        return 'full'
-    if board.id in _granted_board_ids(user):
-        return 'full'
-    item_grants = AccessGrant.query.filter_by(user_id=user.id, scope_type='item').all()
-    if item_grants:
-        granted_items = Item.query.filter(
-            Item.id.in_([g.scope_id for g in item_grants]),
-            Item.board_id == board.id).first()
-        if granted_items:
-            return 'partial'
-    if _assigned_item_ids_on_board(user, board.id):
-        return 'partial'
-    return None
+    return access_context(user).board_access(board)
 
 
 def visible_item_ids(user, board):
     """None means all items visible; otherwise the set of visible item ids
-    (including their sub-items)."""
-    access = board_access(user, board)
-    if access == 'full':
+    (including their sub-items). The set is shared with the request's access
+    context — treat it as read-only."""
+    return access_context(user).visible_item_ids(board)
+
+
+def visible_board_ids(user):
+    """Boards on which the user sees at least part of the items, or None
+    when the user sees every board."""
+    ctx = access_context(user)
+    if is_super(user) or ctx.all_access:
         return None
-    if access is None:
-        return set()
-    ids = set()
-    item_grants = AccessGrant.query.filter_by(user_id=user.id, scope_type='item').all()
-    if item_grants:
-        for i in Item.query.filter(Item.id.in_([g.scope_id for g in item_grants]),
-                                   Item.board_id == board.id).all():
-            ids.add(i.id)
-    ids |= _assigned_item_ids_on_board(user, board.id)
-    # roll visibility up/down the parent-child chain
-    all_items = Item.query.filter_by(board_id=board.id).all()
-    by_id = {i.id: i for i in all_items}
-    # a visible sub-item reveals its parent (as context)
-    for iid in list(ids):
-        item = by_id.get(iid)
-        while item and item.parent_id and item.parent_id not in ids:
-            ids.add(item.parent_id)
-            item = by_id.get(item.parent_id)
-    # a visible parent reveals its sub-items
-    changed = True
-    while changed:
-        changed = False
-        for i in all_items:
-            if i.parent_id in ids and i.id not in ids:
-                ids.add(i.id)
-                changed = True
-    return ids
+    return (ctx.granted_board_ids() | set(ctx.item_grants_by_board())
+            | set(ctx.assigned_by_board()))
+
+
+# --- Visibility as SQL -----------------------------------------------------
+# The same rules as AccessContext, as subqueries the database evaluates in the
+# query that lists items, instead of id sets built in Python and bound back in.
+
+def full_boards_query(user):
+    """SELECT of the board ids the user sees in full (a grant on the board or
+    on its department or company), or None when that is every board."""
+    if is_super(user) or has_all_access(user):
+        return None
+    grants = select(AccessGrant.scope_id).where(AccessGrant.user_id == user.id)
+    companies = grants.where(AccessGrant.scope_type == 'company')
+    own = user.company_id if user.role == 'company_admin' else None
+
+    def in_company(column):
+        return db.or_(column.in_(companies), column == own) if own else column.in_(companies)
+
+    depts = select(Department.id).where(db.or_(
+        Department.id.in_(grants.where(AccessGrant.scope_type == 'department')),
+        in_company(Department.company_id)))
+    return select(Board.id).where(db.or_(
+        Board.id.in_(grants.where(AccessGrant.scope_type == 'board')),
+        Board.department_id.in_(depts),
+        in_company(Board.company_id)))
+
+
+def assigned_items_query(user):
+    """SELECT of the ids of items with the user in a people column."""
+    return select(ItemAssignee.item_id).where(ItemAssignee.user_id == user.id)
+
+
+def visible_item_filter(user, item=Item):
+    """SQL condition on `item` (Item or an alias) matching visible_item_ids
+    on every board at once: full boards, plus single-job grants and
+    assignments rolled up to the parent job and down to its sub-tasks. None
+    when the user sees everything."""
+    full = full_boards_query(user)
+    if full is None:
+        return None
+    direct = (select(AccessGrant.scope_id).where(AccessGrant.user_id == user.id,
+                                                 AccessGrant.scope_type == 'item'),
+              assigned_items_query(user))
+    # a visible sub-task shows its job; a visible job shows its sub-tasks
+    # (sub-tasks don't nest, so one step each way covers the chain)
+    owner = aliased(Item)
+    shown = union(*direct, select(owner.parent_id).where(
+        owner.id.in_(union(*direct)), owner.parent_id.isnot(None)))
+    return db.or_(item.board_id.in_(full), item.id.in_(shown), item.parent_id.in_(shown))
 
 
 def can_view_item(user, item):
@@ -204,34 +356,29 @@ def can_manage_user(actor, target):
 def accessible_companies(user):
     if is_super(user) or has_all_access(user):
         return Company.query.order_by(Company.position, Company.id).all()
-    company_ids = set()
-    company_ids |= managed_company_ids(user)
+    ctx = access_context(user)
+    company_ids = set(ctx.managed_company_ids())
     if user.company_id and user.role == 'company_admin':
         company_ids.add(user.company_id)
-    for g in user_grants(user):
+    board_ids = {g.scope_id for g in ctx.grants if g.scope_type == 'board'}
+    for g in ctx.grants:
         if g.scope_type == 'company':
             company_ids.add(g.scope_id)
         elif g.scope_type == 'department':
             d = db.session.get(Department, g.scope_id)
             if d:
                 company_ids.add(d.company_id)
-        elif g.scope_type == 'board':
-            b = db.session.get(Board, g.scope_id)
-            if b:
-                cid = board_company_id(b)
-                if cid:
-                    company_ids.add(cid)
-        elif g.scope_type == 'item':
-            i = db.session.get(Item, g.scope_id)
-            if i:
-                b = db.session.get(Board, i.board_id)
-                cid = board_company_id(b) if b else None
-                if cid:
-                    company_ids.add(cid)
-    # assignment-based visibility can reach boards with no explicit grant
-    for b in Board.query.all():
-        if b.id not in _granted_board_ids(user) and _assigned_item_ids_on_board(user, b.id):
-            cid = board_company_id(b)
+    # single-job grants, and assignment-based visibility that can reach boards
+    # with no explicit grant
+    board_ids |= set(ctx.item_grants_by_board())
+    board_ids |= set(ctx.assigned_by_board()) - ctx.granted_board_ids()
+    if board_ids:
+        boards = Board.query.filter(Board.id.in_(board_ids)).all()
+        dept_company = dict(db.session.query(Department.id, Department.company_id).filter(
+            Department.id.in_({b.department_id for b in boards if b.department_id})))
+        for b in boards:
+            # board_company_id, with the departments fetched in one query
+            cid = dept_company.get(b.department_id, b.company_id)
             if cid:
                 company_ids.add(cid)
     if not company_ids:
@@ -291,6 +438,97 @@ def can_grant_in_company(actor, company_id):
     return False
 
 
+# board id -> (board-wide user ids, {item_id: [user ids]}). Shared across
+# requests; any change to grants, users, board placement or sub-tasks
+# clears it on commit (see _note_assignable_change below).
+_assignable_cache = {}
+_assignable_generation = [0]
+_ASSIGNABLE_INPUTS = (AccessGrant, User, Board, Department)
+
+
+def _assignable_ids(board):
+    generation = _assignable_generation[0]
+    # uncommitted changes in this session bypass the shared cache
+    shareable = not db.session.info.get('assignable_stale')
+    cached = _assignable_cache.get(board.id) if shareable else None
+    if cached is not None:
+        return cached
+    company_id = board_company_id(board)
+    covering = {cid for cid in (company_id, board.company_id) if cid}
+    scopes = [AccessGrant.scope_type == 'all',
+              db.and_(AccessGrant.scope_type == 'board', AccessGrant.scope_id == board.id)]
+    if covering:
+        scopes.append(db.and_(AccessGrant.scope_type == 'company',
+                              AccessGrant.scope_id.in_(covering)))
+    if board.department_id:
+        scopes.append(db.and_(AccessGrant.scope_type == 'department',
+                              AccessGrant.scope_id == board.department_id))
+    granted = {uid for (uid,) in db.session.query(AccessGrant.user_id).filter(db.or_(*scopes))}
+    active = (db.session.query(User.id, User.company_id, User.role)
+              .filter_by(is_active=True).order_by(User.id).all())
+    board_wide = [uid for uid, cid, role in active
+                  if cid == company_id or role == 'super_admin' or uid in granted
+                  or (role == 'company_admin' and cid in covering)]
+    # single-job grants on this board (and the sub-tasks under those jobs)
+    wide = set(board_wide)
+    jobs_by_user = {}
+    for uid, iid in (db.session.query(AccessGrant.user_id, Item.id)
+                     .join(Item, Item.id == AccessGrant.scope_id)
+                     .filter(AccessGrant.scope_type == 'item', Item.board_id == board.id)
+                     .order_by(Item.id)):
+        if uid not in wide:
+            jobs_by_user.setdefault(uid, []).append(iid)
+    subs = {}
+    job_ids = {iid for jobs in jobs_by_user.values() for iid in jobs}
+    if job_ids:
+        for iid, pid in (db.session.query(Item.id, Item.parent_id)
+                         .filter(Item.parent_id.in_(job_ids)).order_by(Item.id)):
+            subs.setdefault(pid, []).append(iid)
+    item_extra = {}
+    for uid, _cid, _role in active:
+        for job_id in jobs_by_user.get(uid, []):
+            item_extra.setdefault(job_id, []).append(uid)
+            for sub_id in subs.get(job_id, []):
+                item_extra.setdefault(sub_id, []).append(uid)
+    result = (board_wide, item_extra)
+    if shareable and generation == _assignable_generation[0]:
+        _assignable_cache[board.id] = result
+    return result
+
+
+def invalidate_assignable():
+    _assignable_generation[0] += 1
+    _assignable_cache.clear()
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_assignable_change(session, flush_context):
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, _ASSIGNABLE_INPUTS) \
+                or (isinstance(obj, Item) and obj.parent_id and obj in session.new):
+            session.info['assignable_stale'] = True
+            return
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _note_assignable_bulk_change(state):
+    if (state.is_update or state.is_delete) and state.bind_mapper is not None \
+            and state.bind_mapper.class_ in _ASSIGNABLE_INPUTS:
+        state.session.info['assignable_stale'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_soft_rollback')
+def _flush_assignable_cache(session, *args):
+    if session.info.pop('assignable_stale', False):
+        bus.send('assignable_stale', None)  # every worker keeps its own cache
+
+
+@bus.handler('assignable_stale')
+def _on_assignable_stale(payload):
+    invalidate_assignable()
+
+
 def board_assignable(board):
     """Who may be assigned/flagged on this board.
 
@@ -300,24 +538,12 @@ def board_assignable(board):
     - per-item: people whose only access is a single-job grant — they are
       assignable on exactly that job (and its sub-tasks)
     """
-    company_id = board_company_id(board)
-    board_users, item_extra = [], {}
-    for u in User.query.filter_by(is_active=True).all():
-        if u.company_id == company_id:
-            board_users.append(u)
-            continue
-        if is_super(u) or board.id in _granted_board_ids(u):
-            board_users.append(u)
-            continue
-        granted_items = [g.scope_id for g in AccessGrant.query.filter_by(
-            user_id=u.id, scope_type='item').all()]
-        if granted_items:
-            jobs = Item.query.filter(Item.id.in_(granted_items),
-                                     Item.board_id == board.id).all()
-            for job in jobs:
-                item_extra.setdefault(job.id, []).append(u)
-                for sub in Item.query.filter_by(parent_id=job.id).all():
-                    item_extra.setdefault(sub.id, []).append(u)
+    board_ids, extra_ids = _assignable_ids(board)
+    wanted = set(board_ids) | {uid for ids in extra_ids.values() for uid in ids}
+    users = {u.id: u for u in User.query.filter(User.id.in_(wanted)).all()} if wanted else {}
+    board_users = [users[uid] for uid in board_ids if uid in users]
+    item_extra = {iid: [users[uid] for uid in ids if uid in users]
+                  for iid, ids in extra_ids.items()}
     return board_users, item_extra
 
 
@@ -326,10 +552,8 @@ def eligible_assignee_ids(item):
     board = db.session.get(Board, item.board_id)
     if not board:
         return set()
-    board_users, item_extra = board_assignable(board)
-    ids = {u.id for u in board_users}
-    ids |= {u.id for u in item_extra.get(item.id, [])}
-    return ids
+    board_ids, extra_ids = _assignable_ids(board)
+    return set(board_ids) | set(extra_ids.get(item.id, []))
 
 
 def can_create_board_in(user, company_id, dept_id=None):
@@ -0,0 +1,26 @@
+"""Advisory file locks that coordinate gunicorn worker processes: startup
+migrations run one worker at a time and only one worker runs the scheduler.
+Unix only; elsewhere the app runs as a single process anyway."""
+import os
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-Unix development runs
+    fcntl = None
+
+from .config import DATA_DIR
+
+
+def acquire(name, blocking=True):
+    """Lock DATA_DIR/.<name>.lock. Returns the open file — keep it to hold the
+    lock, close it to release — or None when another process holds it and
+    blocking is False. The OS drops the lock if the holder dies."""
+    f = open(os.path.join(DATA_DIR, f'.{name}.lock'), 'a')
+    if fcntl is None:
+        return f
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except OSError:
+        f.close()
+        return None
+    return f
@@ -1,46 +1,255 @@
-"""In-process pub/sub event bus feeding Server-Sent Events streams.
+"""Pub/sub registry feeding Server-Sent Events streams.
 
-Runs single-worker (multi-threaded), so a plain in-memory registry is enough.
+Each worker keeps its own streams in memory; publish() goes out over the
+cross-process bus (bus.py) so every worker delivers to its own streams. A
+stream is either legacy (coarse `board_changed` hints, the client refetches)
+or typed (row-level events such as `value_set`, see changefeed.py). Typed
+streams only get row events for the boards they watch.
+
+Streams are indexed by user and by watched board, so a publish only touches
+the queues that care about it.
 """
 import json
-import queue
+import secrets
 import threading
+import time
+from collections import deque
+
+from . import bus
 
 _lock = threading.Lock()
-_subscribers = []  # list of (queue.Queue, user_id)
+_streams = {}     # stream id -> Subscriber
+_by_user = {}     # user id -> {Subscriber}
+_by_board = {}    # board id -> {typed Subscriber watching it}
+_firehose = set()  # legacy streams: every untargeted event
+
+
+COALESCE_SECONDS = 0.25  # refetch hints wait this long for repeats to merge into
+MAILBOX_SIZE = 200
+
+
+def _coalesce_key(event):
+    """Events that supersede an earlier queued one with the same key: refetch
+    hints merge, row events keep only the latest state."""
+    t = event.get('type')
+    if t == 'board_changed':
+        return (t, event.get('board_id'))
+    if t == 'notification':
+        return (t,)
+    if t == 'value_set':
+        return (t, event.get('item_id'), event.get('column_id'))
+    if t in ('item_moved', 'item_updated'):
+        return (t, event.get('item_id'))
+    return None
+
+
+class Mailbox:
+    """A stream's pending events. Repeats coalesce while queued (refetch hints
+    are held COALESCE_SECONDS so a burst becomes one frame). When a slow
+    client lets MAILBOX_SIZE events pile up, the backlog is dropped and the
+    client gets a single `resync` event instead of silently missing changes."""
+
+    def __init__(self, maxsize=MAILBOX_SIZE):
+        self.maxsize = maxsize
+        self._cond = threading.Condition()
+        self._slots = deque()  # [key, event, due]
+        self._keyed = {}       # coalesce key -> its queued slot
+        self._overflow = False
+
+    def put(self, event):
+        key = _coalesce_key(event)
+        with self._cond:
+            slot = self._keyed.get(key) if key else None
+            if slot is not None:
+                slot[1] = event
+                return
+            if len(self._slots) >= self.maxsize:
+                self._slots.clear()
+                self._keyed.clear()
+                self._overflow = True
+            hint = key is not None and key[0] in ('board_changed', 'notification')
+            slot = [key, event, time.monotonic() + COALESCE_SECONDS if hint else 0]
+            self._slots.append(slot)
+            if key:
+                self._keyed[key] = slot
+            self._cond.notify()
+
+    def poll(self):
+        """(event, None) when one is ready, else (None, seconds until the
+        next held hint is due, or None when empty). Never blocks."""
+        with self._cond:
+            return self._poll()
+
+    def _poll(self):
+        if self._overflow:
+            self._overflow = False
+            return {'type': 'resync'}, None
+        if not self._slots:
+            return None, None
+        key, event, due = self._slots[0]
+        wait = due - time.monotonic()
+        if wait > 0:
+            return None, wait
+        self._slots.popleft()
+        if key:
+            del self._keyed[key]
+        return event, None
+
+    def get(self, timeout):
+        """Next event, or None after `timeout` seconds with nothing to send."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                event, wait = self._poll()
+                if event is not None:
+                    return event
+                left = deadline - time.monotonic()
+                if wait is None and left <= 0:
+                    return None
+                self._cond.wait(wait if wait is not None else left)
+
+
+class Subscriber:
+    __slots__ = ('id', 'mailbox', 'user_id', 'typed', 'boards', 'wake')
+
+    def __init__(self, user_id, typed):
+        self.id = secrets.token_urlsafe(12)
+        self.mailbox = Mailbox()
+        self.user_id = user_id
+        self.typed = typed
+        self.boards = set()
+        self.wake = None  # called after each put, for readers that can't block on the mailbox
+
+
+def subscribe(user_id, typed=False, boards=()):
+    sub = Subscriber(user_id, typed)
+    with _lock:
+        _streams[sub.id] = sub
+        _by_user.setdefault(user_id, set()).add(sub)
+        if not typed:
+            _firehose.add(sub)
+    for board_id in boards:
+        watch(sub.id, user_id, board_id)
+    return sub
+
+
+def unsubscribe(sub):
+    with _lock:
+        _streams.pop(sub.id, None)
+        _discard(_by_user, sub.user_id, sub)
+        for board_id in sub.boards:
+            _discard(_by_board, board_id, sub)
+        _firehose.discard(sub)
 
 
-def subscribe(user_id):
-    q = queue.Queue(maxsize=200)
+def _discard(index, key, sub):
+    subs = index.get(key)
+    if subs is not None:
+        subs.discard(sub)
+        if not subs:
+            del index[key]
+
+
+def watch(stream_id, user_id, board_id, on=True):
+    """Start (or with on=False stop) sending a typed stream the row events of
+    a board. The caller checks board access. A stream this process doesn't
+    hold may live in another worker or the SSE gateway: with a shared bus the
+    request is passed on and accepted, otherwise False means unknown/foreign."""
+    if _set_watch(stream_id, user_id, board_id, on):
+        return True
+    if not bus.shared():
+        return False
+    bus.send('watch', {'stream_id': stream_id, 'user_id': user_id,
+                       'board_id': board_id, 'on': on})
+    return True
+
+
+def unwatch(stream_id, user_id, board_id):
+    return watch(stream_id, user_id, board_id, on=False)
+
+
+@bus.handler('watch')
+def _watch_message(msg):
+    _set_watch(msg['stream_id'], msg['user_id'], msg['board_id'], msg['on'])
+
+
+def _set_watch(stream_id, user_id, board_id, on):
+    with _lock:
+        sub = _streams.get(stream_id)
+        if sub is None or sub.user_id != user_id:
+            return False
+        if on and sub.typed:
+            sub.boards.add(board_id)
+            _by_board.setdefault(board_id, set()).add(sub)
+        elif not on:
+            sub.boards.discard(board_id)
+            _discard(_by_board, board_id, sub)
+        return True
+
+
+def typed_user_ids():
+    """Users with at least one typed stream open."""
     with _lock:
-        _subscribers.append((q, user_id))
-    return q
+        return {uid for uid, subs in _by_user.items() if any(s.typed for s in subs)}
 
 
-def unsubscribe(q):
+def board_watchers(board_id):
+    """Users with a typed stream watching the board."""
     with _lock:
-        _subscribers[:] = [(sq, uid) for (sq, uid) in _subscribers if sq is not q]
+        return {s.user_id for s in _by_board.get(board_id, ())}
 
 
-def publish(event, target_user_id=None):
-    """Broadcast an event dict. If target_user_id is set, only that user receives it."""
+def publish(event, target_user_id=None, typed=None, board_id=None):
+    """Broadcast an event dict to every worker. If target_user_id is set, only
+    that user receives it; typed=True/False limits it to typed or legacy
+    streams; board_id limits the typed streams to those watching that board."""
+    bus.send('realtime', {'event': event, 'target_user_id': target_user_id,
+                          'typed': typed, 'board_id': board_id})
+
+
+@bus.handler('realtime')
+def _deliver_message(msg):
+    deliver(msg['event'], msg['target_user_id'], msg['typed'], msg['board_id'])
+
+
+def deliver(event, target_user_id=None, typed=None, board_id=None):
+    """publish() for this worker's streams only."""
     with _lock:
-        subs = list(_subscribers)
-    for q, uid in subs:
-        if target_user_id is not None and uid != target_user_id:
+        if target_user_id is not None:
+            subs = list(_by_user.get(target_user_id, ()))
+        elif typed is False:
+            subs = list(_firehose)
+        elif board_id is not None:
+            subs = list(_firehose) + list(_by_board.get(board_id, ()))
+        else:
+            subs = list(_streams.values())
+    for sub in subs:
+        if typed is not None and sub.typed != typed:
+            continue
+        if board_id is not None and sub.typed and board_id not in sub.boards:
             continue
-        try:
-            q.put_nowait(event)
-        except queue.Full:
-            pass
+        sub.mailbox.put(event)
+        if sub.wake is not None:
+            sub.wake()
+
+
+KEEPALIVE_SECONDS = 25
+KEEPALIVE_FRAME = ': keepalive\n\n'
+
+
+def sse_frame(event):
+    return f'data: {json.dumps(event)}\n\n'
+
+
+def stream_preamble(sub):
+    """Opening frames of a stream. The hello names the stream so the client
+    can watch boards on it."""
+    return ['retry: 3000\n\n', sse_frame({'type': 'hello', 'stream_id': sub.id})]
 
 
-def sse_stream(q):
+def sse_stream(sub):
     """Generator producing SSE frames; heartbeats keep proxies from closing the stream."""
-    yield 'retry: 3000\n\n'
+    yield from stream_preamble(sub)
     while True:
-        try:
-            event = q.get(timeout=25)
-            yield f'data: {json.dumps(event)}\n\n'
-        except queue.Empty:
-            yield ': keepalive\n\n'
+        event = sub.mailbox.get(timeout=KEEPALIVE_SECONDS)
+        yield sse_frame(event) if event is not None else KEEPALIVE_FRAME
@@ -1,23 +1,29 @@
-"""Background scheduler: recurring jobs, due-date reminders, nightly backups.
+"""Background scheduler: recurring jobs, the Home Assistant sensor, email
+digests, due-date reminders, nightly backups.
 
-Runs on a daemon thread inside the single gunicorn worker; every tick is
-wrapped so one bad rule can never kill the loop."""
+Runs on a daemon thread in whichever gunicorn worker holds the scheduler
+lock, so there is exactly one scheduler however many workers run; if that
+worker dies another takes over on its next tick. Every tick is wrapped so one
+bad rule can never kill the loop."""
 import os
 import shutil
 import sqlite3
+import subprocess
 import threading
 import time
 import zipfile
 from datetime import date, datetime, timedelta
 
+from . import digests, proclock
 from .config import DATA_DIR, UPLOAD_DIR
-from .db import db
+from .db import db, is_sqlite
 
 TICK_SECONDS = 300         # check every 5 minutes
 BACKUP_KEEP = 14           # keep two weeks of nightly backups
 BACKUP_DIR = os.path.join(DATA_DIR, 'backups')
 
 _started = False
+_sensor_state = None  # last state pushed to Home Assistant
 
 
 def start_scheduler(app):
@@ -28,12 +34,27 @@ def start_scheduler(app):
 
     def loop():
         time.sleep(20)  # let the app finish booting/migrating first
+        lock = None
         while True:
+            lock = lock or proclock.acquire('scheduler', blocking=False)
+            if lock is None:  # another worker is the scheduler
+                time.sleep(TICK_SECONDS)
+                continue
             try:
                 with app.app_context():
                     run_recurring()
             except Exception as e:  # noqa: BLE001
                 print(f'TaskMaster scheduler (recurring): {e}')
+            try:
+                with app.app_context():
+                    refresh_ha_sensor()
+            except Exception as e:  # noqa: BLE001
+                print(f'TaskMaster scheduler (HA sensor): {e}')
+            try:
+                with app.app_context():
+                    digests.run()
+            except Exception as e:  # noqa: BLE001
+                print(f'TaskMaster scheduler (email digests): {e}')
             try:
                 with app.app_context():
                     run_daily_once()
@@ -80,9 +101,8 @@ def run_recurring():
 
 
 def _create_recurring_item(rule, board):
-    import json
-    from .models import BoardColumn, BoardGroup, Item, ItemValue, JobTemplate, User
-    from .services import apply_template, log_activity, notify_user
+    from .models import BoardColumn, BoardGroup, Item, JobTemplate, User
+    from .services import add_assignee, apply_template, log_activity, notify_users
     group = (BoardGroup.query.filter_by(board_id=board.id)
              .order_by(BoardGroup.position).first())
     if group is None:
@@ -103,16 +123,26 @@ def _create_recurring_item(rule, board):
         people = (BoardColumn.query.filter_by(board_id=board.id, type='people')
                   .order_by(BoardColumn.position).first())
         if people:
-            existing = ItemValue.query.filter_by(item_id=item.id, column_id=people.id).first()
-            ids = set((existing.value_dict().get('user_ids') if existing else None) or [])
-            ids.add(rule.assignee_id)
-            payload = json.dumps({'user_ids': sorted(ids)})
-            if existing:
-                existing.value = payload
-            else:
-                db.session.add(ItemValue(item_id=item.id, column_id=people.id, value=payload))
-        notify_user(rule.assignee_id, None, 'assigned', board.id, item.id,
-                    f'Recurring job "{rule.name}" is ready on {board.name}')
+            add_assignee(item.id, people.id, rule.assignee_id)
+        notify_users([rule.assignee_id], None, 'assigned', board.id, item.id,
+                     f'Recurring job "{rule.name}" is ready on {board.name}')
+
+
+def refresh_ha_sensor():
+    """Push the items sensor to Home Assistant when its numbers have moved
+    since the last tick. Reads the board counters, not the items."""
+    global _sensor_state
+    from . import ha
+    from .counters import totals
+    from .models import Board
+    t = totals()
+    state = (t['jobs'] + t['tasks'], {
+        'friendly_name': 'TaskMaster items', 'done': t['done'], 'overdue': t['overdue'],
+        'boards': Board.query.filter_by(archived=False).count(),
+    })
+    if state != _sensor_state:
+        ha.update_sensor('sensor.taskmaster_items', *state)
+        _sensor_state = state
 
 
 def run_daily_once():
@@ -138,16 +168,24 @@ def run_daily_once():
             print(f'TaskMaster trash: purged {n} entries older than 30 days')
     except Exception as e:  # noqa: BLE001
         print(f'TaskMaster trash purge: {e}')
+    try:
+        from .changefeed import prune_changes
+        prune_changes()
+    except Exception as e:  # noqa: BLE001
+        print(f'TaskMaster change log prune: {e}')
+    try:
+        from .counters import recount_all
+        recount_all()  # yesterday's due dates are overdue today
+        db.session.commit()
+    except Exception as e:  # noqa: BLE001
+        print(f'TaskMaster board counters: {e}')
 
 
 def run_due_reminders():
     """Tell assignees about jobs due tomorrow, due today, and overdue."""
-    from .models import Board, BoardColumn, Item, ItemValue
-    from .services import notify_user
+    from .models import Board, BoardColumn, Item, ItemAssignee, ItemValue
+    from .services import notify_users, run_automations
     today = date.today()
-    date_cols = {c.id: c for c in BoardColumn.query.filter_by(type='date').all()}
-    if not date_cols:
-        return
     status_cols = {}
     done_ids = {}
     for c in BoardColumn.query.filter_by(type='status').all():
@@ -156,26 +194,34 @@ def run_due_reminders():
                           if l.get('label', '').strip().lower() == 'done'}
     boards = {b.id: b for b in Board.query.filter_by(archived=False).all()}
 
-    for v in ItemValue.query.filter(ItemValue.column_id.in_(list(date_cols))).all():
-        d = v.value_dict().get('date')
-        if not d:
-            continue
-        try:
-            due = date.fromisoformat(d)
-        except ValueError:
-            continue
+    # due-date window as an index range scan on the typed date column
+    due_rows = (db.session.query(ItemValue.item_id, ItemValue.date_value)
+                .join(BoardColumn, BoardColumn.id == ItemValue.column_id)
+                .filter(BoardColumn.type == 'date',
+                        ItemValue.date_value.between(today - timedelta(days=30),
+                                                     today + timedelta(days=1)))
+                .all())
+    if not due_rows:
+        return
+    item_ids = {iid for iid, _due in due_rows}
+    items = {i.id: i for i in Item.query.filter(Item.id.in_(item_ids)).all()}
+    # skip jobs already done
+    done_items = {iid for iid, cid, label_id in db.session.query(
+        ItemValue.item_id, ItemValue.column_id, ItemValue.label_id).filter(
+        ItemValue.item_id.in_(item_ids),
+        ItemValue.column_id.in_(list(status_cols.values())))
+        if items.get(iid) and status_cols.get(items[iid].board_id) == cid
+        and label_id in done_ids.get(cid, set())}
+    assignees = {}
+    for iid, uid in db.session.query(ItemAssignee.item_id, ItemAssignee.user_id).filter(
+            ItemAssignee.item_id.in_(item_ids)):
+        assignees.setdefault(iid, set()).add(uid)
+
+    for item_id, due in due_rows:
         delta = (due - today).days
-        if delta > 1 or delta < -30:
-            continue
-        item = db.session.get(Item, v.item_id)
-        if item is None or item.board_id not in boards:
+        item = items.get(item_id)
+        if item is None or item.board_id not in boards or item.id in done_items:
             continue
-        # skip jobs already done
-        scol = status_cols.get(item.board_id)
-        if scol:
-            sval = ItemValue.query.filter_by(item_id=item.id, column_id=scol).first()
-            if sval and sval.value_dict().get('id') in done_ids.get(scol, set()):
-                continue
         board = boards[item.board_id]
         if delta == 1:
             msg = f'"{item.name}" on {board.name} is due tomorrow'
@@ -183,28 +229,26 @@ def run_due_reminders():
             msg = f'"{item.name}" on {board.name} is due today'
         else:
             msg = f'"{item.name}" on {board.name} is overdue ({-delta} day{"s" if delta != -1 else ""})'
-        from .services import people_column_user_ids, run_automations
-        for uid in people_column_user_ids(item.id):
-            notify_user(uid, None, 'status', item.board_id, item.id, msg)
+        notify_users(assignees.get(item.id, ()), None, 'status', item.board_id, item.id, msg)
         if delta < 0:
             run_automations('overdue', board, item, None)
     db.session.commit()
 
 
 def run_backup():
-    """Zip the database (consistent sqlite snapshot) + uploads; keep the last N."""
+    """Zip a consistent database snapshot + uploads; keep the last N."""
     os.makedirs(BACKUP_DIR, exist_ok=True)
     stamp = date.today().isoformat()
     target = os.path.join(BACKUP_DIR, f'taskmaster-{stamp}.zip')
     snap = os.path.join(BACKUP_DIR, f'.snapshot-{stamp}.db')
-    src = sqlite3.connect(os.path.join(DATA_DIR, 'taskmaster.db'))
-    dst = sqlite3.connect(snap)
-    with dst:
-        src.backup(dst)
-    src.close()
-    dst.close()
+    if is_sqlite():
+        _snapshot_sqlite(snap)
+        snap_name = 'taskmaster.db'
+    else:
+        _snapshot_postgres(snap)
+        snap_name = 'taskmaster.pgdump'  # pg_restore -d <database> taskmaster.pgdump
     with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED) as z:
-        z.write(snap, 'taskmaster.db')
+        z.write(snap, snap_name)
         if os.path.isdir(UPLOAD_DIR):
             for name in os.listdir(UPLOAD_DIR):
                 z.write(os.path.join(UPLOAD_DIR, name), f'uploads/{name}')
@@ -219,3 +263,25 @@ def run_backup():
             pass
     print(f'TaskMaster: backup written to {target}')
     return target
+
+
+def _snapshot_sqlite(snap):
+    src = sqlite3.connect(db.engine.url.database)
+    dst = sqlite3.connect(snap)
+    with dst:
+        src.backup(dst)
+    src.close()
+    dst.close()
+
+
+def _snapshot_postgres(snap):
+    """pg_dump custom-format archive; needs the PostgreSQL client tools."""
+    if shutil.which('pg_dump') is None:
+        raise RuntimeError('pg_dump not found — install the PostgreSQL client tools')
+    url = db.engine.url.set(drivername='postgresql')
+    env = dict(os.environ)
+    if url.password:
+        env['PGPASSWORD'] = url.password  # kept off the command line
+    subprocess.run(['pg_dump', '--format=custom', '--file', snap,
+                    '--dbname', url.set(password=None).render_as_string()],
+                   env=env, check=True, capture_output=True, timeout=3600)
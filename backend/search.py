@@ -0,0 +1,255 @@
+"""Full-text search over jobs and companies.
+
+On SQLite two FTS5 tables back /api/search:
+  search_items     — one row per item (rowid = item id): its name, plus
+                     checklist text, text-column values and update bodies,
+                     plus a `scope` token for its board (b<board_id>)
+  search_companies — one row per company: name, plus contact fields
+A transaction that writes an item, one of its values or updates, or a
+company re-indexes those rows as it commits (once per row, however often it
+flushed), so the index never lags the committed data; a bulk DELETE or
+UPDATE (a dropped column, a purge) counts as a write of the items it
+touches. A restricted user's query carries
+their boards as scope tokens (up to SCOPE_BOARDS of them), so the index
+itself skips other boards; the exact item-level permission filter and the
+ranking then run in the same SQL statement.
+
+Ranking is bounded: only the newest RANK_WINDOW visible matches are ranked,
+jobs whose name matches first, then the most recently updated. A word found
+in half the database then costs what a rare one does (bm25 would not: it
+reads every match of every word for its statistics). The trade-off is that
+older matches of such a word are left out; the response then says
+`truncated`, and another word narrows the search back under the window,
+where every match is ranked.
+
+Other databases have no FTS5; search falls back to matching item and
+company names with LIKE.
+"""
+import json
+import re
+
+from sqlalchemy import bindparam, column, event, inspect, select, table, text
+from sqlalchemy.orm import Session
+
+from .db import db, is_sqlite
+from .models import Company, Item, ItemUpdate, ItemValue
+
+TOKENIZE = "unicode61 remove_diacritics 2"
+PREFIXES = '2 3 4'  # prefix indexes: short type-ahead words stay one lookup
+NAME_WEIGHT = 10.0  # bm25 weight of a company's name against its contacts
+RANK_WINDOW = 2000  # job matches ranked per query, newest first
+SCOPE_BOARDS = 50  # past this many boards the scope tokens cost more than they skip
+CHUNK = 500
+
+_enabled = False
+_TAGS = re.compile(r'<[^>]+>')
+_items_fts = table('search_items', column('rowid'))
+_companies_fts = table('search_companies', column('rowid'))
+
+
+def create_tables(conn):
+    for name, cols in (('search_items', 'name, body, scope'),
+                       ('search_companies', 'name, contact')):
+        conn.execute(text(f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING "
+                          f"fts5({cols}, tokenize='{TOKENIZE}', prefix='{PREFIXES}')"))
+
+
+def enable():
+    """Turn on write-time indexing once the tables exist (after migrations)."""
+    global _enabled
+    _enabled = is_sqlite() and 'search_items' in inspect(db.engine).get_table_names()
+
+
+def rebuild():
+    """Re-index everything; returns the number of items indexed."""
+    conn = db.session.connection()
+    conn.execute(text('DELETE FROM search_items'))
+    conn.execute(text('DELETE FROM search_companies'))
+    item_ids = [iid for (iid,) in conn.execute(text('SELECT id FROM items'))]
+    for i in range(0, len(item_ids), CHUNK):
+        _index_items(conn, item_ids[i:i + CHUNK])
+    _index_companies(conn, [cid for (cid,) in conn.execute(text('SELECT id FROM companies'))])
+    return len(item_ids)
+
+
+def _pending(session):
+    return session.info.setdefault('search_pending', (set(), set()))  # items, companies
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_writes(session, flush_context):
+    if not _enabled:
+        return
+    item_ids, company_ids = _pending(session)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Item):
+            if obj in session.dirty and not _changed(obj, 'name', 'checklist', 'board_id'):
+                continue
+            item_ids.add(obj.id)
+        elif isinstance(obj, ItemUpdate):
+            item_ids.add(obj.item_id)
+        elif isinstance(obj, ItemValue):
+            hist = inspect(obj).attrs.value.history
+            if any('"text"' in (v or '') for v in (obj.value, *hist.deleted)):
+                item_ids.add(obj.item_id)
+        elif isinstance(obj, Company):
+            company_ids.add(obj.id)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _note_bulk_writes(state):
+    """Bulk DELETE/UPDATE bypass the flush: note the items they are about
+    to touch."""
+    if not _enabled or not (state.is_update or state.is_delete) \
+            or state.bind_mapper is None:
+        return None
+    model = state.bind_mapper.class_
+    if model is ItemValue:
+        touched = select(ItemValue.item_id).where(ItemValue.value.like('%"text"%'))
+    elif model is ItemUpdate:
+        touched = select(ItemUpdate.item_id)
+    elif model is Item and state.is_delete:
+        touched = select(Item.id)
+    else:
+        return None
+    if state.statement.whereclause is not None:
+        touched = touched.where(state.statement.whereclause)
+    _pending(state.session)[0].update(state.session.scalars(touched.distinct()))
+    return None
+
+
+@event.listens_for(Session, 'before_commit')
+def _reindex(session):
+    if not _enabled:
+        return
+    session.flush()  # whatever is still unflushed is noted too
+    item_ids, company_ids = session.info.pop('search_pending', (None, None))
+    if not (item_ids or company_ids):
+        return
+    conn = session.connection()
+    item_ids = list(item_ids)
+    for i in range(0, len(item_ids), CHUNK):
+        _index_items(conn, item_ids[i:i + CHUNK])
+    if company_ids:
+        _index_companies(conn, list(company_ids))
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_writes(session, previous_transaction):
+    session.info.pop('search_pending', None)
+
+
+def _changed(obj, *attrs):
+    state = inspect(obj)
+    return any(state.attrs[a].history.has_changes() for a in attrs)
+
+
+def _index_items(conn, ids):
+    """(Re)write the rows of these items; deleted items just lose theirs."""
+    ids_param = bindparam('ids', expanding=True)
+    conn.execute(text('DELETE FROM search_items WHERE rowid IN :ids').bindparams(ids_param),
+                 {'ids': ids})
+    docs = {}
+    for iid, board_id, name, checklist in conn.execute(
+            text('SELECT id, board_id, name, checklist FROM items WHERE id IN :ids')
+            .bindparams(ids_param), {'ids': ids}):
+        body = []
+        try:
+            body += [str(c.get('text') or '') for c in json.loads(checklist or '[]')]
+        except (ValueError, AttributeError):
+            pass
+        docs[iid] = (board_id, name, body)
+    if not docs:
+        return
+    for iid, raw in conn.execute(text(
+            "SELECT item_id, value FROM item_values WHERE item_id IN :ids "
+            "AND value LIKE '%\"text\"%'").bindparams(ids_param), {'ids': list(docs)}):
+        try:
+            docs[iid][2].append(str(json.loads(raw).get('text') or ''))
+        except (ValueError, AttributeError):
+            pass
+    for iid, body in conn.execute(
+            text('SELECT item_id, body FROM item_updates WHERE item_id IN :ids')
+            .bindparams(ids_param), {'ids': list(docs)}):
+        docs[iid][2].append(_TAGS.sub(' ', body or ''))
+    conn.execute(text('INSERT INTO search_items (rowid, name, body, scope) '
+                      'VALUES (:id, :name, :body, :scope)'),
+                 [{'id': iid, 'name': name, 'body': '\n'.join(b for b in body if b),
+                   'scope': f'b{board_id}'} for iid, (board_id, name, body) in docs.items()])
+
+
+def _index_companies(conn, ids):
+    ids_param = bindparam('ids', expanding=True)
+    conn.execute(text('DELETE FROM search_companies WHERE rowid IN :ids').bindparams(ids_param),
+                 {'ids': ids})
+    rows = conn.execute(text(
+        'SELECT id, name, address, phone, phone2, email, contact_name, notes '
+        'FROM companies WHERE id IN :ids').bindparams(ids_param), {'ids': ids}).all()
+    if rows:
+        conn.execute(text('INSERT INTO search_companies (rowid, name, contact) '
+                          'VALUES (:id, :name, :contact)'),
+                     [{'id': r[0], 'name': r[1], 'contact': '\n'.join(v for v in r[2:] if v)}
+                      for r in rows])
+
+
+def match_expression(q):
+    """FTS5 query for free text: every word must match, the last one as a
+    prefix (type-ahead). Words are quoted, so operators and punctuation in
+    the input are inert."""
+    words = [f'"{w}"' for w in re.findall(r'\w+', q)]
+    if words:
+        words[-1] += '*'
+    return ' '.join(words)
+
+
+def search_items(q, visible, board_ids, limit, offset):
+    """Items matching q, best first. `visible` is a SQL filter on Item and
+    `board_ids` the boards it can match on (both None: no restriction).
+    Returns (rows, truncated): up to limit + 1 rows, so the caller can tell
+    whether another page follows, and whether matches beyond the newest
+    RANK_WINDOW were left out of the ranking."""
+    query = Item.query
+    if visible is not None:
+        query = query.filter(visible)
+    if not _enabled:
+        return (query.filter(Item.name.ilike(f'%{q}%')).order_by(Item.updated_at.desc())
+                .offset(offset).limit(limit + 1).all(), False)
+    expr = match_expression(q)
+    if not expr or board_ids is not None and not board_ids:
+        return [], False
+    name_expr = f'name : ({expr})'
+    expr = f'{{name body}} : ({expr})'
+    if board_ids is not None and len(board_ids) <= SCOPE_BOARDS:
+        expr += ' AND scope : (' + ' OR '.join(f'b{b}' for b in sorted(board_ids)) + ')'
+    query = (query.join(_items_fts, _items_fts.c.rowid == Item.id)
+             .filter(text('search_items MATCH :expr').bindparams(expr=expr)))
+    # the newest match past the window, if there is one
+    cut = (query.with_entities(_items_fts.c.rowid).order_by(_items_fts.c.rowid.desc())
+           .offset(RANK_WINDOW).limit(1).scalar())
+    if cut is not None:
+        query = query.filter(_items_fts.c.rowid > cut)
+    name_hit = Item.id.in_(text('SELECT rowid FROM search_items WHERE search_items MATCH '
+                                ':name_expr AND rowid > :cut')
+                           .bindparams(name_expr=name_expr, cut=cut or 0))
+    rows = (query.order_by(name_hit.desc(), Item.updated_at.desc(), Item.id.desc())
+            .offset(offset).limit(limit + 1).all())
+    return rows, cut is not None
+
+
+def search_companies(q, company_ids, limit):
+    """Companies matching q among company_ids (None = all), best first."""
+    query = Company.query
+    if company_ids is not None:
+        if not company_ids:
+            return []
+        query = query.filter(Company.id.in_(company_ids))
+    if _enabled:
+        expr = match_expression(q)
+        if not expr:
+            return []
+        query = (query.join(_companies_fts, _companies_fts.c.rowid == Company.id)
+                 .filter(text('search_companies MATCH :cexpr').bindparams(cexpr=expr))
+                 .order_by(text(f'bm25(search_companies, {NAME_WEIGHT}, 1.0)')))
+    else:
+        query = query.filter(Company.name.ilike(f'%{q}%')).order_by(Company.name)
+    return query.limit(limit).all()
@@ -2,11 +2,14 @@
 import json
 import os
 
-from . import realtime
+from . import bus, deferred, realtime
+from .changefeed import (changed_rows, committed_board_ids, current_cursor,
+                         cursor_is_stale, take_board_events)
 from .db import db
+from .digests import wants_immediate
 from .models import (AccessGrant, Activity, Board, BoardColumn, BoardGroup,
-                     FileAsset, Item, ItemUpdate, ItemValue, Notification,
-                     NotificationRule)
+                     FileAsset, Item, ItemAssignee, ItemUpdate, ItemValue,
+                     Notification, NotificationRule, User)
 
 STATUS_PRESET = [
     {'id': 'l1', 'label': 'Not Started', 'color': '#c4c4c4'},
@@ -48,38 +51,112 @@ def log_activity(user_id, board_id, item_id, action, description, company_id=Non
     ))
 
 
+NOTIFY_SUBJECTS = {
+    'assigned': 'You were assigned a job',
+    'status': 'Status changed',
+    'update': 'New update on a job',
+    'mention': 'You were mentioned',
+}
+
+
 def notify_user(user_id, actor_id, ntype, board_id, item_id, message):
     """Create an in-app notification (skipping self-notifications), push it
     live, and email it when the email service is on and the person wants it."""
-    if user_id == actor_id or user_id is None:
-        return
-    n = Notification(
-        user_id=user_id, actor_id=actor_id, type=ntype,
-        board_id=board_id, item_id=item_id, message=message,
-    )
-    db.session.add(n)
-    db.session.flush()
-    realtime.publish({'type': 'notification'}, target_user_id=user_id)
-
-    from .models import User
-    target = db.session.get(User, user_id)
-    if target and target.email and (target.email_notifications is None
-                                    or target.email_notifications):
-        from flask import current_app
+    notify_users([user_id], actor_id, ntype, board_id, item_id, message)
+
+
+def notify_users(user_ids, actor_id, ntype, board_id, item_id, message):
+    """notify_user for a set of recipients: one insert, one user fetch and
+    one email outbox insert for all of them. Returns the ids notified."""
+    ids = {uid for uid in user_ids if uid is not None and uid != actor_id}
+    if not ids:
+        return set()
+    db.session.bulk_insert_mappings(Notification, [
+        {'user_id': uid, 'actor_id': actor_id, 'type': ntype,
+         'board_id': board_id, 'item_id': item_id, 'message': message}
+        for uid in sorted(ids)])
+    for uid in sorted(ids):
+        realtime.publish({'type': 'notification'}, target_user_id=uid)
+    # digest users get these in their next digest (digests.py) instead
+    emails = [u.email for u in User.query.filter(User.id.in_(ids)).order_by(User.id)
+              if u.email and (u.email_notifications is None or u.email_notifications)
+              and wants_immediate(u)]
+    if emails:
         from . import emailer
-        subjects = {
-            'assigned': 'You were assigned a job',
-            'status': 'Status changed',
-            'update': 'New update on a job',
-            'mention': 'You were mentioned',
-        }
-        emailer.send_async(current_app._get_current_object(), target.email,
-                           f'TaskMaster: {subjects.get(ntype, "Notification")}',
-                           message)
+        subject = f'TaskMaster: {NOTIFY_SUBJECTS.get(ntype, "Notification")}'
+        emailer.queue_many([(to, subject, message) for to in emails])
+    return ids
 
 
 def broadcast_board(board_id, kind='board_changed'):
-    realtime.publish({'type': kind, 'board_id': board_id})
+    """Tell open streams a board changed. Legacy streams get the coarse hint;
+    typed streams get the row events this session committed (or the hint,
+    when a change left no row events behind)."""
+    events = take_board_events()
+    if kind != 'board_changed':
+        events.pop(board_id, None)
+        realtime.publish({'type': kind, 'board_id': board_id})
+    else:
+        realtime.publish({'type': kind, 'board_id': board_id}, typed=False)
+        events.setdefault(board_id, [])
+    if events:
+        # every worker filters the events for its own streams
+        bus.send('board_events', [[b, evs] for b, evs in events.items()])
+
+
+@bus.handler('board_events')
+def _publish_board_events(payload):
+    publish_board_events({board_id: evs for board_id, evs in payload})
+
+
+def publish_board_events(events):
+    """Fan {board_id: [event, ...]} out to typed streams, filtered through the
+    permission model: users without access get nothing, partially-granted
+    users only events about items they can see (and a tombstone for items
+    that changed out of their view). Row events reach only streams watching
+    the board; board_created/board_updated go to every typed stream, for the
+    sidebar. A client receiving an event for an item it doesn't hold can pick
+    it up from /api/boards/<id>/changes."""
+    from . import permissions as perm
+    forgot = False
+    for board_id, evs in events.items():
+        if any(ev['type'] == 'board_created' for ev in evs):
+            evs = [ev for ev in evs if ev['type'] == 'board_created']  # nothing is open on it yet
+        elif not evs:
+            evs = [{'type': 'board_changed'}]
+        sidebar = [ev for ev in evs if ev['type'] in ('board_created', 'board_updated')]
+        uids = realtime.typed_user_ids() if sidebar else realtime.board_watchers(board_id)
+        board = db.session.get(Board, board_id) if uids else None
+        if board is None:
+            continue
+        if not forgot:
+            perm.forget_access()  # the commit may have moved grants or assignments
+            forgot = True
+        watchers = realtime.board_watchers(board_id)
+        for u in User.query.filter(User.id.in_(uids), User.is_active.is_(True)).all():
+            if not perm.board_access(u, board):
+                if u.id in watchers:  # access just went away: let the client find out
+                    realtime.deliver({'type': 'board_changed', 'board_id': board_id},
+                                     target_user_id=u.id, typed=True, board_id=board_id)
+                continue
+            for ev in sidebar:
+                realtime.deliver(dict(ev, board_id=board_id), target_user_id=u.id, typed=True)
+            if u.id not in watchers:
+                continue
+            visible = perm.visible_item_ids(u, board)
+            hidden = set()
+            for ev in evs:
+                if ev in sidebar:
+                    continue
+                iid = ev.get('item_id')
+                if (visible is not None and iid is not None and iid not in visible
+                        and ev['type'] != 'item_deleted'):
+                    if iid in hidden:
+                        continue
+                    hidden.add(iid)
+                    ev = {'type': 'item_deleted', 'item_id': iid}
+                realtime.deliver(dict(ev, board_id=board_id), target_user_id=u.id,
+                                 typed=True, board_id=board_id)
 
 
 def item_counts(item_ids):
@@ -108,29 +185,19 @@ def values_for_items(item_ids):
     return out
 
 
-def serialize_board_full(board, visible_ids=None, access='full'):
+BOARD_BATCH = 500  # items per batch of a streamed board payload
+
+
+def serialize_board_full(board, visible_ids=None, access='full', stream=False):
     """Full board payload. visible_ids=None means every item; a set filters
-    the payload down to the items a partially-granted user may see."""
+    the payload down to the items a partially-granted user may see.
+    stream=True leaves 'items' a generator that reads the board in batches
+    (for jsonstream.stream_json) instead of a list."""
+    cursor = current_cursor()  # read first: anything newer is re-sent, never lost
     groups = (BoardGroup.query.filter_by(board_id=board.id)
               .order_by(BoardGroup.position).all())
     columns = (BoardColumn.query.filter_by(board_id=board.id)
                .order_by(BoardColumn.position).all())
-    items = (Item.query.filter_by(board_id=board.id)
-             .order_by(Item.position).all())
-    if visible_ids is not None:
-        items = [i for i in items if i.id in visible_ids]
-    ids = [i.id for i in items]
-    values = values_for_items(ids)
-    counts = item_counts(ids)
-    subitem_counts = {}
-    for i in items:
-        if i.parent_id:
-            subitem_counts[i.parent_id] = subitem_counts.get(i.parent_id, 0) + 1
-    out_items = []
-    for i in items:
-        d = i.to_dict(values=values.get(i.id, {}), counts=counts.get(i.id))
-        d['subitems_count'] = subitem_counts.get(i.id, 0)
-        out_items.append(d)
     from . import permissions as perm
     board_users, item_extra = perm.board_assignable(board)
     user_map = {u.id: u for u in board_users}
@@ -142,13 +209,94 @@ def serialize_board_full(board, visible_ids=None, access='full'):
         'board_ids': [u.id for u in board_users],
         'item_ids': {str(iid): [u.id for u in lst] for iid, lst in item_extra.items()},
     }
+    items = _board_items(board, visible_ids)
     return {
         'board': board.to_dict(),
         'groups': [g.to_dict() for g in groups],
         'columns': [c.to_dict() for c in columns],
-        'items': out_items,
         'access': access,
         'assignable': assignable,
+        'cursor': cursor,
+        'items': items if stream else list(items),
+    }
+
+
+def _board_items(board, visible_ids):
+    """The board's item dicts in position order, BOARD_BATCH rows at a time
+    off one server-side cursor; sub-item counts come per batch."""
+    from .jsonstream import chunks
+    rows = (Item.query.filter_by(board_id=board.id)
+            .order_by(Item.position).yield_per(BOARD_BATCH))
+    for batch in chunks(rows, BOARD_BATCH):
+        if visible_ids is not None:
+            batch = [i for i in batch if i.id in visible_ids]
+        subitem_counts = {}
+        if batch:
+            q = (db.session.query(Item.parent_id, Item.id)
+                 .filter(Item.board_id == board.id, Item.parent_id.in_([i.id for i in batch])))
+            for parent_id, iid in q.all():
+                if visible_ids is None or iid in visible_ids:
+                    subitem_counts[parent_id] = subitem_counts.get(parent_id, 0) + 1
+        yield from serialize_items(batch, subitem_counts)
+
+
+def serialize_items(items, subitem_counts):
+    """Item dicts as the board payload ships them: values, counts, sub-items."""
+    ids = [i.id for i in items]
+    values = values_for_items(ids)
+    counts = item_counts(ids)
+    out = []
+    for i in items:
+        d = i.to_dict(values=values.get(i.id, {}), counts=counts.get(i.id))
+        d['subitems_count'] = subitem_counts.get(i.id, 0)
+        out.append(d)
+    return out
+
+
+def serialize_board_changes(board, since, visible_ids=None, access='full'):
+    """Delta payload for a client holding cursor `since`: only the board,
+    groups, columns and items that changed after it, plus ids of the ones
+    that were deleted (or, for a partial user, dropped out of view). Returns
+    {'resync': True} when the cursor can't be answered incrementally."""
+    cursor = current_cursor()
+    if cursor_is_stale(since, cursor):
+        return {'resync': True, 'cursor': cursor, 'access': access}
+    latest = changed_rows(board.id, since)
+    wanted = {'group': set(), 'column': set(), 'item': set()}
+    deleted = {'group': set(), 'column': set(), 'item': set()}
+    for (kind, row_id), gone in latest.items():
+        if kind == 'board':
+            if gone:
+                return {'resync': True, 'cursor': cursor, 'access': access}
+            continue
+        (deleted if gone else wanted)[kind].add(row_id)
+    if visible_ids is not None:
+        deleted['item'] |= wanted['item'] - visible_ids
+        wanted['item'] &= visible_ids
+    rows = {}
+    for kind, model in (('group', BoardGroup), ('column', BoardColumn), ('item', Item)):
+        found = []
+        if wanted[kind]:
+            found = (model.query.filter(model.board_id == board.id, model.id.in_(wanted[kind]))
+                     .order_by(model.position).all())
+        # rows that vanished without a logged delete (e.g. a reused id) are gone too
+        deleted[kind] |= wanted[kind] - {r.id for r in found}
+        rows[kind] = found
+    subitem_counts = {}
+    if rows['item']:
+        q = (db.session.query(Item.parent_id, Item.id)
+             .filter(Item.parent_id.in_([i.id for i in rows['item']])))
+        for parent_id, iid in q.all():
+            if visible_ids is None or iid in visible_ids:
+                subitem_counts[parent_id] = subitem_counts.get(parent_id, 0) + 1
+    return {
+        'cursor': cursor,
+        'access': access,
+        'board': board.to_dict() if ('board', board.id) in latest else None,
+        'groups': [g.to_dict() for g in rows['group']],
+        'columns': [c.to_dict() for c in rows['column']],
+        'items': serialize_items(rows['item'], subitem_counts),
+        'deleted': {kind + 's': sorted(ids) for kind, ids in deleted.items()},
     }
 
 
@@ -161,6 +309,7 @@ def purge_item_rows(item_ids, keep_files=False):
         return
     from .config import UPLOAD_DIR
     ItemValue.query.filter(ItemValue.item_id.in_(item_ids)).delete(synchronize_session=False)
+    ItemAssignee.query.filter(ItemAssignee.item_id.in_(item_ids)).delete(synchronize_session=False)
     ItemUpdate.query.filter(ItemUpdate.item_id.in_(item_ids)).delete(synchronize_session=False)
     for f in FileAsset.query.filter(FileAsset.item_id.in_(item_ids)).all():
         if not keep_files:
@@ -272,77 +421,117 @@ def run_automations(trigger, board, item, actor_id, new_label_text=None):
     trigger for this board's company (global rules unless opted out).
     Returns the set of user ids already notified."""
     import json as _json
+    from . import automations
     from . import permissions as perm
-    from .models import AutomationRule, BoardColumn, ItemValue, User
-    company_id = perm.board_company_id(board)
+    from .models import ItemValue, User
     notified = set()
-    for rule in AutomationRule.query.filter_by(enabled=True).all():
-        if (rule.trigger or 'status') != trigger:
-            continue
-        if rule.company_id is not None and rule.company_id != company_id:
-            continue
-        if rule.company_id is None and company_id in rule.disabled_company_list():
-            continue
-        if trigger == 'status' and rule.label_text \
-                and rule.label_text.strip().lower() != (new_label_text or '').strip().lower():
-            continue
-
-        action = rule.action or 'notify'
-        if action == 'notify':
-            targets = set(rule.user_id_list())
+    status_targets = []  # notified together once every rule has run
+    assignees = None
+    for rule in automations.matching_rules(trigger, perm.board_company_id(board),
+                                           new_label_text):
+        if rule.action == 'notify':
+            targets = set(rule.user_ids)
             if rule.notify_assignees:
-                targets |= people_column_user_ids(item.id)
-            what = {'status': f'changed to {new_label_text}',
-                    'created': 'was created',
-                    'overdue': 'is overdue'}[trigger]
-            for uid in targets:
-                if uid not in notified:
-                    notify_user(uid, actor_id, 'status', board.id, item.id,
-                                f'"{item.name}" on {board.name} {what}')
-                    notified.add(uid)
-        elif action == 'set_status':
-            col = (BoardColumn.query.filter_by(board_id=board.id, type='status')
-                   .order_by(BoardColumn.position).first())
-            wanted = (rule.action_param or '').strip().lower()
-            label = col and next((l for l in col.settings_dict().get('labels', [])
-                                  if l['label'].strip().lower() == wanted), None)
-            if col and label:
-                iv = ItemValue.query.filter_by(item_id=item.id, column_id=col.id).first()
+                if assignees is None:
+                    assignees = people_column_user_ids(item.id)
+                targets |= assignees
+            status_targets += [uid for uid in targets if uid not in notified]
+            notified |= targets
+        elif rule.action == 'set_status':
+            cols = automations.board_columns(board.id)
+            label = cols.status_labels.get(automations.normalize(rule.action_param))
+            if cols.status_id and label:
+                iv = ItemValue.query.filter_by(item_id=item.id, column_id=cols.status_id).first()
                 if not (iv and iv.value_dict().get('id') == label['id']):
                     if iv:
                         iv.value = _json.dumps({'id': label['id']})
                     else:
-                        db.session.add(ItemValue(item_id=item.id, column_id=col.id,
+                        db.session.add(ItemValue(item_id=item.id, column_id=cols.status_id,
                                                  value=_json.dumps({'id': label['id']})))
                     log_activity(rule.created_by, board.id, item.id, 'value_changed',
                                  f'automation set Status of "{item.name}" to {label["label"]}')
-        elif action == 'assign':
+        elif rule.action == 'assign':
             try:
                 target_id = int(rule.action_param or 0)
             except ValueError:
                 continue
             target = db.session.get(User, target_id)
-            col = (BoardColumn.query.filter_by(board_id=board.id, type='people')
-                   .order_by(BoardColumn.position).first())
-            if target and target.is_active and col \
+            col_id = automations.board_columns(board.id).people_id
+            if target and target.is_active and col_id \
                     and target_id in perm.eligible_assignee_ids(item):
-                iv = ItemValue.query.filter_by(item_id=item.id, column_id=col.id).first()
-                ids = set((iv.value_dict().get('user_ids') if iv else None) or [])
-                if target_id not in ids:
-                    ids.add(target_id)
-                    payload = _json.dumps({'user_ids': sorted(ids)})
-                    if iv:
-                        iv.value = payload
-                    else:
-                        db.session.add(ItemValue(item_id=item.id, column_id=col.id, value=payload))
+                if add_assignee(item.id, col_id, target_id):
+                    assignees = None  # later notify rules see the new assignee
                     log_activity(rule.created_by, board.id, item.id, 'value_changed',
                                  f'automation assigned {target.display_name} to "{item.name}"')
-                    notify_user(target_id, actor_id, 'assigned', board.id, item.id,
-                                f'You were assigned to "{item.name}" on {board.name} (automation)')
+                    notify_users([target_id], actor_id, 'assigned', board.id, item.id,
+                                 f'You were assigned to "{item.name}" on {board.name} (automation)')
                     notified.add(target_id)
+    if status_targets:
+        what = {'status': f'changed to {new_label_text}',
+                'created': 'was created',
+                'overdue': 'is overdue'}[trigger]
+        notify_users(status_targets, actor_id, 'status', board.id, item.id,
+                     f'"{item.name}" on {board.name} {what}')
     return notified
 
 
+@deferred.handler('status_changed')
+def _after_status_change(changes):
+    """What a status / priority edit sets off (queued by set_value): the Home
+    Assistant event, a notification to each assignee, the automations."""
+    from . import ha
+    items = {i.id: i for i in Item.query.filter(Item.id.in_({c['item_id'] for c in changes}))}
+    boards = {b.id: b for b in
+              Board.query.filter(Board.id.in_({i.board_id for i in items.values()}))}
+    assignees = {}
+    for iid, uid in db.session.query(ItemAssignee.item_id, ItemAssignee.user_id) \
+            .filter(ItemAssignee.item_id.in_(list(items))):
+        assignees.setdefault(iid, set()).add(uid)
+    for c in changes:
+        item = items.get(c['item_id'])
+        if item is None or item.board_id not in boards:
+            continue  # deleted since
+        board = boards[item.board_id]
+        ha.fire_event('taskmaster_status_changed', {
+            'item_id': item.id, 'board_id': board.id, 'board': board.name,
+            'name': item.name, 'column': c['column'],
+            'old_status': c['old'], 'new_status': c['new'], 'changed_by': c['actor_username'],
+        })
+        # assignees hear about status changes made by someone else
+        notify_users(assignees.get(item.id, ()), c['actor_id'], 'status', board.id, item.id,
+                     f'{c["actor_name"]} set {c["column"]} of "{item.name}" to {c["new"]}')
+        run_automations('status', board, item, c['actor_id'], new_label_text=c['new'])
+    _commit_and_broadcast()
+
+
+@deferred.handler('item_created')
+def _after_item_created(created):
+    """What a new job sets off (queued by create_item): the Home Assistant
+    event and the 'created' automations."""
+    from . import ha
+    items = {i.id: i for i in Item.query.filter(Item.id.in_({c['item_id'] for c in created}))}
+    boards = {b.id: b for b in
+              Board.query.filter(Board.id.in_({i.board_id for i in items.values()}))}
+    for c in created:
+        item = items.get(c['item_id'])
+        if item is None or item.board_id not in boards:
+            continue
+        board = boards[item.board_id]
+        ha.fire_event('taskmaster_item_created', {
+            'item_id': item.id, 'board_id': board.id,
+            'board': board.name, 'name': item.name, 'created_by': c['actor_username'],
+        })
+        if item.parent_id is None:
+            run_automations('created', board, item, c['actor_id'])
+    _commit_and_broadcast()
+
+
+def _commit_and_broadcast():
+    db.session.commit()
+    for board_id in committed_board_ids():
+        broadcast_board(board_id)
+
+
 def create_default_board_layout(board):
     """Give a fresh board monday-style defaults: two groups + core columns."""
     if (BoardColumn.query.filter_by(board_id=board.id).count()
@@ -363,12 +552,68 @@ def create_default_board_layout(board):
 
 def people_column_user_ids(item_id):
     """All user ids present in any people-column value of an item."""
-    ids = set()
-    for v in ItemValue.query.filter_by(item_id=item_id).all():
-        col = BoardColumn.query.get(v.column_id)
-        if col and col.type == 'people':
-            ids.update(v.value_dict().get('user_ids') or [])
-    return ids
+    return {uid for (uid,) in db.session.query(ItemAssignee.user_id)
+            .filter(ItemAssignee.item_id == item_id)}
+
+
+def _user_id_set(user_ids):
+    out = set()
+    for uid in user_ids or []:
+        try:
+            out.add(int(uid))
+        except (TypeError, ValueError):
+            pass
+    return out
+
+
+def sync_assignees(item_id, column_id, user_ids):
+    """Mirror one people-column value into the item_assignees index. Call it
+    next to every write of a people value (None / [] clears it)."""
+    wanted = _user_id_set(user_ids)
+    current = {a.user_id: a for a in
+               ItemAssignee.query.filter_by(item_id=item_id, column_id=column_id).all()}
+    for uid, row in current.items():
+        if uid not in wanted:
+            db.session.delete(row)
+    for uid in wanted - set(current):
+        db.session.add(ItemAssignee(item_id=item_id, user_id=uid, column_id=column_id))
+
+
+def add_assignee(item_id, column_id, user_id):
+    """Add one person to an item's people-column value. Returns False when
+    they were already on it."""
+    iv = ItemValue.query.filter_by(item_id=item_id, column_id=column_id).first()
+    ids = set((iv.value_dict().get('user_ids') if iv else None) or [])
+    if user_id in ids:
+        return False
+    ids.add(user_id)
+    payload = json.dumps({'user_ids': sorted(ids)})
+    if iv:
+        iv.value = payload
+    else:
+        db.session.add(ItemValue(item_id=item_id, column_id=column_id, value=payload))
+    sync_assignees(item_id, column_id, ids)
+    return True
+
+
+def rebuild_item_assignees():
+    """Recreate the whole item_assignees index from the people-column values.
+    Returns the number of index rows written."""
+    ItemAssignee.query.delete(synchronize_session=False)
+    rows = (db.session.query(ItemValue.item_id, ItemValue.column_id, ItemValue.value)
+            .join(BoardColumn, BoardColumn.id == ItemValue.column_id)
+            .filter(BoardColumn.type == 'people'))
+    mappings = []
+    for item_id, column_id, raw in rows:
+        try:
+            ids = json.loads(raw or '{}').get('user_ids')
+        except (ValueError, AttributeError):
+            continue
+        mappings += [{'item_id': item_id, 'user_id': uid, 'column_id': column_id}
+                     for uid in _user_id_set(ids)]
+    if mappings:
+        db.session.bulk_insert_mappings(ItemAssignee, mappings)
+    return len(mappings)
 
 
 # ---- Snapshots: power both the trash bin (delete → restore) and duplication ----
@@ -402,8 +647,12 @@ def snapshot_item(item):
     return snap
 
 
-def snapshot_board(board):
-    """Full JSON-able copy of a board: groups, columns, and all jobs."""
+def snapshot_board(board, stream=False):
+    """Full JSON-able copy of a board: groups, columns, and all jobs.
+    stream=True leaves 'items' a generator, for jsonstream.iter_json."""
+    items = (snapshot_item(i) for i in
+             Item.query.filter(Item.board_id == board.id, Item.parent_id.is_(None))
+             .order_by(Item.position).yield_per(BOARD_BATCH))
     return {
         'board': {'name': board.name, 'description': board.description,
                   'icon': board.icon, 'color': board.color, 'status': board.status,
@@ -417,9 +666,7 @@ def snapshot_board(board):
                      'settings': c.settings, 'position': c.position, 'width': c.width}
                     for c in BoardColumn.query.filter_by(board_id=board.id)
                     .order_by(BoardColumn.position).all()],
-        'items': [snapshot_item(i) for i in
-                  Item.query.filter(Item.board_id == board.id, Item.parent_id.is_(None))
-                  .order_by(Item.position).all()],
+        'items': items if stream else list(items),
     }
 
 
@@ -433,11 +680,17 @@ def _restore_one_item(d, board_id, group_id, parent_id, column_map,
               created_by=d.get('created_by'), checklist=d.get('checklist'))
     db.session.add(it)
     db.session.flush()
-    valid_cols = {c.id for c in BoardColumn.query.filter_by(board_id=board_id).all()}
+    col_types = {c.id: c.type for c in BoardColumn.query.filter_by(board_id=board_id).all()}
     for v in d.get('values', []):
         cid = column_map.get(v['column_id']) if column_map else v['column_id']
-        if cid in valid_cols:
+        if cid in col_types:
             db.session.add(ItemValue(item_id=it.id, column_id=cid, value=v['value']))
+            if col_types[cid] == 'people':
+                try:
+                    ids = json.loads(v['value'] or '{}').get('user_ids')
+                except (ValueError, AttributeError):
+                    ids = None
+                sync_assignees(it.id, cid, ids)
     if include_discussion:
         for u in d.get('updates', []):
             up = ItemUpdate(item_id=it.id, user_id=u.get('user_id'), body=u['body'])
@@ -528,6 +781,7 @@ def trash_item(user_id, item):
 
 def trash_board(user_id, board):
     """Snapshot a whole board into the trash, then hard-delete it."""
+    from .jsonstream import iter_json
     from .models import TrashEntry
     from . import permissions as perm
     from .models import Department
@@ -536,7 +790,8 @@ def trash_board(user_id, board):
         kind='board', title=board.name[:500],
         context=f'department {dept.name}' if dept else 'company page',
         company_id=perm.board_company_id(board),
-        payload=json.dumps(snapshot_board(board)), deleted_by=user_id)
+        payload=''.join(iter_json(snapshot_board(board, stream=True))),
+        deleted_by=user_id)
     db.session.add(entry)
     purge_board(board, keep_files=True)
     return entry
@@ -0,0 +1,194 @@
+"""Asyncio front door that holds /api/events streams without a thread each.
+
+Behind plain gunicorn every open tab pins one of the worker's request threads
+for as long as its event stream lives. With SSE_GATEWAY=1 (run.sh) this
+process listens on the public port instead: it serves /api/events itself —
+thousands of idle streams on one event-loop thread — and passes every other
+request through to gunicorn on GATEWAY_UPSTREAM, so the browser still sees a
+single origin. It joins the cross-process bus (EVENT_BUS=table) like one more
+worker, with its own realtime registry.
+
+    EVENT_BUS=table python3 -m backend.sse_gateway
+"""
+import asyncio
+from urllib.parse import urlsplit
+
+from . import create_app, realtime
+from .config import EVENT_BUS, GATEWAY_UPSTREAM, PORT
+
+HEAD_LIMIT = 64 * 1024
+IDLE_SECONDS = 75  # keep-alive connections waiting for their next request
+COPY_CHUNK = 64 * 1024
+HOP_HEADERS = {'connection', 'keep-alive', 'proxy-connection'}
+
+
+def _parse_head(raw):
+    lines = raw.decode('latin-1').split('\r\n')
+    first, headers = lines[0].split(' ', 2), []
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(':')
+            headers.append((name.strip(), value.strip()))
+    return first, headers
+
+
+def _header(headers, name):
+    for k, v in headers:
+        if k.lower() == name:
+            return v
+    return None
+
+
+def _head(first_line, headers):
+    lines = [first_line] + [f'{k}: {v}' for k, v in headers]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+async def _copy(reader, writer, n=None):
+    """Copy n bytes (or everything up to EOF) from reader to writer."""
+    while n is None or n > 0:
+        chunk = await reader.read(COPY_CHUNK if n is None else min(n, COPY_CHUNK))
+        if not chunk:
+            return
+        writer.write(chunk)
+        await writer.drain()
+        if n is not None:
+            n -= len(chunk)
+
+
+class Gateway:
+    def __init__(self, app, upstream):
+        self.app = app
+        host, _, port = upstream.rpartition(':')
+        self.upstream = (host or '127.0.0.1', int(port))
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    raw = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), IDLE_SECONDS)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                        asyncio.TimeoutError):
+                    return
+                (method, target, version), headers = _parse_head(raw[:-4])
+                if method == 'GET' and urlsplit(target).path == '/api/events':
+                    await self.events(target, headers, writer)
+                    return
+                if _header(headers, 'transfer-encoding') or _header(headers, 'upgrade'):
+                    await self.tunnel(raw, reader, writer)  # framing we don't parse
+                    return
+                keep = (version == 'HTTP/1.1'
+                        and (_header(headers, 'connection') or '').lower() != 'close')
+                if not await self.forward(method, target, version, headers, reader, writer):
+                    return
+                if not keep:
+                    return
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def forward(self, method, target, version, headers, reader, writer):
+        """Proxy one request on a fresh upstream connection. Returns whether the
+        client connection can carry another request."""
+        try:
+            up_reader, up_writer = await asyncio.open_connection(*self.upstream)
+        except OSError:
+            body = b'{"error": "Server is starting, try again shortly"}\n'
+            writer.write(_head('HTTP/1.1 502 Bad Gateway', [
+                ('Content-Type', 'application/json'), ('Content-Length', str(len(body)))]) + body)
+            await writer.drain()
+            return True
+        try:
+            sent = [(k, v) for k, v in headers if k.lower() not in HOP_HEADERS]
+            sent.append(('Connection', 'close'))  # the response then ends at EOF
+            peer = writer.get_extra_info('peername')
+            if peer:
+                sent.append(('X-Forwarded-For', str(peer[0])))
+            up_writer.write(_head(f'{method} {target} {version}', sent))
+            await _copy(reader, up_writer, int(_header(headers, 'content-length') or 0))
+            raw = await up_reader.readuntil(b'\r\n\r\n')
+            (_version, status, reason), resp = _parse_head(raw[:-4])
+            framed = (_header(resp, 'content-length') is not None
+                      or 'chunked' in (_header(resp, 'transfer-encoding') or '').lower()
+                      or method == 'HEAD' or status in ('204', '304'))
+            resp = [(k, v) for k, v in resp if k.lower() not in HOP_HEADERS]
+            if not framed:
+                resp.append(('Connection', 'close'))
+            writer.write(_head(f'{version} {status} {reason}', resp))
+            await _copy(up_reader, writer)
+            return framed
+        finally:
+            up_writer.close()
+
+    async def tunnel(self, raw, reader, writer):
+        """Hand the rest of the connection to gunicorn byte for byte."""
+        up_reader, up_writer = await asyncio.open_connection(*self.upstream)
+        up_writer.write(raw)
+        try:
+            await asyncio.gather(_copy(reader, up_writer), _copy(up_reader, writer))
+        finally:
+            up_writer.close()
+
+    def _open_stream(self, target, headers):
+        """Authenticate like the Flask view does, then subscribe (worker thread)."""
+        from .api.misc import open_stream
+        from .auth import current_user
+        cookie = _header(headers, 'cookie') or ''
+        with self.app.test_request_context(target, headers={'Cookie': cookie}):
+            user = current_user()
+            return open_stream(user) if user else None
+
+    async def events(self, target, headers, writer):
+        loop = asyncio.get_running_loop()
+        sub = await loop.run_in_executor(None, self._open_stream, target, headers)
+        if sub is None:
+            body = b'{"error": "Authentication required"}\n'
+            writer.write(_head('HTTP/1.1 401 Unauthorized', [
+                ('Content-Type', 'application/json'), ('Content-Length', str(len(body)))]) + body)
+            await writer.drain()
+            return
+        ready = asyncio.Event()
+        sub.wake = lambda: loop.call_soon_threadsafe(ready.set)
+        ready.set()  # anything delivered before the wake hook was set
+        try:
+            writer.write(_head('HTTP/1.1 200 OK', [
+                ('Content-Type', 'text/event-stream'), ('Cache-Control', 'no-cache'),
+                ('X-Accel-Buffering', 'no'), ('Connection', 'close')]))
+            writer.write(''.join(realtime.stream_preamble(sub)).encode())
+            await writer.drain()
+            while True:
+                ready.clear()
+                while True:
+                    event, due_in = sub.mailbox.poll()
+                    if event is None:
+                        break
+                    writer.write(realtime.sse_frame(event).encode())
+                await writer.drain()
+                try:
+                    await asyncio.wait_for(ready.wait(), due_in or realtime.KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if due_in is None:  # idle, not just waiting out a held hint
+                        writer.write(realtime.KEEPALIVE_FRAME.encode())
+                        await writer.drain()
+        finally:
+            realtime.unsubscribe(sub)
+
+
+def main():
+    if EVENT_BUS != 'table':
+        raise SystemExit('sse_gateway needs EVENT_BUS=table to hear from the gunicorn workers')
+    gateway = Gateway(create_app(background=False), GATEWAY_UPSTREAM)
+
+    async def serve():
+        server = await asyncio.start_server(gateway.handle, '0.0.0.0', PORT,
+                                            limit=HEAD_LIMIT, backlog=1024)
+        print(f'TaskMaster SSE gateway on :{PORT}, API upstream {GATEWAY_UPSTREAM}')
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
@@ -4,11 +4,27 @@ set -e
 echo "Starting TaskMaster v3..."
 cd /app
 
-# Single worker (in-process SSE event bus), many threads for concurrent
-# requests and long-lived event streams.
+# WORKERS > 1 spreads requests over several processes; realtime events then
+# travel between them over the database-backed event bus (EVENT_BUS=table).
+# Many threads per worker for concurrent requests and long-lived event streams.
+WORKERS="${WORKERS:-1}"
+if [ "$WORKERS" -gt 1 ]; then
+    export EVENT_BUS="${EVENT_BUS:-table}"
+fi
+BIND="0.0.0.0:${PORT:-8099}"
+
+# SSE_GATEWAY=1 puts the asyncio gateway on the public port: it holds every
+# /api/events stream on one thread and proxies the API to gunicorn, which
+# then listens on localhost only.
+if [ "${SSE_GATEWAY:-0}" = "1" ]; then
+    export EVENT_BUS=table
+    export GATEWAY_UPSTREAM="${GATEWAY_UPSTREAM:-127.0.0.1:8100}"
+    BIND="$GATEWAY_UPSTREAM"
+    python3 -m backend.sse_gateway &
+fi
 exec gunicorn \
-    --bind "0.0.0.0:${PORT:-8099}" \
-    --workers 1 \
+    --bind "$BIND" \
+    --workers "$WORKERS" \
     --threads 32 \
     --timeout 0 \
     --access-logfile - \
@@ -0,0 +1,73 @@
+"""Shared setup for the bench_*.py scripts: a throwaway (or given) data
+directory, the app without its background threads, a signed-in client and a
+statement counter. The scripts go through the HTTP API and the models only,
+so the same script also runs on an older commit for the "before" figure."""
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_app(data_dir=None):
+    os.environ['DATA_DIR'] = data_dir or tempfile.mkdtemp(prefix='taskmaster-bench-')
+    os.environ.setdefault('EVENT_BUS', 'local')
+    sys.path.insert(0, ROOT)
+    from backend import create_app
+    try:
+        return create_app(background=False)
+    except TypeError:  # trees from before the flag
+        return create_app()
+
+
+def signed_in(app, username='root', password='secret1'):
+    """A client signed in as the super admin, created on a new database."""
+    client = app.test_client()
+    r = client.post('/api/auth/setup', json={'username': username, 'password': password})
+    if r.status_code != 200:
+        r = client.post('/api/auth/login', json={'username': username, 'password': password})
+    assert r.status_code == 200, r.get_json()
+    return client
+
+
+def new_board(client, name='Jobs'):
+    """Id of a new board (default columns and group) in a new company."""
+    company = client.post('/api/companies', json={'name': f'{name} Ltd'}).get_json()['company']
+    dept = client.post(f'/api/companies/{company["id"]}/departments', json={'name': 'Ops'})
+    dept = dept.get_json().get('department', dept.get_json())
+    board = client.post(f'/api/departments/{dept["id"]}/boards', json={'name': name}).get_json()
+    return board.get('board', board)['id']
+
+
+class Statements:
+    """Counts the SQL statements run inside the with-block."""
+
+    def __init__(self, app):
+        self.app = app
+        self.count = 0
+
+    def _seen(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        from sqlalchemy import event
+        from backend.db import db
+        with self.app.app_context():
+            self.engine = db.engine
+        event.listen(self.engine, 'before_cursor_execute', self._seen)
+        return self
+
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+        event.remove(self.engine, 'before_cursor_execute', self._seen)
+
+
+def median_ms(fn, runs=5):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
@@ -0,0 +1,55 @@
+"""Opening a board with many users: time and SQL statements of GET
+/api/boards/<id>, which lists who can be assigned on it.
+
+Seeds a new database with USERS members: a third in the board's company,
+every 7th with a grant on the board, every 11th with a grant on one of its
+jobs. "cold" clears the per-board assignable cache first; "warm" reuses it.
+Run at the parent of the assignable-users change for the before figures.
+
+    python3 scripts/bench_assignable.py [USERS]
+"""
+import sys
+
+from _bench import Statements, make_app, median_ms, new_board, signed_in
+
+
+def main(users=2000):
+    app = make_app()
+    client = signed_in(app)
+    board_id = new_board(client)
+    items = [client.post(f'/api/boards/{board_id}/items', json={'name': f'Job {n}'})
+             .get_json()['item'] for n in range(20)]
+    for parent in items[:5]:
+        client.post(f'/api/boards/{board_id}/items',
+                    json={'name': f'{parent["name"]} check', 'parent_id': parent['id']})
+
+    from backend import permissions as perm
+    from backend.db import db
+    from backend.models import AccessGrant, Board, User
+    with app.app_context():
+        company_id = db.session.get(Board, board_id).company_id
+        db.session.bulk_insert_mappings(User, [
+            dict(username=f'u{k}', display_name=f'User {k}', role='member', is_active=True,
+                 company_id=company_id if k % 3 == 0 else None) for k in range(users)])
+        db.session.commit()
+        ids = [uid for (uid,) in db.session.query(User.id).filter(User.username.like('u%'))]
+        db.session.bulk_insert_mappings(AccessGrant, [
+            dict(user_id=uid, scope_type='board', scope_id=board_id) for uid in ids[1::7]] + [
+            dict(user_id=uid, scope_type='item', scope_id=items[1]['id']) for uid in ids[2::11]])
+        db.session.commit()
+
+    def open_board(cold):
+        if cold and hasattr(perm, 'invalidate_assignable'):
+            perm.invalidate_assignable()
+        assert client.get(f'/api/boards/{board_id}').status_code == 200
+
+    for label, cold in (('cold', True), ('warm', False)):
+        open_board(cold)
+        with Statements(app) as stmts:
+            open_board(cold)
+        ms = median_ms(lambda: open_board(cold))
+        print(f'{users} users, board open {label}: {ms:6.1f} ms, {stmts.count} statements')
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:]))
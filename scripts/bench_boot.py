@@ -0,0 +1,124 @@
+"""Boot time on a large database: create_app on a current database (the
+versioned fast path), and the same boot followed by the chain every boot
+used to run (create_all, then the steps that were ensure_schema, the v2
+import and the v4 data fixes).
+
+Builds BOARDS boards of 1,250 jobs, 8 columns and an activity row per job
+(400 boards: 500k jobs, 4M values, ~1.1 GB) in DATA_DIR, or reuses the
+database already there. Each timing is a new process, as a real boot is.
+
+    python3 scripts/bench_boot.py [BOARDS] [DATA_DIR]
+"""
+import datetime
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from _bench import make_app
+
+ITEMS = 1250
+GROUPS = 4
+COLUMNS = [('Status', 'status'), ('Due date', 'date'), ('Priority', 'status'),
+           ('Notes', 'text'), ('Cost', 'number'), ('Owner', 'people'),
+           ('Details', 'text'), ('Site', 'text')]
+
+
+def build(path, boards):
+    c = sqlite3.connect(path)
+    c.execute('PRAGMA synchronous=OFF')
+    now = datetime.datetime.utcnow().isoformat(' ')
+    labels = json.dumps({'labels': [{'id': f'l{i}', 'label': f'L{i}', 'color': '#000'}
+                                    for i in range(5)]})
+    pad = 'x' * 280
+    company = c.execute("INSERT INTO companies (name, position) VALUES ('Big Ltd', 1)").lastrowid
+    dept = c.execute('INSERT INTO departments (company_id, name, position) VALUES (?, ?, 1)',
+                     (company, 'Ops')).lastrowid
+    for b in range(boards):
+        board = c.execute('INSERT INTO boards (name, position, department_id, company_id, '
+                          'archived, created_at, updated_at) VALUES (?, ?, ?, ?, 0, ?, ?)',
+                          (f'Board {b}', b, dept, company, now, now)).lastrowid
+        cols = [(c.execute('INSERT INTO board_columns (board_id, title, type, settings, position) '
+                           'VALUES (?, ?, ?, ?, ?)', (board, title, ctype, labels, k)).lastrowid,
+                 ctype) for k, (title, ctype) in enumerate(COLUMNS)]
+        groups = [c.execute('INSERT INTO board_groups (board_id, name, position, collapsed) '
+                            'VALUES (?, ?, ?, 0)', (board, f'G{g}', g)).lastrowid
+                  for g in range(GROUPS)]
+        first = (c.execute('SELECT max(id) FROM items').fetchone()[0] or 0) + 1
+        items, values, activity = [], [], []
+        for n in range(ITEMS):
+            iid = first + n
+            items.append((iid, board, groups[n % GROUPS], f'Job {iid}', n, now, now))
+            for cid, ctype in cols:
+                value = {'status': {'label_id': f'l{n % 5}'}, 'date': {'date': '2026-01-01'},
+                         'number': {'number': n}, 'people': {'user_ids': []}}.get(
+                             ctype, {'text': pad})
+                values.append((iid, cid, json.dumps(value)))
+            activity.append((board, iid, company, 'item_created', 'created ' + pad[:120], now))
+        c.executemany('INSERT INTO items (id, board_id, group_id, name, position, created_at, '
+                      'updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)', items)
+        c.executemany('INSERT INTO item_values (item_id, column_id, value) VALUES (?, ?, ?)',
+                      values)
+        c.executemany('INSERT INTO activity (board_id, item_id, company_id, action, description, '
+                      'created_at) VALUES (?, ?, ?, ?, ?, ?)', activity)
+        c.commit()
+    c.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    c.close()
+
+
+def timed_boot(data_dir, legacy):
+    """Seconds for one boot (or one legacy chain) in a new process."""
+    out = subprocess.run([sys.executable, __file__, 'legacy' if legacy else 'boot', data_dir],
+                         check=True, capture_output=True, text=True).stdout
+    return float(out.split()[-1])
+
+
+def boot(data_dir):
+    os.environ['DATA_DIR'] = data_dir  # config.py reads it on import
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import backend.migrations  # noqa: F401  (imports are not part of the boot)
+    start = time.perf_counter()
+    make_app(data_dir)
+    print(time.perf_counter() - start)
+
+
+def legacy(data_dir):
+    os.environ['DATA_DIR'] = data_dir  # config.py reads it on import
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from backend.db import db
+    from backend.migrations import MIGRATIONS
+    start = time.perf_counter()
+    app = make_app(data_dir)
+    with app.app_context():
+        db.create_all()
+        for version, step in MIGRATIONS[:3]:
+            step()
+        print(time.perf_counter() - start)
+
+
+def main(boards=400, data_dir=None):
+    data_dir = data_dir or tempfile.mkdtemp(prefix='taskmaster-bench-')
+    path = os.path.join(data_dir, 'taskmaster.db')
+    if not os.path.exists(path):
+        make_app(data_dir)  # a current, empty database
+        start = time.perf_counter()
+        build(path, int(boards))
+        print(f'built {boards} boards in {time.perf_counter() - start:.0f}s')
+        timed_boot(data_dir, False)  # the first boot after the bulk load is not timed
+    print(f'{data_dir}: {os.path.getsize(path) / 1e9:.2f} GB')
+    for label, is_legacy in (('current database, fast path', False),
+                             ('legacy chain (every boot before)', True)):
+        times = sorted(timed_boot(data_dir, is_legacy) for _ in range(3))
+        print(f'{label:34} {times[0]:.2f}-{times[-1]:.2f} s')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['boot']:
+        boot(sys.argv[2])
+    elif sys.argv[1:2] == ['legacy']:
+        legacy(sys.argv[2])
+    else:
+        main(*sys.argv[1:])
@@ -0,0 +1,81 @@
+"""SQLite under write contention: WRITERS threads each commit TX
+transactions (add an update to a job, rename another) while READERS threads
+keep loading a 300-job board through the API. Prints write throughput,
+latency, the board reads served meanwhile (WAL keeps serving them during
+writes; a rollback journal blocks them) and the transactions that failed
+("database is locked", pool timeout).
+
+The connection settings come from config.py, so the same script measures
+the settings before the SQLite tuning change:
+
+    python3 scripts/bench_sqlite_writes.py [WRITERS] [READERS] [TX]
+    SQLITE_JOURNAL_MODE=DELETE SQLITE_SYNCHRONOUS=FULL SQLITE_BUSY_TIMEOUT_MS=5000 \\
+        DB_POOL_SIZE=5 DB_MAX_OVERFLOW=10 python3 scripts/bench_sqlite_writes.py
+"""
+import os
+import sys
+import threading
+import time
+
+from _bench import make_app, new_board, signed_in
+
+
+def main(writers=16, readers=8, tx=60):
+    app = make_app()
+    board_id = new_board(signed_in(app))
+
+    from backend.db import db
+    from backend.models import BoardGroup, Item, ItemUpdate, User
+    with app.app_context():
+        group = BoardGroup.query.filter_by(board_id=board_id).first()
+        db.session.add_all(Item(board_id=board_id, group_id=group.id, name=f'Job {k}', position=k)
+                           for k in range(300))
+        db.session.commit()
+        ids = [iid for (iid,) in db.session.query(Item.id).filter_by(board_id=board_id)]
+        uid = User.query.first().id
+
+    errors, latencies, reads = [], [], [0]
+    stop = threading.Event()
+
+    def write(n):
+        for k in range(tx):
+            start = time.perf_counter()
+            try:
+                with app.app_context():
+                    db.session.add(ItemUpdate(item_id=ids[(n * tx + k) % len(ids)], user_id=uid,
+                                              body='x' * 200))
+                    db.session.get(Item, ids[k % len(ids)]).name = f'Job {n}-{k}'
+                    db.session.commit()
+            except Exception as e:  # the failures are what this measures
+                errors.append(type(e).__name__)
+            latencies.append(time.perf_counter() - start)
+
+    def read():
+        client = signed_in(app)
+        while not stop.is_set():
+            if client.get(f'/api/boards/{board_id}').status_code == 200:
+                reads[0] += 1
+            else:
+                errors.append('read')
+
+    threads = ([threading.Thread(target=read) for _ in range(readers)]
+               + [threading.Thread(target=write, args=(n,)) for n in range(writers)])
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads[readers:]:
+        t.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for t in threads[:readers]:
+        t.join()
+    latencies.sort()
+    print(f'journal {os.environ.get("SQLITE_JOURNAL_MODE", "default")}: '
+          f'{writers * tx} write tx in {elapsed:.2f}s = {writers * tx / elapsed:.0f} tx/s, '
+          f'p50 {latencies[len(latencies) // 2] * 1000:.0f} ms, '
+          f'p99 {latencies[int(len(latencies) * .99)] * 1000:.0f} ms, '
+          f'{reads[0]} board reads, {len(errors)} failed {sorted(set(errors))}')
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:]))
@@ -0,0 +1,54 @@
+"""Shared fixtures. The backend reads its settings from the environment at
+import, so this module points it at a throwaway DATA_DIR (fresh SQLite
+database) before anything imports it, and runs no background threads: tests
+drive the queues themselves.
+
+    pip install pytest        # plus pgserver for the PostgreSQL tests
+    python -m pytest tests
+"""
+import os
+import tempfile
+
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='taskmaster-test-')
+os.environ.pop('DATABASE_URL', None)
+os.environ['EVENT_BUS'] = 'local'
+
+import pytest  # noqa: E402
+
+from backend import create_app  # noqa: E402
+from backend.db import db  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    app = create_app(background=False)
+    app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture(scope='session')
+def client(app):
+    """A client signed in as the super admin."""
+    client = app.test_client()
+    r = client.post('/api/auth/setup', json={'username': 'root', 'password': 'secret1'})
+    assert r.status_code == 200, r.get_json()
+    return client
+
+
+@pytest.fixture
+def board(client):
+    """A fresh board (with the default columns) in a fresh company."""
+    company = client.post('/api/companies', json={'name': 'Acme'}).get_json()['company']
+    dept = client.post(f'/api/companies/{company["id"]}/departments', json={'name': 'Ops'})
+    dept = dept.get_json().get('department', dept.get_json())
+    created = client.post(f'/api/departments/{dept["id"]}/boards', json={'name': 'Jobs'})
+    assert created.status_code == 201, created.get_json()
+    created = created.get_json()
+    return client.get(f'/api/boards/{created.get("board", created)["id"]}').get_json()
+
+
+@pytest.fixture
+def session(app):
+    with app.app_context():
+        yield db.session
+        db.session.rollback()
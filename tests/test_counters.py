@@ -0,0 +1,28 @@
+"""Per-board counters stay equal to a recount from the live tables."""
+from backend import counters
+from backend.db import db
+from backend.models import BoardCounter
+
+
+def _counts(app, board_id):
+    with app.app_context():
+        row = db.session.get(BoardCounter, board_id)
+        live = {c: getattr(row, c) for c in counters.COUNTERS}
+        counters.recount(db.session.connection(), [board_id])
+        db.session.expire_all()
+        row = db.session.get(BoardCounter, board_id)
+        assert live == {c: getattr(row, c) for c in counters.COUNTERS}
+        db.session.rollback()
+        return live
+
+
+def test_updates_shift_the_count(app, client, board):
+    board_id = board['board']['id']
+    item = client.post(f'/api/boards/{board_id}/items', json={'name': 'Boiler'}).get_json()['item']
+    assert _counts(app, board_id)['updates'] == 0
+    posted = [client.post(f'/api/items/{item["id"]}/updates', json={'body': f'note {n}'})
+              .get_json()['update'] for n in range(3)]
+    assert _counts(app, board_id)['updates'] == 3
+    assert client.delete(f'/api/updates/{posted[0]["id"]}').status_code == 200
+    assert _counts(app, board_id) == {'jobs': 1, 'tasks': 0, 'done': 0, 'overdue': 0,
+                                      'updates': 2, 'files': 0}
@@ -0,0 +1,127 @@
+"""The email outbox against an in-process SMTP stand-in."""
+import socketserver
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend import emailer
+from backend.models import EmailOutbox
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """Just enough SMTP (EHLO, AUTH, MAIL, RCPT, DATA, RSET, QUIT) to take
+    messages, counting connections and logins; `refuse` holds recipients
+    it answers with 550."""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _Session)
+        self.connections = 0
+        self.logins = 0
+        self.delivered = []  # recipient per message
+        self.refuse = set()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+class _Session(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self.reply('220 stand-in')
+        rcpt = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd = line.decode().strip()
+            verb = cmd.split(' ', 1)[0].split(':', 1)[0].upper()
+            if verb == 'EHLO':
+                self.reply('250-stand-in')
+                self.reply('250 AUTH PLAIN LOGIN')
+            elif verb == 'AUTH':
+                server.logins += 1
+                self.reply('235 ok')
+            elif verb == 'RCPT':
+                addr = cmd.split(':', 1)[1].strip(' <>')
+                if addr in server.refuse:
+                    self.reply('550 no such user')
+                else:
+                    rcpt.append(addr)
+                    self.reply('250 ok')
+            elif verb == 'DATA':
+                self.reply('354 go on')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                server.delivered += rcpt
+                rcpt = []
+                self.reply('250 ok')
+            elif verb == 'RSET':
+                rcpt = []
+                self.reply('250 ok')
+            elif verb == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:  # HELO, MAIL, NOOP
+                self.reply('250 ok')
+
+
+@pytest.fixture
+def smtp(session):
+    server = SMTPStandIn()
+    saved = emailer.get_config()
+    emailer.save_config({'enabled': True, 'host': '127.0.0.1', 'port': server.server_address[1],
+                         'security': 'none', 'username': 'tm', 'password': 'pw',
+                         'from_addr': 'taskmaster@example.com'})
+    session.commit()
+    yield server
+    EmailOutbox.query.delete()
+    emailer.save_config(saved)
+    session.commit()
+    server.shutdown()
+    server.server_close()
+
+
+def test_batch_shares_one_connection(smtp, session):
+    emailer.queue_many([(f'user{n}@example.com', 'Hi', 'Body') for n in range(12)])
+    session.commit()
+    connection = emailer._Connection()
+    emailer.drain(connection)
+    emailer.queue('late@example.com', 'Hi', 'Body')  # the next batch reuses it too
+    session.commit()
+    emailer.drain(connection)
+    connection.close()
+    assert len(smtp.delivered) == 13
+    assert (smtp.connections, smtp.logins) == (1, 1)
+    assert EmailOutbox.query.count() == 0
+
+
+def test_failed_send_waits_in_the_outbox_then_goes_out(smtp, session):
+    smtp.refuse = {'bounce@example.com'}
+    emailer.queue_many([('ok@example.com', 'Hi', 'Body'), ('bounce@example.com', 'Hi', 'Body')])
+    session.commit()
+    before = datetime.utcnow()
+    emailer.drain()
+    assert smtp.delivered == ['ok@example.com']
+    row = EmailOutbox.query.one()
+    assert (row.to_addr, row.status, row.attempts) == ('bounce@example.com', 'pending', 1)
+    assert '550' in row.last_error
+    assert row.run_after >= before + timedelta(seconds=emailer.RETRY_SECONDS)
+    assert emailer.drain() == 0  # not due yet
+
+    smtp.refuse = set()
+    row.run_after = datetime.utcnow()  # the backoff has run out
+    session.commit()
+    emailer.drain()
+    assert smtp.delivered == ['ok@example.com', 'bounce@example.com']
+    assert EmailOutbox.query.count() == 0
+
+
+def test_nothing_is_queued_when_the_transaction_rolls_back(smtp, session):
+    emailer.queue('nobody@example.com', 'Hi', 'Body')
+    session.rollback()
+    assert EmailOutbox.query.count() == 0
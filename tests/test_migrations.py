@@ -0,0 +1,32 @@
+"""Startup migrations: every step does its own work, and a database from an
+older release catches up."""
+import pytest
+from sqlalchemy import inspect, text
+
+from backend import migrations
+from backend.db import db
+from backend.models import AppSetting, BoardCounter, DeferredWork, EmailOutbox
+
+
+@pytest.mark.parametrize('step, model', [
+    (migrations._board_counters, BoardCounter),
+    (migrations._deferred_work, DeferredWork),
+    (migrations._email_outbox, EmailOutbox),
+])
+def test_table_steps_create_their_tables(session, step, model):
+    table = model.__tablename__
+    session.execute(text(f'DROP TABLE {table}'))
+    session.commit()
+    step()
+    insp = inspect(db.engine)
+    assert table in insp.get_table_names()
+    assert {i.name for i in model.__table__.indexes} <= {i['name'] for i in insp.get_indexes(table)}
+
+
+def test_an_older_database_gets_the_newer_columns(session):
+    session.execute(text('ALTER TABLE users DROP COLUMN digest_last_id'))
+    AppSetting.set_json(migrations.VERSION_KEY, 10)
+    session.commit()
+    migrations.run_migrations()
+    assert 'digest_last_id' in {c['name'] for c in inspect(db.engine).get_columns('users')}
+    assert migrations.schema_version() == migrations.LATEST
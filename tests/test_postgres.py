@@ -0,0 +1,83 @@
+"""The models, migrations and the main write paths on PostgreSQL.
+
+Runs against TEST_DATABASE_URL when set (an empty, disposable database), or
+else a throwaway local server from the `pgserver` package; skipped when
+neither is available. The checks run in a child process, since the backend
+picks its database at import time.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+
+def _database_url():
+    url = os.environ.get('TEST_DATABASE_URL')
+    if url:
+        return url, None
+    pgserver = pytest.importorskip('pgserver')
+    pytest.importorskip('psycopg')
+    data = tempfile.mkdtemp(prefix='taskmaster-pg-')
+    server = pgserver.get_server(data, cleanup_mode='stop')
+    bin_dir = os.path.join(os.path.dirname(pgserver.__file__), 'pginstall', 'bin')
+    return server.get_uri(), (server, bin_dir)
+
+
+def test_postgres_backend():
+    url, local = _database_url()
+    env = dict(os.environ, DATABASE_URL=url, DATA_DIR=tempfile.mkdtemp(),
+               EVENT_BUS='local', PYTHONPATH=os.path.dirname(os.path.dirname(__file__)))
+    if local:
+        env['PATH'] = local[1] + os.pathsep + env['PATH']  # pg_dump for the backup
+    try:
+        done = subprocess.run([sys.executable, __file__], env=env, capture_output=True,
+                              text=True, timeout=600)
+    finally:
+        if local:
+            local[0].cleanup()
+    assert done.returncode == 0, done.stdout + done.stderr
+
+
+def _run():
+    from backend import create_app
+    from backend.db import db
+    from backend.migrations import LATEST, schema_version
+    from backend.models import BoardChange, BoardCounter, Item
+    from backend.scheduler import run_backup
+
+    app = create_app(background=False)
+    app.config['TESTING'] = True
+    with app.app_context():
+        assert db.engine.dialect.name == 'postgresql'
+        assert schema_version() == LATEST
+    create_app(background=False)  # a second boot finds the schema current
+
+    c = app.test_client()
+    assert c.post('/api/auth/setup', json={'username': 'root', 'password': 'secret1'}).status_code == 200
+    company = c.post('/api/companies', json={'name': 'Acme'}).get_json()['company']
+    dept = c.post(f'/api/companies/{company["id"]}/departments', json={'name': 'Ops'}).get_json()
+    dept = dept.get('department', dept)
+    created = c.post(f'/api/departments/{dept["id"]}/boards', json={'name': 'Jobs'}).get_json()
+    board = c.get(f'/api/boards/{created.get("board", created)["id"]}').get_json()
+    status = next(col for col in board['columns'] if col['type'] == 'status')
+    done = next(l['id'] for l in status['settings']['labels'] if l['label'].lower() == 'done')
+    item = c.post(f'/api/boards/{board["board"]["id"]}/items', json={'name': 'Fix the printer'}).get_json()['item']
+    r = c.put(f'/api/items/{item["id"]}/values/{status["id"]}', json={'value': {'id': done}})
+    assert r.status_code == 200, r.get_json()
+    overview = c.get('/api/overview-items?limit=10').get_json()
+    assert [i['name'] for i in overview['items']] == ['Fix the printer']
+
+    with app.app_context():
+        assert db.session.get(Item, item['id']).done is True
+        counter = db.session.get(BoardCounter, board['board']['id'])
+        assert (counter.jobs, counter.done) == (1, 1)
+        assert BoardChange.query.filter_by(board_id=board['board']['id'], row_id=item['id']).count()
+        if shutil.which('pg_dump'):
+            assert os.path.getsize(run_backup()) > 0
+
+
+if __name__ == '__main__':
+    _run()
@@ -0,0 +1,63 @@
+"""The hot job-list queries read an index, never the whole items table.
+Each request's statements are captured and run again under EXPLAIN QUERY
+PLAN."""
+import re
+
+import pytest
+from sqlalchemy import event
+
+from backend.db import db
+from backend.models import User
+
+FULL_SCAN = re.compile(r'SCAN items( AS \w+)?$')
+
+
+@pytest.fixture
+def plans(app, client, board):
+    """plans(url) -> the query plans of the statements on items that the
+    request ran, one list of plan lines per statement."""
+    people = next(c for c in board['columns'] if c['type'] == 'people')
+    with app.app_context():
+        root = User.query.filter_by(username='root').one().id
+    for n in range(3):
+        item = client.post(f'/api/boards/{board["board"]["id"]}/items',
+                           json={'name': f'Pump service {n}'}).get_json()['item']
+        client.put(f'/api/items/{item["id"]}/values/{people["id"]}',
+                   json={'value': {'user_ids': [root]}})
+
+    def run(url):
+        seen = []
+        with app.app_context():
+            def capture(conn, cursor, statement, params, context, executemany):
+                if 'FROM items' in statement and not statement.startswith('EXPLAIN'):
+                    seen.append((statement, params))
+            event.listen(db.engine, 'before_cursor_execute', capture)
+            try:
+                r = client.get(url)
+                assert r.status_code == 200, r.get_data(as_text=True)
+                r.get_data()
+                r.close()
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', capture)
+            conn = db.engine.raw_connection()
+            try:
+                return [[row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + s, p)]
+                        for s, p in seen]
+            finally:
+                conn.close()
+    return run
+
+
+@pytest.mark.parametrize('url, index', [
+    ('/api/overview-items?limit=50', 'idx_items_updated'),
+    ('/api/overview-items?limit=50&sort=due', 'idx_items_due'),
+    ('/api/overview-items?limit=50&sort=name', 'idx_items_name'),
+    ('/api/my-work?limit=50', 'idx_assignees_user'),
+    ('/api/search?q=pump', 'search_items VIRTUAL TABLE INDEX'),
+])
+def test_hot_queries_use_an_index(plans, url, index):
+    found = plans(url)
+    assert found, 'no statement on items'
+    for lines in found:
+        assert not [line for line in lines if FULL_SCAN.match(line)], lines
+    assert any(index in line for lines in found for line in lines), found
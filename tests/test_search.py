@@ -0,0 +1,46 @@
+"""/api/search against the FTS5 index: bounded ranking and the bulk writes
+that skip the flush."""
+from backend import search as fts
+
+
+def _add(client, board, name):
+    r = client.post(f'/api/boards/{board["board"]["id"]}/items', json={'name': name})
+    assert r.status_code == 201, r.get_json()
+    return r.get_json()['item']
+
+
+def _search(client, q):
+    r = client.get('/api/search', query_string={'q': q})
+    assert r.status_code == 200, r.get_json()
+    return r.get_json()
+
+
+def test_names_rank_before_other_text(client, board):
+    named = _add(client, board, 'Replace the quokka filter')
+    other = _add(client, board, 'Monthly service')
+    client.post(f'/api/items/{other["id"]}/updates', json={'body': 'quokka filter was dusty'})
+    ids = [i['id'] for i in _search(client, 'quokka')['items']]
+    assert ids == [named['id'], other['id']]
+
+
+def test_common_words_rank_only_the_newest_matches(client, board, monkeypatch):
+    monkeypatch.setattr(fts, 'RANK_WINDOW', 3)
+    items = [_add(client, board, f'Wombat check {n}') for n in range(5)]
+    found = _search(client, 'wombat')
+    assert found['truncated']
+    assert {i['id'] for i in found['items']} == {i['id'] for i in items[2:]}
+    # another word brings the match set back under the window
+    found = _search(client, 'wombat 0')
+    assert not found['truncated']
+    assert [i['id'] for i in found['items']] == [items[0]['id']]
+
+
+def test_dropping_a_column_drops_its_text_from_the_index(client, board):
+    item = _add(client, board, 'Gate repair')
+    col = client.post(f'/api/boards/{board["board"]["id"]}/columns',
+                      json={'type': 'text', 'title': 'Notes'}).get_json()['column']
+    client.put(f'/api/items/{item["id"]}/values/{col["id"]}', json={'value': {'text': 'numbat hinge'}})
+    assert [i['id'] for i in _search(client, 'numbat')['items']] == [item['id']]
+    assert client.delete(f'/api/columns/{col["id"]}').status_code == 200
+    assert _search(client, 'numbat')['items'] == []
+    assert [i['id'] for i in _search(client, 'gate repair')['items']] == [item['id']]